@@ -1,7 +1,18 @@
 import math
+import time
 
 import musicbrainzngs
 
+from .scheduler import get_scheduler
+
+# Maximum number of recordings that MusicBrainz accepts in a single request to
+# add or remove recordings from a collection
+COLLECTION_CHUNK_SIZE = 400
+# Number of times a failed request is retried, and the delay before the first
+# retry in seconds. The delay doubles after each retry.
+MAX_RETRIES = 3
+RETRY_DELAY = 5.0
+
 
 def star_to_hundred_rating(rating: int):
     """
@@ -13,40 +24,137 @@ def star_to_hundred_rating(rating: int):
     return math.floor(rating * 20)
 
 
+def chunks(items: list, size: int):
+    """Splits items into consecutive lists of at most size items."""
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def is_transient_error(error: musicbrainzngs.WebServiceError) -> bool:
+    """Network errors and server errors are worth retrying, client errors such
+    as a bad MBID or missing authentication are not."""
+    if isinstance(error, musicbrainzngs.NetworkError):
+        return True
+
+    code = getattr(getattr(error, "cause", None), "code", None)
+    return isinstance(error, musicbrainzngs.ResponseError) and (code or 0) >= 500
+
+
+def call_with_retry(
+    name: str,
+    function,
+    *args,
+    retries: int = MAX_RETRIES,
+    retry_delay: float = RETRY_DELAY,
+):
+    """Makes a rate limited call, retrying it with exponential backoff if it
+    failed with a transient error. Returns the response and the number of
+    attempts that were made. Only use this for requests that can safely be
+    sent more than once."""
+    for attempt in range(retries + 1):
+        try:
+            return get_scheduler().call(name, function, *args), attempt + 1
+        except musicbrainzngs.WebServiceError as e:
+            if attempt == retries or not is_transient_error(e):
+                raise
+
+            delay = retry_delay * 2**attempt
+            print(f"{name}: {e}, retrying in {delay:.0f}s.")
+            time.sleep(delay)
+
+
+def modify_collection(
+    name: str,
+    function,
+    collection: str,
+    recordings: list[str],
+    retries: int = MAX_RETRIES,
+    retry_delay: float = RETRY_DELAY,
+):
+    """Sends recordings to a collection endpoint in batches of the largest size
+    that MusicBrainz accepts. Adding or removing the same recordings twice has
+    no further effect, so a batch that failed is simply sent again."""
+    for chunk in chunks(list(recordings), COLLECTION_CHUNK_SIZE):
+        path = "collection/%s/recordings/%s" % (collection, ";".join(chunk))
+        call_with_retry(name, function, path, retries=retries, retry_delay=retry_delay)
+
+
 def add_recordings_to_collection(collection, recordings_to_add=[]):
-    # We don't need to do anything
-    if len(recordings_to_add) == 0:
-        return
+    modify_collection(
+        "add_recordings_to_collection",
+        musicbrainzngs.musicbrainz._do_mb_put,  # type: ignore
+        collection,
+        recordings_to_add,
+    )
+
+
+def remove_recordings_from_collection(collection, recordings_to_remove=[]):
+    modify_collection(
+        "remove_recordings_from_collection",
+        musicbrainzngs.musicbrainz._do_mb_delete,  # type: ignore
+        collection,
+        recordings_to_remove,
+    )
+
 
-    if len(recordings_to_add) >= 50:
-        first_part = recordings_to_add[:50]
-        assert len(first_part) == 50
-        second_part = recordings_to_add[50:]
-        assert len(first_part) + len(second_part) == len(recordings_to_add)
+class CollectionChanges:
+    """The recordings that need to be added to and removed from a collection."""
 
-        recording_list = ";".join(first_part)
+    def __init__(self, rating: int, collection: str):
+        self.rating = rating
+        self.collection = collection
+        self.add: list[str] = []
+        self.remove: list[str] = []
 
-        musicbrainzngs.musicbrainz._do_mb_put(  # type: ignore
-            "collection/%s/recordings/%s" % (collection, recording_list)
+    def __repr__(self):
+        return (
+            f"CollectionChanges: {self.rating} Star +{len(self.add)} "
+            f"-{len(self.remove)} -> {self.collection}"
         )
-        return add_recordings_to_collection(collection, second_part)
 
-    recording_list = ";".join(recordings_to_add)
-    return musicbrainzngs.musicbrainz._do_mb_put(  # type: ignore
-        "collection/%s/recordings/%s" % (collection, recording_list)
-    )
 
+def plan_collection_changes(
+    ratings: dict[str, int],
+    collections: dict[int, str],
+    members: dict[int, set[str]],
+    keep: set[str] = set(),
+) -> list[CollectionChanges]:
+    """Computes the smallest set of changes that puts every recording in the
+    collection for its rating. ratings maps each mbid to its rating,
+    collections maps each rating to the mbid of its star collection and members
+    holds the recordings currently in each of those collections. Recordings
+    that aren't in ratings are never removed, since the collections may hold
+    recordings that aren't in the library. A recording whose rating changed is
+    added to its new collection and removed from the old one, unless it's in
+    keep."""
+    plan = []
 
-def remove_recordings_from_collection(collection, recordings_to_add=[]):
-    # We don't need to do anything
-    if len(recordings_to_add) == 0:
-        return
+    for rating, collection in sorted(collections.items()):
+        current = members.get(rating, set())
+        changes = CollectionChanges(rating, collection)
+        changes.add = sorted(
+            mbid
+            for mbid, new_rating in ratings.items()
+            if new_rating == rating and mbid not in current
+        )
+        changes.remove = sorted(
+            mbid
+            for mbid in current
+            if mbid in ratings and ratings[mbid] != rating and mbid not in keep
+        )
 
-    # TODO: Break the array into chunks if it's greater than size 400
-    if len(recordings_to_add) >= 400:
-        raise ValueError("Cannot remove more than 400 recordings at a time.")
+        if changes.add or changes.remove:
+            plan.append(changes)
 
-    recording_list = ";".join(recordings_to_add)
-    return musicbrainzngs.musicbrainz._do_mb_delete(  # type: ignore
-        "collection/%s/recordings/%s" % (collection, recording_list)
-    )
+    return plan
+
+
+def apply_collection_changes(plan: list[CollectionChanges]):
+    """Makes the changes in a plan. Recordings are added to their new collection
+    before they are removed from the old one, so a failure part way through
+    never leaves a recording without a collection."""
+    for changes in plan:
+        add_recordings_to_collection(changes.collection, changes.add)
+
+    for changes in plan:
+        remove_recordings_from_collection(changes.collection, changes.remove)
@@ -31,4 +31,5 @@ def init_musicbrainzngs():
     user, password = load_musicbrainz_credentials()
     musicbrainzngs.auth(user, password)
     musicbrainzngs.set_useragent(user_agent, version, contact)
-    musicbrainzngs.set_rate_limit(limit_or_interval=1.0, new_requests=1)
+    # The shared scheduler enforces the rate limit
+    musicbrainzngs.set_rate_limit(False)
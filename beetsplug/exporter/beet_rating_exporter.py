@@ -1,22 +1,42 @@
+import time
 from logging import getLogger
 
 from beets import dbcore
+from beets.library import Item
 
+from ..library_index import LibraryIndex
 from ..matcher import RecordingMatcher
 from ..rating_store import RatingStore, RatingStoreExporter
+from ..recording import RecordingInfo
+from ..stats import get_stats
 
 
 class BeetRatingExporter(RatingStoreExporter):
-    def __init__(self, library):
+    def __init__(
+        self,
+        library,
+        index: LibraryIndex | None = None,
+        chunk_size: int = 0,
+        dry_run: bool = False,
+    ):
         self.library = library
+        self.index = index
+        # Number of songs to store per library transaction. If zero, all of the
+        # songs are stored in a single transaction.
+        self.chunk_size = chunk_size
+        # If set, compute the changes but don't write anything to the library
+        self.dry_run = dry_run
+        # The changes computed by the last export, as (song, recording) pairs
+        self.changes: list[tuple[Item, RecordingInfo]] = []
 
     def export_songs(self, rating_store: RatingStore):
         found_count = 0
         missing_count = 0
 
-        matcher = RecordingMatcher(self.library, getLogger("beets"))
+        matcher = RecordingMatcher(self.library, getLogger("beets"), self.index)
 
         # Find all of the existing ratings in the library
+        get_stats().record_library_query()
         beet_existing_ratings = self.library.items(
             dbcore.query.RegexpQuery("rating", r"\d", False)
         )
@@ -43,6 +63,7 @@ class BeetRatingExporter(RatingStoreExporter):
 
         print(f"Found {len(unrated_songs)} unrated songs...")
 
+        recordings = []
         for unrated_song in unrated_songs:
             recording = rating_store.ratings.get(unrated_song, None)
 
@@ -50,23 +71,65 @@ class BeetRatingExporter(RatingStoreExporter):
                 print(f"Missing recording: {unrated_song} from ratings library.")
                 continue
 
-            song = matcher.match(recording)
+            recordings.append(recording)
 
-            # We found a song and have a rating to update
-            if song and recording.rating != 0:
-                song["rating"] = int(recording.rating)
+        # Resolve all of the recordings at once rather than querying the
+        # library for each one
+        matches = matcher.match_all(recordings)
 
-                # If we have an MBID, update it. This will ensure we don't have to update
-                # the same song multiple times.
-                if recording.mbid:
-                    song["mb_trackid"] = recording.mbid
+        self.changes = []
+        for recording in recordings:
+            song = matches.get(recording.mbid, None)
 
-                song.store()
+            # We found a song and have a rating to update
+            if song and recording.rating != 0:
+                self.changes.append((song, recording))
                 found_count += 1
-                print(f"Added rating: {recording.title} --- {recording.rating}")
-
             else:
                 print(f"Missing Song: {0} --- {1}", recording.artist, recording.title)
                 missing_count += 1
 
+        if self.dry_run:
+            for song, recording in self.changes:
+                print(
+                    f"Would add rating: {recording.title} --- {recording.rating} "
+                    f"(was {song.get('rating', 'unrated')})"
+                )
+        else:
+            self.store_changes()
+
         return (found_count, missing_count)
+
+    def store_changes(self):
+        """Writes all of the computed changes to the library. Songs are grouped
+        into transactions so that we don't commit once per song."""
+        if len(self.changes) == 0:
+            return
+
+        chunk_size = self.chunk_size if self.chunk_size > 0 else len(self.changes)
+        start = time.perf_counter()
+
+        for offset in range(0, len(self.changes), chunk_size):
+            with self.library.transaction():
+                for song, recording in self.changes[offset : offset + chunk_size]:
+                    song["rating"] = int(recording.rating)
+
+                    # If we have an MBID, update it. This will ensure we don't have
+                    # to update the same song multiple times.
+                    if recording.mbid:
+                        old_mbid = song.mb_trackid
+                        song["mb_trackid"] = recording.mbid
+
+                        # Keep the index in step with the library
+                        if self.index:
+                            self.index.update_mbid(song, old_mbid)
+
+                    song.store()
+                    print(f"Added rating: {recording.title} --- {recording.rating}")
+
+        runtime = time.perf_counter() - start
+        rate = len(self.changes) / runtime if runtime > 0 else 0
+        print(
+            f"Stored {len(self.changes)} ratings in {runtime:.2f}s "
+            f"({rate:.1f} ratings/s)"
+        )
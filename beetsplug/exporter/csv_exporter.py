@@ -1,34 +1,177 @@
 import csv
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import islice
 
 from ..rating_store import RatingStore, RatingStoreExporter
+from ..recording import RecordingInfo
 
 
 class CSVExporter(RatingStoreExporter):
-    def __init__(self, file_name):
+    FIELD_NAMES = ["rating", "artist", "album", "title", "length", "mbid"]
+    # Size of the buffer used when writing the file, in bytes
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, file_name, chunk_size=100_000, dry_run=False):
         self.file_name = file_name  # type: ignore
+        # If set, check whether the ratings changed but don't write the file
+        self.dry_run = dry_run
+        # Ratings are sorted in runs of chunk_size that are merged while the
+        # file is written, so the whole rating store is never sorted at once
+        self.chunk_size = chunk_size
+        # Whether the last export changed the file. The file is only written
+        # if the ratings differ from the last export.
+        self.changed: bool | None = None
 
-    def export_songs(self, rating_store: RatingStore):
+    @staticmethod
+    def sort_key(row: list):
         # We sort by rating, then artist, then album, then title
         # Note that we want the ratings to be descending but everything else
-        # ascending, hence why we use -k.rating
-        recordings = sorted(
-            rating_store.ratings.values(),
-            key=lambda k: (-k.rating, k.artist, k.album, k.title),
-        )
+        # ascending, hence why we use -rating
+        return (-int(row[0]), row[1], row[2], row[3])
+
+    @staticmethod
+    def to_row(recording: RecordingInfo) -> list:
+        return [
+            recording.rating,
+            recording.artist,
+            recording.album,
+            recording.title,
+            recording.length,
+            recording.mbid,
+        ]
+
+    def export_songs(self, rating_store: RatingStore):
+        start = time.perf_counter()
+
+        with self.sorted_rows(rating_store) as rows:
+            digest = self.digest(rows())
+            self.changed = digest != self.load_digest()
+
+            if not self.changed:
+                print(f"Ratings in {self.file_name} are unchanged, skipping export.")
+                return
 
-        with open(self.file_name, "w") as output_file:
-            field_names = ["rating", "artist", "album", "title", "length", "mbid"]
-            csv_writer = csv.DictWriter(output_file, fieldnames=field_names)
-            csv_writer.writeheader()
-
-            for recording in recordings:
-                csv_writer.writerow(
-                    {
-                        "rating": recording.rating,
-                        "artist": recording.artist,
-                        "album": recording.album,
-                        "title": recording.title,
-                        "length": recording.length,
-                        "mbid": recording.mbid,
-                    }
+            if self.dry_run:
+                print(
+                    f"Would export {len(rating_store.ratings)} ratings to "
+                    f"{self.file_name}."
                 )
+                return
+
+            # Write to a temporary file first and then rename it so that the
+            # ratings file is never left partially written
+            temp_path = f"{self.file_name}.tmp"
+            with open(
+                temp_path, "w", newline="", buffering=self.BUFFER_SIZE
+            ) as output_file:
+                csv_writer = csv.writer(output_file)
+                csv_writer.writerow(self.FIELD_NAMES)
+                csv_writer.writerows(rows())
+
+        os.replace(temp_path, self.file_name)
+        self.save_digest(digest)
+
+        elapsed = time.perf_counter() - start
+        count = len(rating_store.ratings)
+        print(
+            f"Exported {count} ratings to {self.file_name} in {elapsed:.1f}s "
+            f"({count / max(elapsed, 1e-9):.0f} rows/sec)"
+        )
+
+    def get_digest_path(self):
+        return f"{self.file_name}.sha256"
+
+    def digest(self, rows) -> str:
+        """The digest of the file that would be written for rows."""
+        digest = hashlib.sha256()
+        csv_writer = csv.writer(HashWriter(digest))
+        csv_writer.writerow(self.FIELD_NAMES)
+        csv_writer.writerows(rows)
+        return digest.hexdigest()
+
+    def file_signature(self) -> list | None:
+        if not os.path.exists(self.file_name):
+            return None
+
+        stat = os.stat(self.file_name)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def load_digest(self) -> str | None:
+        """The digest of the last export, unless the file was changed or removed
+        since then."""
+        try:
+            with open(self.get_digest_path(), "r") as f:
+                saved = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if saved.get("signature") != self.file_signature():
+            return None
+        return saved.get("digest")
+
+    def save_digest(self, digest: str):
+        with open(self.get_digest_path(), "w") as f:
+            json.dump({"digest": digest, "signature": self.file_signature()}, f)
+
+    @contextmanager
+    def sorted_rows(self, rating_store: RatingStore):
+        """Provides a function that returns the rows of every rating in sorted
+        order, and can be called more than once. If there are more than
+        chunk_size ratings, each chunk is sorted and written to a temporary run
+        file, and the runs are merged as the rows are read."""
+        recordings = iter(rating_store.ratings.values())
+
+        if len(rating_store.ratings) <= self.chunk_size:
+            rows = sorted(map(self.to_row, recordings), key=self.sort_key)
+            yield lambda: iter(rows)
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.file_name))
+        with tempfile.TemporaryDirectory(dir=directory) as run_directory:
+            runs = self.write_runs(recordings, run_directory)
+            yield lambda: self.merge_runs(runs)
+
+    def write_runs(self, recordings, run_directory: str) -> list[str]:
+        runs = []
+        while True:
+            chunk = sorted(
+                map(self.to_row, islice(recordings, self.chunk_size)),
+                key=self.sort_key,
+            )
+            if not chunk:
+                break
+
+            run_path = os.path.join(run_directory, f"run-{len(runs)}.csv")
+            with open(run_path, "w", newline="") as run_file:
+                csv.writer(run_file).writerows(chunk)
+            runs.append(run_path)
+
+        return runs
+
+    def merge_runs(self, runs: list[str]):
+        run_files = [open(run_path, newline="") for run_path in runs]
+        try:
+            # Runs are merged in order, so equal rows keep their original order
+            # just like a single sort would
+            yield from heapq.merge(
+                *(csv.reader(run_file) for run_file in run_files), key=self.sort_key
+            )
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+
+class HashWriter:
+    """A file-like object that adds everything written to it to a digest."""
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def write(self, text: str):
+        self.digest.update(text.encode())
@@ -1,29 +1,38 @@
-from ..collection import add_recordings_to_collection
-from ..mb_user import MBUser
+from ..collection import apply_collection_changes, plan_collection_changes
+from ..mb_user import RATING_BATCH_BYTES, MBCache, MBUser
 from ..rating_store import RatingStore, RatingStoreExporter
 
 
 class MBRatingCollectionExporter(RatingStoreExporter):
     RATING_SET = "mb"
 
-    def __init__(self, user: MBUser):
+    def __init__(
+        self,
+        user: MBUser,
+        cache: MBCache | None = None,
+        rating_batch_bytes: int = RATING_BATCH_BYTES,
+        dry_run: bool = False,
+    ):
         self.user = user
+        self.rating_batch_bytes = rating_batch_bytes
+        # If set, show the changes but don't send anything to MusicBrainz
+        self.dry_run = dry_run
+        # Without a cache the current contents of the collections are unknown,
+        # so recordings are only ever added
+        self.cache = cache
 
     def export_songs(self, rating_store: RatingStore):
         missing_songs_by_mbid = rating_store.get_missing_ratings_for_set(
             MBRatingCollectionExporter.RATING_SET
         )
-        new_recordings = [[], [], [], [], []]  # 1 star, 2 star, 3 star, 4 star, 5 star
         new_ratings: dict[str, int] = {}  # mbid -> rating
 
-        # Build a list of recordings to add to each collection
         for song_mbid in missing_songs_by_mbid:
             if song_mbid in rating_store.ratings:
-                recording = rating_store.ratings[song_mbid]
-                new_recordings[recording.rating - 1].append(song_mbid)
-                new_ratings[song_mbid] = recording.rating
+                new_ratings[song_mbid] = rating_store.ratings[song_mbid].rating
 
         collection_names = ["1 Star", "2 Star", "3 Star", "4 Star", "5 Star"]
+        collections = {}  # Key: rating, Value: MBCollection
 
         # The numeric rating is based on the order of the collection_names, starting
         # at 1. collection_names on the line above must be ordered from 1 to the
@@ -34,15 +43,83 @@ class MBRatingCollectionExporter(RatingStoreExporter):
 
                 # We found the specific recording collection for numeric_rating
                 if collection.entity_type == "recording":
-                    add_recordings_to_collection(
-                        collection.mbid, new_recordings[numeric_rating - 1]
-                    )
+                    collections[numeric_rating] = collection
+
+        # Every rated recording belongs in the collection for its rating. Only
+        # the recordings that aren't there yet are added, and recordings whose
+        # rating changed are moved out of their old collection.
+        ratings = {
+            mbid: recording.rating
+            for mbid, recording in rating_store.ratings.items()
+            if recording.rating in collections
+        }
+        members: dict[int, set[str]] = {}
+
+        if self.cache:
+            rec_collections = self.cache.get_recording_collections(
+                list(collections.values())
+            )
+            for numeric_rating, rec_collection in zip(collections, rec_collections):
+                members[numeric_rating] = {r.mbid for r in rec_collection.recordings}
+        else:
+            ratings = {
+                mbid: rating
+                for mbid, rating in ratings.items()
+                if mbid in missing_songs_by_mbid
+            }
+
+        plan = plan_collection_changes(
+            ratings,
+            {rating: collection.mbid for rating, collection in collections.items()},
+            members,
+            self.find_ambiguous(rating_store, members),
+        )
+
+        add, remove = (
+            ("would add", "remove") if self.dry_run else ("adding", "removing")
+        )
+        for changes in plan:
+            print(
+                f"{collection_names[changes.rating - 1]}: {add} {len(changes.add)} "
+                f"and {remove} {len(changes.remove)} recordings."
+            )
+
+        if self.dry_run:
+            print(f"Would submit {len(new_ratings)} ratings to MusicBrainz.")
+            rating_store.mark_complete(MBRatingCollectionExporter.RATING_SET)
+            return
+
+        apply_collection_changes(plan)
+
+        if self.cache:
+            for numeric_rating, rec_collection in zip(collections, rec_collections):
+                if any(changes.rating == numeric_rating for changes in plan):
+                    rec_collection.invalidate()
 
         # Update the musicbrainz star ratings
-        self.user.submit_ratings(new_ratings)
+        self.user.submit_ratings(new_ratings, self.rating_batch_bytes)
 
         # Add the ratings to the mb rating set, which should now be equivalent to
         # the "all" rating set
-        rating_store.rating_sets[
-            MBRatingCollectionExporter.RATING_SET
-        ] = rating_store.rating_set_all
+        rating_store.mark_complete(MBRatingCollectionExporter.RATING_SET)
+
+    def find_ambiguous(
+        self, rating_store: RatingStore, members: dict[int, set[str]]
+    ) -> set[str]:
+        """The recordings that are in more than one star collection and whose
+        rating was read from those collections. The importer keeps the highest
+        of their ratings, but we can't tell which collection the user meant, so
+        they are never removed from any of them."""
+        seen: set[str] = set()
+        duplicates: set[str] = set()
+        for mbids in members.values():
+            duplicates |= seen & mbids
+            seen |= mbids
+
+        return {
+            mbid
+            for mbid in duplicates
+            if mbid in rating_store.ratings
+            and rating_store.get_sources(mbid).get(self.RATING_SET)
+            == rating_store.ratings[mbid].rating
+        }
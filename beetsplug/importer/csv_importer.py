@@ -1,4 +1,6 @@
 import csv
+import time
+from itertools import islice
 
 from ..rating_store import RatingStore, RatingStoreImporter
 from ..recording import RecordingInfo
@@ -6,31 +8,61 @@ from ..recording import RecordingInfo
 
 class CSVImporter(RatingStoreImporter):
     RATING_SET = "csv"
+    FIELD_NAMES = ["rating", "artist", "album", "title", "length", "mbid"]
 
-    def __init__(self, file_name):
+    def __init__(self, file_name, chunk_size=0):
         self.file_name = file_name
+        # Number of rows added to the rating store at a time. Zero adds the
+        # whole file in a single call.
+        self.chunk_size = chunk_size
 
     def import_songs(self, rating_store: RatingStore):
+        start = time.perf_counter()
+        recordings = self.read_recordings()
+        count = 0
 
-        with open(self.file_name, "r") as file:
-            field_names = ["rating", "artist", "album", "title", "length", "mbid"]
-            reader = csv.DictReader(file, field_names)
-            next(reader)  # Need to call this to skip the header row
-            line = 1
+        if self.chunk_size > 0:
+            while chunk := list(islice(recordings, self.chunk_size)):
+                count += rating_store.add_ratings(chunk, self.RATING_SET)
+        else:
+            count = rating_store.add_ratings(recordings, self.RATING_SET)
 
-            for row in reader:
+        elapsed = time.perf_counter() - start
+        print(
+            f"Imported {count} ratings from {self.file_name} in {elapsed:.1f}s "
+            f"({count / max(elapsed, 1e-9):.0f} rows/sec)"
+        )
+
+    def read_recordings(self):
+        """Reads the recordings in the file one row at a time."""
+        with open(self.file_name, "r", newline="") as file:
+            reader = csv.reader(file)
+            header = next(reader, None)
+            if header is None:
+                return
+
+            # Find each field by its position in the header row, so that the
+            # columns may be in any order
+            try:
+                rating, artist, album, title, length, mbid = (
+                    header.index(field) for field in self.FIELD_NAMES
+                )
+            except ValueError:
+                print(f"Error reading CSV file: missing columns in {self.file_name}.")
+                return
+
+            for line, row in enumerate(reader, start=2):
                 try:
                     recording = RecordingInfo(
-                        row["artist"],
-                        row["album"],
-                        row["title"],
-                        int(row["length"]),
-                        row["mbid"],
-                        int(row["rating"]),
+                        row[artist],
+                        row[album],
+                        row[title],
+                        int(row[length]),
+                        row[mbid],
+                        int(row[rating]),
                     )
-                except ValueError:
+                except (ValueError, IndexError):
                     print(f"Error reading CSV file on line {line}. Skipping line.")
                     continue
 
-                rating_store.add_rating(recording, rating_set=self.RATING_SET)
-                line += 1
+                yield recording
@@ -1,19 +1,106 @@
+import copy
 import csv
+import json
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any
 
 import pylast
 from beets import plugins
 
+from ..rate_limit_log import log_rate_limited_call
 from ..rating_store import RatingStore, RatingStoreImporter
 from ..recording import RecordingInfo
+from ..scheduler import TokenBucket
 from ..track_finder import MBTrackFinder
 
 
+class LastFMCheckpoint:
+    """The ranges of loved track timestamps that have been fully imported. A
+    range is only added once every track in it has been written to the cache,
+    so an import that stops partway can resume by fetching only the tracks
+    outside of these ranges."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # [oldest, newest] timestamps of each range, newest range first
+        self.ranges: list[list[int]] = []
+        # True once the oldest range reaches the first track the user loved
+        self.complete = False
+        self.exists = os.path.exists(path)
+
+        if self.exists:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                checkpoint = json.load(f)
+
+            self.ranges = checkpoint["ranges"]
+            self.complete = checkpoint["complete"]
+        except (IOError, ValueError, KeyError):
+            print(f"LastFMCheckpoint.load: Unable to load {self.path}.")
+            self.exists = False
+
+    def save(self):
+        # Write to a temporary file first and then rename it so that the
+        # checkpoint is never left partially written
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"ranges": self.ranges, "complete": self.complete}, f)
+
+        os.replace(temp_path, self.path)
+        self.exists = True
+
+    def copy(self) -> "LastFMCheckpoint":
+        checkpoint = copy.copy(self)
+        checkpoint.ranges = [list(r) for r in self.ranges]
+        return checkpoint
+
+    def contains(self, timestamp: int) -> bool:
+        return any(oldest <= timestamp <= newest for oldest, newest in self.ranges)
+
+    def covers_all_before(self, timestamp: int) -> bool:
+        """True if every track loved at or before timestamp was imported."""
+        if not self.complete or not self.ranges:
+            return False
+
+        oldest, newest = self.ranges[-1]
+        return oldest <= timestamp <= newest
+
+    def add_range(self, oldest: int, newest: int):
+        """Adds a range, merging it with any ranges that it overlaps."""
+        ranges = []
+
+        for range_oldest, range_newest in self.ranges:
+            if range_oldest <= newest and oldest <= range_newest:
+                oldest = min(oldest, range_oldest)
+                newest = max(newest, range_newest)
+            else:
+                ranges.append([range_oldest, range_newest])
+
+        ranges.append([oldest, newest])
+        self.ranges = sorted(ranges, reverse=True)
+
+
 class LastFMLovedTrackImporter(RatingStoreImporter):
     RATING_SET = "lastfm"
-
-    def __init__(self, user_name, cache_dir: str, rating: int = 4, track_finder=None):
+    LOVED_FIELDS = ["artist", "album", "title", "length", "mbid", "timestamp"]
+    UNMATCHED_FIELDS = ["artist", "title", "timestamp"]
+
+    # Last.fm allows about five requests per second
+    ALBUM_RATE = 5.0
+
+    def __init__(
+        self,
+        user_name,
+        cache_dir: str,
+        rating: int = 4,
+        track_finder=None,
+        album_workers: int = 4,
+        batch_size: int = 50,
+    ):
         # Last FM object
         self.last_fm = pylast.LastFMNetwork(api_key=plugins.LASTFM_KEY)
         # Last FM User
@@ -26,25 +113,43 @@ class LastFMLovedTrackImporter(RatingStoreImporter):
         self.track_finder = track_finder
         # Default rating to assign to loved tracks
         self.default_rating = rating
+        # Number of threads looking up albums, and the number of tracks that
+        # are matched together
+        self.album_workers = album_workers
+        self.batch_size = batch_size
+        # Shared by the album lookups so the pool stays under the Last.fm limit
+        self.album_bucket = TokenBucket(self.ALBUM_RATE, album_workers)
         # Path to the cache file, given the directory
         self.cache_path = os.path.join(cache_dir, ".lastfm", f"loved-{user_name}.csv")
         self.unmatched_path = os.path.join(
             cache_dir, ".lastfm", f"unmatched-{user_name}.csv"
         )
+        self.checkpoint = LastFMCheckpoint(
+            os.path.join(cache_dir, ".lastfm", f"checkpoint-{user_name}.json")
+        )
         # The most recent (highest) timestamp of a song
         self.max_cached_timestamp = None
-        self.load()
+        # The loved tracks are loaded by import_songs, so that the time spent
+        # loading them counts towards the import
+        self.loaded = False
 
     def load(self):
+        self.loaded = True
+
         if os.path.exists(self.cache_path):
             self.load_cache(self.cache_path)
 
         if os.path.exists(self.unmatched_path):
             self.load_unmatched(self.unmatched_path)
 
+        # Caches written before checkpoints existed may have holes left by an
+        # import that stopped partway, so they don't get a checkpoint range.
+        # The whole list is streamed once instead, and only the tracks missing
+        # from the cache are searched for.
+
         # Note that we always attempt to load from last_fm. We load recordings one by
-        # one until we reach the first cached recording or the end if nothing is cached.
-        # This will be fast if everything is cached already.
+        # one, skipping the ranges in the checkpoint, until we reach the tracks that
+        # were all imported before. This will be fast if everything is cached already.
         self.load_from_lastfm()
 
     def load_cache(self, cache_path):
@@ -112,32 +217,39 @@ class LastFMLovedTrackImporter(RatingStoreImporter):
                 except StopIteration:
                     pass  # Empty file
 
-                for row in reader:
-                    artist = row["artist"]
-                    title = row["title"]
-                    timestamp = int(row["timestamp"])
+                rows = [
+                    (row["artist"], row["title"], int(row["timestamp"]))
+                    for row in reader
+                ]
 
-                    tf = self.track_finder if self.track_finder else MBTrackFinder()
-                    recording = tf.find(artist, title)
-
-                    if recording:
-                        recording.extra["lastfm_timestamp"] = timestamp
-                        self.loved_tracks[timestamp] = recording
-                    else:
-                        recording = RecordingInfo(
-                            artist, "", title, 0, "", self.default_rating
-                        )
-                        recording.extra["lastfm_timestamp"] = timestamp
-                        self.unmatched_tracks[timestamp] = recording
-                        print(f'No match found for {artist} -- "{title}"')
-
-                    # We still update the max cached timestamp regardless so we don't
-                    # reload unmapped tracks
-                    self.max_cached_timestamp = (
-                        timestamp
-                        if not self.max_cached_timestamp
-                        else max(self.max_cached_timestamp, timestamp)
+            # Search for all of the unmatched tracks at once so that the searches
+            # can share the rate limit instead of running one after another
+            tf = self.track_finder if self.track_finder else MBTrackFinder()
+            results = tf.find_all([(artist, title, None) for artist, title, _ in rows])
+
+            found = []
+            for (artist, title, timestamp), recording in zip(rows, results):
+                if recording:
+                    recording.extra["lastfm_timestamp"] = timestamp
+                    self.loved_tracks[timestamp] = recording
+                    found.append(recording)
+                else:
+                    recording = RecordingInfo(
+                        artist, "", title, 0, "", self.default_rating
                     )
+                    recording.extra["lastfm_timestamp"] = timestamp
+                    self.unmatched_tracks[timestamp] = recording
+                    print(f'No match found for {artist} -- "{title}"')
+
+                # We still update the max cached timestamp regardless so we don't
+                # reload unmapped tracks
+                self.max_cached_timestamp = (
+                    timestamp
+                    if not self.max_cached_timestamp
+                    else max(self.max_cached_timestamp, timestamp)
+                )
+
+            self.append_loved(found)
 
         except IOError:
             # If there were issues loading the cache,
@@ -148,63 +260,150 @@ class LastFMLovedTrackImporter(RatingStoreImporter):
             )
             print("Recaching from LastFM.")
 
+    def stream_loved_tracks(self):
+        """Streams the loved tracks from Last.fm, newest first. The tracks are
+        requested one page at a time as the stream is read."""
+        # pylast requests the pages itself, so count each page request by
+        # wrapping the request method of a copy of the user
+        user = copy.copy(self.user)
+        request = user._request
+
+        def counted_request(*args, **kwargs):
+            log_rate_limited_call("get_loved_tracks", "lastfm")
+            return request(*args, **kwargs)
+
+        user._request = counted_request  # type: ignore
+        return user.get_loved_tracks(
+            limit=None, cacheable=True, stream=True  # type: ignore
+        )
+
+    def resolve_album(self, track, title: str) -> str | None:
+        """Looks up the album of a track. This is a separate request for each
+        track, so it runs on the album pool."""
+        self.album_bucket.acquire()
+        log_rate_limited_call("get_album", "lastfm")
+
+        try:
+            album = track.get_album()
+            if album:
+                # If the album title is the same as the title, ignore it; we
+                # will try to search for the album title with the same name as a
+                # last resort. This avoids bad data from Last.fm where we are
+                # missing the actual album name and we need to search for it.
+                return album.title if album.title != title else None
+        # Did not find an album or Last.fm returned an error.
+        # For some reason reading the album tends to fail quite often.
+        # If we pass a null album to the track finder, it should still generally
+        # be able to find the track, although having the album name helps.
+        except (
+            pylast.WSError,
+            pylast.NetworkError,
+            pylast.MalformedResponseError,
+        ):
+            # We can continue safely.
+            # We don't need to bug the user with random exceptions that
+            # don't have a negative impact.
+            pass
+
+        return None
+
+    def match_batch(self, tf, batch: list[tuple], newest: int):
+        """Waits for the albums of a batch of tracks and then searches for all of
+        the tracks at once. Each entry is (artist, title, timestamp, album). An
+        entry without an artist is a track that was imported before, it's only
+        there to mark how far the stream has reached.
+
+        Once the batch is written to the cache, the checkpoint is moved to cover
+        every track from the newest track of this import to the end of the
+        batch."""
+        tracks = [entry for entry in batch if entry[0] is not None]
+        queries = [
+            (artist, title, album.result()) for artist, title, _, album in tracks
+        ]
+        results = tf.find_all(queries) if queries else []
+        found = []
+        not_found = []
+
+        for (artist, title, timestamp, _), recording in zip(tracks, results):
+            if recording:
+                recording.extra["lastfm_timestamp"] = timestamp
+                self.loved_tracks[timestamp] = recording
+                found.append(recording)
+            else:
+                recording = RecordingInfo(artist, "", title, 0, "", self.default_rating)
+                recording.extra["lastfm_timestamp"] = timestamp
+                self.unmatched_tracks[timestamp] = recording
+                not_found.append(recording)
+                print(f'No match found for {artist} -- "{title}"')
+
+        self.append_loved(found)
+        self.append_unmatched(not_found)
+
+        # The tracks are streamed newest first, so the last entry is the oldest
+        self.checkpoint.add_range(batch[-1][2], newest)
+        self.checkpoint.save()
+
     def load_from_lastfm(self):
         # If track finder was provided, use that, otherwise the generic MBTrackFinder
         tf = self.track_finder if self.track_finder else MBTrackFinder()
 
+        # Loading the tracks is split into three stages that run at the same
+        # time: streaming the pages of loved tracks, looking up the albums on the
+        # album pool, and matching each batch of tracks on the match thread.
+        album_pool = ThreadPoolExecutor(
+            max_workers=self.album_workers, thread_name_prefix="lastfm-album"
+        )
+        match_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lastfm")
+        # The batch being matched, at most one batch is matched at a time so
+        # that streaming doesn't get too far ahead of the matching
+        pending_match: Future | None = None
+        batch: list[tuple] = []
+        # The checkpoint as it was before this import, the match thread updates
+        # the checkpoint while the tracks are streamed
+        imported = self.checkpoint.copy()
+        # Timestamp of the most recently loved track
+        newest = None
+        reached_end = False
+        matching_failed = False
+
         try:
-            for loved_track in self.user.get_loved_tracks(
-                limit=None, cacheable=True, stream=True  # type: ignore
-            ):
+            for loved_track in self.stream_loved_tracks():
                 track = loved_track.track
                 timestamp = int(loved_track.timestamp)
-                artist = track.get_artist().name
-                title = track.get_name()
-                album = None
-
-                # If this timestamp is lower than the max,
-                # we have already loaded the rest before from the cache
-                if self.max_cached_timestamp and timestamp <= self.max_cached_timestamp:
-                    break
+                newest = timestamp if newest is None else newest
 
-                try:
-                    album = track.get_album()
-                    if album:
-                        # If the album title is the same as the title, ignore it; we
-                        # will try to search for the album title with the same name as a
-                        # last resort. This avoids bad data from Last.fm where we are
-                        # missing the actual album name and we need to search for it.
-                        album = album.title if album.title != title else None
-                # Did not find an album or Last.fm returned an error.
-                # For some reason reading the album tends to fail quite often.
-                # If we pass a null album to the track finder, it should still generally
-                # be able to find the track, although having the album name helps.
-                except (
-                    pylast.WSError,
-                    pylast.NetworkError,
-                    pylast.MalformedResponseError,
-                ):
-                    # We can continue safely.
-                    # We don't need to bug the user with random exceptions that
-                    # don't have a negative impact.
-                    pass
-
-                recording = tf.find(
-                    artist,
-                    title,
-                    album,
+                cached = (
+                    timestamp in self.loved_tracks or timestamp in self.unmatched_tracks
                 )
+                if cached or imported.contains(timestamp):
+                    # This track was imported before, only mark the position
+                    batch.append((None, None, timestamp, None))
 
-                if recording:
-                    recording.extra["lastfm_timestamp"] = timestamp
-                    self.loved_tracks[timestamp] = recording
+                    # Every track from here on was imported before
+                    if imported.covers_all_before(timestamp):
+                        break
                 else:
-                    recording = RecordingInfo(
-                        artist, "", title, 0, "", self.default_rating
+                    artist = track.get_artist().name
+                    title = track.get_name()
+                    album = album_pool.submit(self.resolve_album, track, title)
+                    batch.append((artist, title, timestamp, album))
+
+                if len(batch) >= self.batch_size:
+                    if pending_match:
+                        previous_match, pending_match = pending_match, None
+                        try:
+                            previous_match.result()
+                        except Exception:
+                            # The checkpoint can't move past a batch that failed
+                            matching_failed = True
+                            raise
+                    pending_match = match_pool.submit(
+                        self.match_batch, tf, batch, newest
                     )
-                    recording.extra["lastfm_timestamp"] = timestamp
-                    self.unmatched_tracks[timestamp] = recording
-                    print(f'No match found for {artist} -- "{title}"')
+                    batch = []
+            else:
+                # We reached the first track that the user loved
+                reached_end = True
 
         except pylast.NetworkError as network_exception:
             print(f"Network error: {network_exception}")
@@ -213,51 +412,77 @@ class LastFMLovedTrackImporter(RatingStoreImporter):
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
 
-        self.save_cache()
+        # Match the tracks that were streamed before the end of the stream or
+        # before an error stopped it
+        try:
+            if pending_match:
+                pending_match.result()
+            if batch and not matching_failed:
+                self.match_batch(tf, batch, newest)
+
+            if reached_end and newest is not None:
+                self.checkpoint.complete = True
+                self.checkpoint.save()
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+        finally:
+            album_pool.shutdown(cancel_futures=True)
+            match_pool.shutdown()
+
+        if self.checkpoint.ranges:
+            self.max_cached_timestamp = self.checkpoint.ranges[0][1]
         self.save_unmatched()
 
-    def save_cache(self):
-        field_names = ["artist", "album", "title", "length", "mbid", "timestamp"]
+    def append_rows(self, path: str, field_names: list[str], rows: list[dict]):
+        """Appends rows to a cache file, so that each page of tracks is written
+        without rewriting the tracks that were already cached."""
+        if not rows:
+            return
 
         # Create the cache directory if necessary
-        directory = os.path.dirname(self.cache_path)
+        directory = os.path.dirname(path)
         if not os.path.exists(directory):
             os.mkdir(directory)
 
-        # Need to make sure the tracks are sorted by timestamp. They may be out
-        # of order if we found tracks that were unmapped previously
-        recordings = sorted(
-            self.loved_tracks.values(),
-            key=lambda x: x.extra["lastfm_timestamp"],
-            reverse=True,
-        )
-
-        with open(self.cache_path, "w") as f:
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a") as f:
             writer = csv.DictWriter(f, field_names)
-            writer.writeheader()
-
-            updated_timestamp = False
-            for recording in recordings:
-                # Assuming that tracks are sorted in descending timestamp order,
-                # the first track will have the highest timestamp
-                if not updated_timestamp:
-                    self.max_cached_timestamp = recording.extra["lastfm_timestamp"]
-                    updated_timestamp = True
-
-                row: dict[str, Any] = {
-                    "artist": recording.artist,
-                    "album": recording.album,
-                    "title": recording.title,
-                    "length": recording.length,
-                    "mbid": recording.mbid,
-                    "timestamp": recording.extra["lastfm_timestamp"],
-                }
-
-                writer.writerow(row)  # type: ignore
+            if write_header:
+                writer.writeheader()
+
+            writer.writerows(rows)  # type: ignore
+
+    def append_loved(self, recordings: list[RecordingInfo]):
+        rows: list[dict[str, Any]] = [
+            {
+                "artist": recording.artist,
+                "album": recording.album,
+                "title": recording.title,
+                "length": recording.length,
+                "mbid": recording.mbid,
+                "timestamp": recording.extra["lastfm_timestamp"],
+            }
+            for recording in recordings
+        ]
+        self.append_rows(self.cache_path, self.LOVED_FIELDS, rows)
+
+    def append_unmatched(self, recordings: list[RecordingInfo]):
+        rows: list[dict[str, Any]] = [
+            {
+                "artist": recording.artist,
+                "title": recording.title,
+                "timestamp": recording.extra["lastfm_timestamp"],
+            }
+            for recording in recordings
+        ]
+        self.append_rows(self.unmatched_path, self.UNMATCHED_FIELDS, rows)
 
     def save_unmatched(self):
-        # Don't need to do anything if there are no unmatched tracks
+        # Tracks that were unmatched before may have been found since,
+        # so the whole file is rewritten. It only holds a few tracks.
         if len(self.unmatched_tracks) == 0:
+            if os.path.exists(self.unmatched_path):
+                os.remove(self.unmatched_path)
             return
 
         # Create the cache directory if necessary
@@ -271,9 +496,8 @@ class LastFMLovedTrackImporter(RatingStoreImporter):
             reverse=True,
         )
 
-        field_names = ["artist", "title", "timestamp"]
         with open(self.unmatched_path, "w") as f:
-            writer = csv.DictWriter(f, field_names)
+            writer = csv.DictWriter(f, self.UNMATCHED_FIELDS)
             writer.writeheader()
 
             for recording in recordings:
@@ -287,7 +511,7 @@ class LastFMLovedTrackImporter(RatingStoreImporter):
 
     def import_songs(self, rating_store: RatingStore):
         # Load the songs if we haven't already
-        if len(self.loved_tracks) == 0:
+        if not self.loaded:
             self.load()
 
         recordings = sorted(
@@ -297,4 +521,4 @@ class LastFMLovedTrackImporter(RatingStoreImporter):
 
         for recording in recordings:
             recording.rating = self.default_rating
-            rating_store.add_rating(recording, self.RATING_SET)
+        rating_store.add_ratings(recordings, self.RATING_SET)
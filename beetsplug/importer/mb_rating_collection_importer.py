@@ -19,17 +19,23 @@ class MBRatingCollectionImporter(RatingStoreImporter):
         # The numeric rating is based on the order of the collection_names, starting
         # at 1. collection_names on the line above must be ordered from 1 to the
         # highest rating or this loop will fail.
+        ratings = []
+        collections = []
         for numeric_rating, name in enumerate(collection_names, start=1):
             if self.user.has_collection(name):
                 collection = self.user.get_collection(name)
 
                 if collection.entity_type == "recording":
-                    rec_collection = self.cache.get_recording_collection(
-                        collection.name, collection.mbid
-                    )
-                    self.import_recording_collection(
-                        rec_collection, numeric_rating, rating_store, True
-                    )
+                    ratings.append(numeric_rating)
+                    collections.append(collection)
+
+        # Load all of the rating collections at once through the shared scheduler
+        rec_collections = self.cache.get_recording_collections(collections)
+
+        for numeric_rating, rec_collection in zip(ratings, rec_collections):
+            self.import_recording_collection(
+                rec_collection, numeric_rating, rating_store, True
+            )
 
     def import_recording_collection(
         self,
@@ -40,17 +46,18 @@ class MBRatingCollectionImporter(RatingStoreImporter):
     ):
         """Loads ratings from a specific rating collection, using the specific number
         as the rating. If overwrite is True, existing ratings will be overwritten."""
-        recordings = collection.recordings
-        for recording in recordings:
+        rating_store.add_ratings(
+            self.find_recordings(collection, rating), self.RATING_SET, overwrite
+        )
+
+    def find_recordings(self, collection: MBRecordingCollection, rating: int):
+        """Finds the recordings in a collection in the library, one at a time."""
+        for recording in collection.recordings:
             rec_info = self.library_finder.findByRecording(recording)
 
             if rec_info:
                 rec_info.rating = rating
-                rating_store.add_rating(
-                    rec_info,
-                    self.RATING_SET,
-                    overwrite,
-                )
+                yield rec_info
             else:
                 # Todo: Make this a debug log.
                 # Todo: Handle edge case where the MBID changed due to merge. We need to
@@ -0,0 +1,112 @@
+import math
+import threading
+
+import beets.library
+
+from .stats import get_stats
+
+
+class LibraryIndex:
+    """An in-memory index of every item in the Beets library. All items are
+    loaded once and keyed by MBID and artist, and bucketed by length so that
+    lookups don't require a library query. Artist lookups match substrings,
+    the same way the library queries they replace do."""
+
+    def __init__(self, library):
+        self.library = library
+        self.loaded = False
+        # Lookups run on several worker threads, so only one of them loads
+        # the index while the others wait for it
+        self.lock = threading.Lock()
+
+        # Key: mb_trackid, Value: list of items with that MBID
+        self.by_mbid: dict[str, list[beets.library.Item]] = {}
+        # Key: lowercase artist, Value: list of items credited to that artist
+        self.by_artist: dict[str, list[beets.library.Item]] = {}
+        # Key: length in whole seconds, Value: list of items with that length
+        self.by_length: dict[int, list[beets.library.Item]] = {}
+        # Key: lowercase search, Value: items whose artist contains the search.
+        # Many tracks are looked up for the same artist, so the artists are only
+        # scanned once for each search.
+        self.artist_matches: dict[str, list[beets.library.Item]] = {}
+
+    def load(self):
+        """Loads every item from the library into the index. Calling this
+        multiple times will rebuild the index from scratch."""
+        with self.lock:
+            self.__load()
+
+    def __load(self):
+        self.by_mbid.clear()
+        self.by_artist.clear()
+        self.by_length.clear()
+        self.artist_matches.clear()
+
+        get_stats().record_library_query()
+        for item in self.library.items():
+            self.add(item)
+
+        self.loaded = True
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+
+        with self.lock:
+            # Another thread may have loaded the index while we waited
+            if not self.loaded:
+                self.__load()
+
+    def add(self, item: beets.library.Item):
+        if item.mb_trackid:
+            self.by_mbid.setdefault(item.mb_trackid, []).append(item)
+
+        self.by_artist.setdefault(item.artist.lower(), []).append(item)
+        self.by_length.setdefault(math.floor(item.length), []).append(item)
+        self.artist_matches.clear()
+
+    def update_mbid(self, item: beets.library.Item, old_mbid: str):
+        """Moves an item to its new MBID after the MBID was changed."""
+        if old_mbid == item.mb_trackid:
+            return
+
+        if old_mbid in self.by_mbid:
+            self.by_mbid[old_mbid] = [
+                i for i in self.by_mbid[old_mbid] if i is not item
+            ]
+            if not self.by_mbid[old_mbid]:
+                del self.by_mbid[old_mbid]
+
+        if item.mb_trackid:
+            self.by_mbid.setdefault(item.mb_trackid, []).append(item)
+
+    def get_by_mbid(self, mbid: str) -> list[beets.library.Item]:
+        self.ensure_loaded()
+        return self.by_mbid.get(mbid, [])
+
+    def get_by_artist(self, artist: str) -> list[beets.library.Item]:
+        """Returns all items whose artist contains artist, ignoring case."""
+        self.ensure_loaded()
+        search = artist.lower()
+
+        if search not in self.artist_matches:
+            self.artist_matches[search] = [
+                item
+                for name, items in self.by_artist.items()
+                if search in name
+                for item in items
+            ]
+
+        return self.artist_matches[search]
+
+    def get_by_length(self, lower: float, upper: float) -> list[beets.library.Item]:
+        """Returns all items with a length between lower and upper, inclusive."""
+        self.ensure_loaded()
+        items = []
+
+        for bucket in range(math.floor(lower), math.floor(upper) + 1):
+            for item in self.by_length.get(bucket, []):
+                if lower <= item.length <= upper:
+                    items.append(item)
+
+        return items
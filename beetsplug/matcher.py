@@ -1,39 +1,28 @@
+import math
+from collections.abc import Iterable
 from logging import getLogger
 
 import beets.library
 from beets import dbcore
 from thefuzz import fuzz
 
+from .library_index import LibraryIndex
 from .normalize import first_artist
 from .recording import RecordingInfo
+from .stats import get_stats
 
 
 class RecordingMatcher:
-    def __init__(self, lib, logger):
+    def __init__(self, lib, logger, index: LibraryIndex | None = None):
         self.lib = lib
         self.logger = logger if logger else getLogger("beets")
+        self.index = index
 
     def match(self, recording: RecordingInfo) -> beets.library.Item | None:
         """Finds a matching song in the library based on a recording object"""
-        song = None
+        get_stats().record_library_query()
         songs = self.lib.items(dbcore.query.MatchQuery("mb_trackid", recording.mbid))
-
-        if len(songs) == 1:
-            song = songs.get()
-        else:
-            for each_song in songs:
-                # Note that song will be None on the first iteration. We want
-                # to match with the song with the highest track total
-                if not song or (
-                    (each_song.tracktotal > song.tracktotal)
-                    # We don't prefer remix releases. If it's the only release
-                    # it will be chosen on the first iteration because song was None
-                    and (
-                        "remixes" not in each_song.album.lower()
-                        and "remix" not in each_song.album.lower()
-                    )
-                ):
-                    song = each_song
+        song = self.select_by_mbid(songs)
 
         if song is None:
             # self._log.debug(
@@ -53,31 +42,9 @@ class RecordingMatcher:
                 ]
             )
 
+            get_stats().record_library_query()
             songs = self.lib.items(andQuery)
-
-            if len(songs) == 1:
-                song = songs.get()
-            else:
-                for each_song in songs:
-                    # We might get the a collision if the track title is in the track
-                    # title of another song and the song lengths are similar. Double
-                    # check that the artist is correct and that the title is
-                    # reasonably close
-                    if (
-                        recording.artist
-                        and first_artist(recording.artist) not in each_song["artist"]
-                    ) or fuzz.ratio(each_song["title"], recording.title) < 90:
-                        continue
-
-                    # Note that song will be None on the first iteration. We want
-                    # to match with the song with the highest track total
-                    if not song or each_song.tracktotal > song.tracktotal:
-                        song = each_song
-
-                        self.logger.info(
-                            "RecordingMatcher: Matched song --"
-                            f"{song['title']} to {recording.title}"
-                        )
+            song = self.select_by_title(recording, songs)
 
         if not song:
             self.logger.info(
@@ -85,3 +52,123 @@ class RecordingMatcher:
             )
 
         return song
+
+    def match_all(
+        self, recordings: Iterable[RecordingInfo]
+    ) -> dict[str, beets.library.Item]:
+        """Matches a batch of recordings against the library at once. Returns a
+        dictionary of mbid -> Item for every recording that was matched.
+
+        Recordings are first matched by MBID in a single pass over the library.
+        Only the recordings left over are fuzzy matched by title and length."""
+        recordings = list(recordings)
+        matches: dict[str, beets.library.Item] = {}
+
+        if self.index:
+            self.index.ensure_loaded()
+            by_mbid, by_length = self.index.by_mbid, self.index.by_length
+        else:
+            by_mbid, by_length = self.load_tables({rec.mbid for rec in recordings})
+
+        leftovers = []
+        for recording in recordings:
+            song = self.select_by_mbid(by_mbid.get(recording.mbid, []))
+
+            if song is not None:
+                matches[recording.mbid] = song
+            else:
+                leftovers.append(recording)
+
+        for recording in leftovers:
+            # Allow for a difference in lengths by +- 3 seconds
+            length_lower = round(recording.length) - 3
+            length_upper = round(recording.length) + 3
+            title = recording.title.lower()
+
+            songs = [
+                song
+                for bucket in range(length_lower, length_upper + 1)
+                for song in by_length.get(bucket, [])
+                if length_lower <= song.length <= length_upper
+                and title in song.title.lower()
+            ]
+            song = self.select_by_title(recording, songs)
+
+            if song is not None:
+                matches[recording.mbid] = song
+            else:
+                self.logger.info(
+                    f"RecordingMatcher: Unable to match song {recording.title}"
+                )
+
+        return matches
+
+    def load_tables(self, mbids: set[str]):
+        """Loads the library in a single pass. Returns the songs whose MBID is
+        in mbids, and all of the songs bucketed by length in whole seconds."""
+        by_mbid: dict[str, list[beets.library.Item]] = {}
+        by_length: dict[int, list[beets.library.Item]] = {}
+
+        get_stats().record_library_query()
+        for song in self.lib.items():
+            if song.mb_trackid and song.mb_trackid in mbids:
+                by_mbid.setdefault(song.mb_trackid, []).append(song)
+
+            by_length.setdefault(math.floor(song.length), []).append(song)
+
+        return by_mbid, by_length
+
+    def select_by_mbid(self, songs) -> beets.library.Item | None:
+        """Selects the best song from songs that all share the same MBID."""
+        song = None
+
+        if len(songs) == 1:
+            song = songs[0]
+        else:
+            for each_song in songs:
+                # Note that song will be None on the first iteration. We want
+                # to match with the song with the highest track total
+                if not song or (
+                    (each_song.tracktotal > song.tracktotal)
+                    # We don't prefer remix releases. If it's the only release
+                    # it will be chosen on the first iteration because song was None
+                    and (
+                        "remixes" not in each_song.album.lower()
+                        and "remix" not in each_song.album.lower()
+                    )
+                ):
+                    song = each_song
+
+        return song
+
+    def select_by_title(
+        self, recording: RecordingInfo, songs
+    ) -> beets.library.Item | None:
+        """Selects the best song from songs that have a similar title and length."""
+        song = None
+
+        if len(songs) == 1:
+            song = songs[0]
+        else:
+            for each_song in songs:
+                # We might get the a collision if the track title is in the track
+                # title of another song and the song lengths are similar. Double
+                # check that the artist is correct and that the title is
+                # reasonably close
+                if (
+                    recording.artist
+                    and first_artist(recording.artist) not in each_song["artist"]
+                ) or fuzz.ratio(each_song["title"], recording.title) < 90:
+                    continue
+
+                # Note that song will be None on the first iteration. We want
+                # to match with the song with the highest track total
+                if not song or each_song.tracktotal > song.tracktotal:
+                    song = each_song
+
+                    self.logger.info(
+                        "RecordingMatcher: Matched song --"
+                        f"{song['title']} to {recording.title}"
+                    )
+
+        return song
@@ -1,13 +1,21 @@
 import csv
+import hashlib
+import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import musicbrainzngs
+from musicbrainzngs.mbxml import make_rating_request
 
+from .collection import call_with_retry
 from .credentials import contact, user_agent, version
-from .rate_limit_log import log_rate_limited_call
 from .recording import MBRecording
+from .scheduler import get_scheduler
+
+# Maximum size of a single rating submission to MusicBrainz, in bytes
+RATING_BATCH_BYTES = 64 * 1024
 
 
 class MBCache:
@@ -36,9 +44,30 @@ class MBCache:
         cache_path = self.get_collection_cache_path(mbid)
         return MBRecordingCollection(name, mbid, cache_path)
 
+    def get_recording_collections(
+        self, collections: list["MBCollection"]
+    ) -> list["MBRecordingCollection"]:
+        """Loads several recording collections at once. The collections share
+        the scheduler, so one collection is parsed while another is fetched."""
+        return get_scheduler().map(
+            lambda c: self.get_recording_collection(c.name, c.mbid), collections
+        )
+
     def get_track_cache_path(self):
         return os.path.join(self.path, "tracks.csv")
 
+    def get_response_cache_path(self):
+        return os.path.join(self.path, "responses.db")
+
+    def get_conflict_report_path(self):
+        return os.path.join(self.path, "conflicts.json")
+
+    def get_stats_path(self):
+        return os.path.join(self.path, "stats.json")
+
+    def get_negative_cache_path(self):
+        return os.path.join(self.path, "not-found.csv")
+
     def get_user_cache_path(self, user):
         return os.path.join(self.path, f"user-{user}.csv")
 
@@ -59,6 +88,13 @@ class MBCollection:
 class MBRecordingCollection(MBCollection):
     """Represents a specific collection of recordings on Musicbrainz."""
 
+    # Maximum number of recordings that MusicBrainz returns per request
+    PAGE_SIZE = 100
+    # Time before the cache is checked against MusicBrainz for changes
+    CACHE_TTL = 3 * 60 * 60
+    # Time before the whole collection is reloaded, even if it seems unchanged
+    FULL_REFRESH_AGE = 7 * 24 * 60 * 60
+
     def __init__(self, name, mbid, cache_path):
         super().__init__(name, mbid, "recording")
         self.cache_path = cache_path
@@ -85,18 +121,97 @@ class MBRecordingCollection(MBCollection):
             cache_mod_time = os.path.getmtime(cache_path)
             current_time = time.time()
 
-            if current_time - cache_mod_time > (3 * 60 * 60):  # 3 hours in seconds
-                # Cache is older than 3 hours, so load from MusicBrainz and update the cache
-                print(
-                    "Cache is older than 3 hours, reloading and recaching from Musicbrainz."
-                )
-                self.load_from_musicbrainz()
+            if current_time - cache_mod_time > self.CACHE_TTL:
+                # Cache is older than 3 hours, so check MusicBrainz for changes
+                print("Cache is older than 3 hours, checking Musicbrainz for changes.")
+                self.refresh()
             else:
                 # Cache is fresh, so load from the cache file
                 self.load_cache(cache_path)
         else:
             self.load_from_musicbrainz()
 
+    def invalidate(self):
+        """Marks the cache as stale after the collection was modified, so the
+        next load checks MusicBrainz for the changes."""
+        if os.path.exists(self.cache_path):
+            os.utime(self.cache_path, (0, 0))
+
+    def get_pages_path(self):
+        return f"{self.cache_path}.pages"
+
+    @staticmethod
+    def page_checksum(mbids: list[str]) -> str:
+        return hashlib.sha1("\n".join(mbids).encode()).hexdigest()
+
+    def page_checksums(self) -> list[str]:
+        """Checksums of the recording ids in each page of the collection."""
+        mbids = [recording.mbid for recording in self.recordings]
+        return [
+            self.page_checksum(mbids[offset : offset + self.PAGE_SIZE])
+            for offset in range(0, max(len(mbids), 1), self.PAGE_SIZE)
+        ]
+
+    def load_pages(self) -> dict | None:
+        try:
+            with open(self.get_pages_path(), "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save_pages(self, full_refresh: float):
+        pages = {
+            "count": len(self.recordings),
+            "checksums": self.page_checksums(),
+            "full_refresh": full_refresh,
+        }
+
+        with open(self.get_pages_path(), "w") as f:
+            json.dump(pages, f)
+
+    def refresh(self):
+        """Brings the cached collection up to date. Most of the time only a few
+        ratings change between runs, so rather than reloading the collection the
+        recording count and the first and last pages are compared with the
+        cache. The whole collection is only reloaded if any of them changed."""
+        self.recordings.clear()
+        self.load_cache(self.cache_path)
+        pages = self.load_pages()
+
+        # Changes in the middle of the collection don't show up in the first or
+        # last page, so the collection is still reloaded every so often
+        if (
+            pages is None
+            or pages["count"] != len(self.recordings)
+            or time.time() - pages["full_refresh"] > self.FULL_REFRESH_AGE
+        ):
+            self.load_from_musicbrainz()
+            return
+
+        first_page = self.fetch_page(0)
+        collection = first_page[0]
+        count = collection["recording-count"]
+        unchanged = count == pages["count"] and pages["checksums"][0] == (
+            self.page_checksum([item["id"] for item in collection["recording-list"]])
+        )
+
+        # The first page matched, check the last page too
+        last_offset = (max(count - 1, 0) // self.PAGE_SIZE) * self.PAGE_SIZE
+        if unchanged and last_offset > 0:
+            last_page = self.fetch_page(last_offset)[0]["recording-list"]
+            unchanged = pages["checksums"][-1] == self.page_checksum(
+                [item["id"] for item in last_page]
+            )
+
+        if unchanged:
+            print(f"Recording collection '{self.name}' is unchanged.")
+            # Reset the cache age without rewriting the cache
+            os.utime(self.cache_path)
+            return
+
+        print(f"Recording collection '{self.name}' changed, reloading.")
+        self.load_from_musicbrainz(first_page)
+
     def load_cache(self, cache_path):
         try:
             with open(self.cache_path, "r") as f:
@@ -128,38 +243,94 @@ class MBRecordingCollection(MBCollection):
             #     "This may not be an error if the collection itself is actually empty."
             # )
 
-    def load_from_musicbrainz(self):
+    def fetch_page(self, offset: int) -> tuple[dict, float, float]:
+        """Fetches a single page of recordings. Returns the collection, the time
+        spent waiting for the rate limiter and the time spent fetching."""
+        scheduler = get_scheduler()
+        start = time.monotonic()
+
+        result = scheduler.call(
+            "get_recordings_in_collection",
+            musicbrainzngs.get_recordings_in_collection,
+            self.mbid,
+            limit=self.PAGE_SIZE,
+            offset=offset,
+        )
+
+        wait = scheduler.last_wait()
+        return result["collection"], wait, time.monotonic() - start - wait
+
+    def parse_page(self, recording_list: list) -> int:
+        """Adds the recordings in a page to the collection. Returns the number of
+        recordings that are missing length information."""
+        missing_length = 0
+
+        for item in recording_list:
+            length = item.get("length", None)
+            if length is None:
+                missing_length += 1
+                length = 0
+            else:
+                length = int(length) / 1000
+
+            recording = MBRecording(item["title"], int(length), item["id"])
+            self.recordings.append(recording)
+
+        return missing_length
+
+    def load_from_musicbrainz(self, first_page: tuple | None = None):
+        """Loads every page of the collection. first_page is the result of
+        fetch_page(0) if the first page was already fetched."""
         self.recordings.clear()
+        full_refresh = time.time()
+        wait_time = 0.0
+        fetch_time = 0.0
+        pages = 0
+        missing_length = 0
 
-        log_rate_limited_call("get_recordings_in_collection")
-        result = musicbrainzngs.get_recordings_in_collection(self.mbid, limit=100)
+        # The next page is fetched on its own thread while the current page is
+        # parsed, so parsing never delays the next rate limited request
+        prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="collection")
+
+        try:
+            if first_page:
+                next_page = prefetcher.submit(lambda: first_page)
+            else:
+                next_page = prefetcher.submit(self.fetch_page, 0)
+            offset = 0
 
-        recording_list = result["collection"]["recording-list"]
-        count = result["collection"]["recording-count"]
-        offset = 0
+            while next_page:
+                collection, wait, fetch = next_page.result()
+                wait_time += wait
+                fetch_time += fetch
+                pages += 1
 
-        while len(recording_list) > 0 and offset < count:
-            offset += len(recording_list)
+                recording_list = collection["recording-list"]
+                count = collection["recording-count"]
+                offset += len(recording_list)
 
-            for item in recording_list:
-                length = item.get("length", None)
-                if length is None:
-                    print(
-                        f"Warning: Recording '{item['title']}' is missing length information."
-                    )
-                    length = 0
-                else:
-                    length = int(length) / 1000
+                # Only request another page if there are recordings left
+                next_page = None
+                if len(recording_list) > 0 and offset < count:
+                    next_page = prefetcher.submit(self.fetch_page, offset)
 
-                recording = MBRecording(item["title"], int(length), item["id"])
-                self.recordings.append(recording)
+                missing_length += self.parse_page(recording_list)
+        finally:
+            prefetcher.shutdown(cancel_futures=True)
 
-            log_rate_limited_call("get_recordings_in_collection")
-            recording_list = musicbrainzngs.get_recordings_in_collection(
-                self.mbid, limit=100, offset=offset
-            )["collection"]["recording-list"]
+        if missing_length:
+            print(
+                f"Warning: {missing_length} recordings in '{self.name}' are missing "
+                "length information."
+            )
+        print(
+            f"Loaded {len(self.recordings)} recordings from '{self.name}' in "
+            f"{pages} pages: {fetch_time:.1f}s fetching, "
+            f"{wait_time:.1f}s waiting for the rate limit"
+        )
 
         self.save_cache()
+        self.save_pages(full_refresh)
 
     def save_cache(self):
         field_names = ["title", "length", "mbid"]
@@ -178,6 +349,23 @@ class MBRecordingCollection(MBCollection):
                 )
 
 
+class RatingBatch:
+    """A batch of ratings that was submitted to MusicBrainz. latency includes
+    the time spent waiting for the rate limiter and retrying."""
+
+    def __init__(self, size: int, bytes: int, latency: float, attempts: int):
+        self.size = size
+        self.bytes = bytes
+        self.latency = latency
+        self.attempts = attempts
+
+    def __repr__(self):
+        return (
+            f"RatingBatch: {self.size} ratings [{self.bytes} bytes] "
+            f"{self.latency:.2f}s, {self.attempts} attempts"
+        )
+
+
 class MBUser:
     authenticated = False
 
@@ -186,6 +374,8 @@ class MBUser:
         self.cache_path = cache_path
         self.collection_index: dict[str, MBCollection] = {}
         self.collections: list[MBCollection] = []
+        # The rating batches submitted to MusicBrainz, in order
+        self.rating_batches_sent: list[RatingBatch] = []
 
         # Authenticate with MusicBrainz regardless of whether we are using the cache
         self.authenticate(user, password)
@@ -200,7 +390,6 @@ class MBUser:
 
         try:
             musicbrainzngs.set_useragent(user_agent, version, contact)
-            musicbrainzngs.set_rate_limit(limit_or_interval=1.0, new_requests=1)
             # The below line only should be enabled while debugging authentication.
             # Under normal circumstances only one auth call is made.
             # log_rate_limited_call("auth")
@@ -241,8 +430,9 @@ class MBUser:
         # we only store one copy of the collections
         self.collections.clear()  # type: ignore
 
-        log_rate_limited_call("get_collections")
-        results = musicbrainzngs.get_collections()
+        results = get_scheduler().call(
+            "get_collections", musicbrainzngs.get_collections
+        )
 
         collection_list = results["collection-list"]
 
@@ -282,9 +472,95 @@ class MBUser:
         """Gets a specific collection by name."""
         return self.collection_index[name]
 
-    def submit_ratings(self, ratings: dict[str, int]):
+    def get_pending_ratings_path(self):
+        return f"{self.cache_path}.pending"
+
+    def load_pending_ratings(self) -> dict[str, int]:
         try:
-            musicbrainzngs.submit_ratings(recording_ratings=ratings)
-        except musicbrainzngs.AuthenticationError as e:
-            error_text = str(e)
-            print("Error while submitting ratings to Musicbrainz:", error_text)
+            with open(self.get_pending_ratings_path(), "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_pending_ratings(self, pending: dict[str, int]):
+        path = self.get_pending_ratings_path()
+
+        if not pending:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        # Write to a temporary file first so a crash never leaves a partial file
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(pending, f)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def rating_batches(ratings: dict[str, int], max_bytes: int):
+        """Splits ratings into batches whose rating request is at most max_bytes
+        long. Every batch holds at least one rating."""
+        envelope = len(make_rating_request(recording_ratings={}))
+        sample = len(make_rating_request(recording_ratings={"": 0})) - envelope - 1
+        batch: dict[str, int] = {}
+        size = envelope
+
+        for mbid, rating in ratings.items():
+            entry = sample + len(mbid) + len(str(rating))
+
+            if batch and size + entry > max_bytes:
+                yield batch
+                batch = {}
+                size = envelope
+
+            batch[mbid] = rating
+            size += entry
+
+        if batch:
+            yield batch
+
+    def submit_ratings(
+        self, ratings: dict[str, int], max_bytes: int = RATING_BATCH_BYTES
+    ):
+        """Submits ratings in batches of at most max_bytes. The ratings that
+        haven't been submitted yet are saved, so if a run stops part of the way
+        through, the next run submits them first."""
+        pending = self.load_pending_ratings()
+        if pending:
+            print(f"Resuming the submission of {len(pending)} ratings.")
+        pending.update(ratings)
+        self.save_pending_ratings(pending)
+
+        for ratings_batch in list(self.rating_batches(pending, max_bytes)):
+            query = make_rating_request(recording_ratings=ratings_batch)
+            start = time.monotonic()
+
+            try:
+                _, attempts = call_with_retry(
+                    "submit_ratings",
+                    musicbrainzngs.musicbrainz._do_mb_post,  # type: ignore
+                    "rating",
+                    query,
+                )
+            except musicbrainzngs.WebServiceError as e:
+                print("Error while submitting ratings to Musicbrainz:", str(e))
+                print(f"{len(pending)} ratings will be submitted on the next run.")
+                return
+
+            self.rating_batches_sent.append(
+                RatingBatch(
+                    len(ratings_batch), len(query), time.monotonic() - start, attempts
+                )
+            )
+
+            for mbid in ratings_batch:
+                del pending[mbid]
+            self.save_pending_ratings(pending)
+
+        if self.rating_batches_sent:
+            total_bytes = sum(batch.bytes for batch in self.rating_batches_sent)
+            total_time = sum(batch.latency for batch in self.rating_batches_sent)
+            print(
+                f"Submitted {sum(b.size for b in self.rating_batches_sent)} ratings "
+                f"in {len(self.rating_batches_sent)} batches: {total_bytes} bytes, "
+                f"{total_time:.1f}s"
+            )
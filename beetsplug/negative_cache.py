@@ -0,0 +1,117 @@
+import csv
+import os
+import threading
+import time
+
+from .normalize import first_artist, normalize
+
+DAY = 24 * 60 * 60
+
+
+class NegativeResult:
+    def __init__(self, key: str, last_attempt: float, attempts: int):
+        self.key = key
+        self.last_attempt = last_attempt
+        self.attempts = attempts
+
+
+class NegativeCache:
+    """Remembers the track searches that didn't find anything, so that the
+    same search isn't repeated on every run. After each failed attempt, the
+    time before the search is retried doubles, up to max_delay."""
+
+    FIELD_NAMES = ["key", "last_attempt", "attempts"]
+
+    def __init__(self, cache_file_path, base_delay=DAY, max_delay=64 * DAY):
+        self.cache_file_path = cache_file_path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.results: dict[str, NegativeResult] = {}  # Key: artist:title:album
+        self.dirty = False
+        # Searches on the scheduler's worker threads record their results at
+        # the same time
+        self.lock = threading.Lock()
+        self.__load_cache(cache_file_path)
+
+    def __load_cache(self, path):
+        if not os.path.exists(path):
+            return
+
+        with open(path, newline="") as cache_file:
+            reader = csv.reader(cache_file)
+
+            for row in reader:
+                # Skip blank lines and the header row
+                if not row or row[0] == "key":
+                    continue
+
+                key, last_attempt, attempts = row
+                self.results[key] = NegativeResult(
+                    key, float(last_attempt), int(attempts)
+                )
+
+    def save(self):
+        with self.lock:
+            self.__save()
+
+    def __save(self):
+        if not self.dirty:
+            return
+
+        # Write to a temporary file first and then rename it so that the cache
+        # file is never left partially written
+        temp_path = f"{self.cache_file_path}.tmp"
+        with open(temp_path, "w", newline="") as cache_file:
+            writer = csv.writer(cache_file)
+            writer.writerow(self.FIELD_NAMES)
+
+            for result in self.results.values():
+                writer.writerow([result.key, result.last_attempt, result.attempts])
+
+        os.replace(temp_path, self.cache_file_path)
+        self.dirty = False
+
+    def build_key(self, artist: str, title: str, album: str | None = None) -> str:
+        album = normalize(album) if album else ""
+        key = f"{first_artist(artist)}:{normalize(title)}:{album}"
+        return key.lower()
+
+    def retry_delay(self, attempts: int) -> float:
+        """The time to wait before retrying after the given number of attempts."""
+        return min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+    def should_retry(
+        self, artist: str, title: str, album: str | None = None, now=None
+    ) -> bool:
+        result = self.results.get(self.build_key(artist, title, album), None)
+
+        # We have never failed to find this track
+        if result is None:
+            return True
+
+        now = now if now is not None else time.time()
+        return now - result.last_attempt >= self.retry_delay(result.attempts)
+
+    def record_failure(
+        self, artist: str, title: str, album: str | None = None, now=None
+    ):
+        key = self.build_key(artist, title, album)
+        now = now if now is not None else time.time()
+
+        with self.lock:
+            result = self.results.get(key, None)
+
+            if result is None:
+                self.results[key] = NegativeResult(key, now, 1)
+            else:
+                result.last_attempt = now
+                result.attempts += 1
+
+            self.dirty = True
+
+    def record_success(self, artist: str, title: str, album: str | None = None):
+        key = self.build_key(artist, title, album)
+
+        with self.lock:
+            if self.results.pop(key, None) is not None:
+                self.dirty = True
@@ -1,14 +1,53 @@
 import re
+from functools import lru_cache
 
 import unidecode
 
 # TODO: Normalize ’ characters to '
 # Normalize all " to '
 
+# The same strings are normalized many times while building cache keys,
+# searching the library and scoring candidates, so the results are memoized
+CACHE_SIZE = 2**17
+
+ARTIST_DELIMITERS = [
+    ", ",
+    " x ",
+    " X ",
+    " & ",
+    " vs ",
+    " Vs ",
+    " Vs. ",
+    " vs. ",
+    " ft. ",
+    " Ft.",
+    " Feat. ",
+    " feat. ",
+    " featuring ",
+    " Featuring ",
+    " with ",
+    " With ",
+]
+
+# Match the longest delimiter first so that " vs. " is preferred over " vs "
+ARTIST_DELIMITER_PATTERN = re.compile(
+    "|".join(re.escape(d) for d in sorted(ARTIST_DELIMITERS, key=len, reverse=True))
+)
+TITLE_PATTERN = re.compile(r"(\s[\W]*|^[\W]*)([a-z])?")
+SPOTIFY_TITLE_PATTERN = re.compile(r" - (.+ (Remix|Edit|VIP))")
+FEAT_PATTERN = re.compile(r"\([fF](ea)?[tT]\. .+?\)\s*")
+WITH_PATTERN = re.compile(r"\([wW]ith .+?\)\s*")
+CURLY_QUOTED_PATTERN = re.compile(r"(\w+’\w+\s*)")
+QUOTED_PATTERN = re.compile(r"(\w+'\w+\s*)")
+
+# Only use parentheses, normal quotation marks, and remove double quotes
+TITLE_CHARACTERS = str.maketrans({"[": "(", "]": ")", "’": "'", '"': None})
+# Some song titles have a dash in them, and mix names that don't add anything
+TITLE_REMOVALS_PATTERN = re.compile(r" - |\(original mix\)|\(album mix\)")
+
 
 def to_title(string):
-    return re.sub(
-        r"(\s[\W]*|^[\W]*)([a-z])?",
+    return TITLE_PATTERN.sub(
         lambda m: m.group(1) + safe_title(m.group(2)),
         string,
     )
@@ -22,28 +61,9 @@ def force_titlecase(string):
     return safe_title(string.lower().strip())
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def normalize_artists(artist_string):
-    valid_delimters = [
-        ", ",
-        " x ",
-        " X ",
-        " & ",
-        " vs ",
-        " Vs ",
-        " Vs. ",
-        " vs. ",
-        " ft. ",
-        " Ft.",
-        " Feat. ",
-        " feat. ",
-        " featuring ",
-        " Featuring ",
-        " with ",
-        " With ",
-    ]
-
-    for delimiter in valid_delimters:
-        artist_string = artist_string.replace(delimiter, "; ")
+    artist_string = ARTIST_DELIMITER_PATTERN.sub("; ", artist_string)
 
     # Transliterate unicode characters to ASCII
     artist_string = unidecode.unidecode(artist_string)
@@ -57,6 +77,7 @@ def split_artists(artist_string):
     return artists
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def first_artist(artist_string):
     artist_string = normalize_artists(artist_string)
     if "; " in artist_string:
@@ -66,43 +87,56 @@ def first_artist(artist_string):
 
 
 def normalize_spotify_title(title):
-    title = re.sub(r" - (.+ (Remix|Edit|VIP))", r" (\1)", title)
+    title = SPOTIFY_TITLE_PATTERN.sub(r" (\1)", title)
     return title.strip()
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def remove_feat(title):
     # title = title.replace("featuring", "feat")
-    title = re.sub(r"\([fF](ea)?[tT]\. .+?\)\s*", "", title)
-    title = re.sub(r"\([wW]ith .+?\)\s*", "", title)
+    title = FEAT_PATTERN.sub("", title)
+    title = WITH_PATTERN.sub("", title)
     return title.strip()
 
 
 def remove_quoted_text(title):
-    title = re.sub(r"(\w+’\w+\s*)", "", title)
-    title = re.sub(r"(\w+'\w+\s*)", "", title)
+    title = CURLY_QUOTED_PATTERN.sub("", title)
+    title = QUOTED_PATTERN.sub("", title)
     return title.strip()
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def normalize(title):
     # Transliterate unicode characters to ASCII
     title = unidecode.unidecode(title)
     title = normalize_spotify_title(title)
     # title = remove_quoted_text(title)
-    title = (
-        title.lower()
-        .replace("[", "(")  # Only use parentheses
-        .replace("]", ")")
-        # .replace('"', "'")  # Only use single quotes
-        .replace(" - ", " ")  # Some song titles have a dash in them
-        # MusicBrainz uses ’ while other apps use '
-        # Normalize all title quotes to '
-        .replace("’", "'")  # Only use normal quotation marks
-        .replace('"', "")  # Remove quotes
-        .replace("(original mix)", "")  # Remove original mix
-        .replace("(album mix)", "")  # Remove original mix
-        .strip()
-    )
+    title = title.lower().translate(TITLE_CHARACTERS)
+    # A dash is replaced by a space, the mix names are removed
+    title = TITLE_REMOVALS_PATTERN.sub(
+        lambda m: " " if m.group(0) == " - " else "", title
+    ).strip()
 
     # Note that we remove the feat last in case brackets were used
     # instead of parentheses
     return remove_feat(title)
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """Returns the memoization hits, misses and size of each cached function."""
+    stats = {}
+
+    for function in [normalize, normalize_artists, first_artist, remove_feat]:
+        info = function.cache_info()
+        stats[function.__name__] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+        }
+
+    return stats
+
+
+def clear_caches():
+    for function in [normalize, normalize_artists, first_artist, remove_feat]:
+        function.cache_clear()
@@ -1,3 +1,5 @@
+from .stats import get_stats
+
 LOG_RATE_LIMIT_CALLS = False
 RATE_LIMIT_CALLS = 0
 
@@ -7,10 +9,12 @@ def enable_rate_limit_logging():
     LOG_RATE_LIMIT_CALLS = True
 
 
-def log_rate_limited_call(name):
+def log_rate_limited_call(name, service="musicbrainz"):
     global LOG_RATE_LIMIT_CALLS
     global RATE_LIMIT_CALLS
 
+    get_stats().record_call(service, name)
+
     if LOG_RATE_LIMIT_CALLS:
         RATE_LIMIT_CALLS += 1
         print(f"{RATE_LIMIT_CALLS}. Rate limited call: {name}")
@@ -1,7 +1,21 @@
+import json
+import os
 from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Iterable
+
+from beets.logging import DEBUG, Logger, getLogger
 
 from .recording import RecordingInfo
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Ratings from Last.fm are only loved tracks, so they don't count as conflicts
+LASTFM_SOURCE = "lastfm"
+
 
 class Conflict:
     def __init__(self, mbid: str):
@@ -14,13 +28,21 @@ class RatingStore:
     Considered the single source of truth that importers and exporters
     interact with."""
 
-    def __init__(self):
+    def __init__(self, logger: Logger | None = None, conflict_level=DEBUG):
         self.ratings: dict[str, RecordingInfo] = {}  # Key: mbid, Value: RecordingInfo
-        self.rating_sets: dict[
-            str, set[str]
-        ] = {}  # Key: rating_set:str, Value: set[str]
+        self.rating_sets: dict[str, set[str]] = (
+            {}
+        )  # Key: rating_set:str, Value: set[str]
         self.rating_set_all: set[str] = set()
         self.conflicts: dict[str, Conflict] = {}  # Key: mbid, Value: Conflict
+        # The number of non Last.fm sources that gave each rating, so that a
+        # conflict is found without looking at every source.
+        # Key: mbid, Value: dict of rating to number of sources
+        self.rating_counts: dict[str, dict[int, int]] = {}
+        self.logger = logger if logger else getLogger("beets")
+        # Conflicts are common in large imports, so by default they are only
+        # shown with beet -v and are written to the conflict report instead
+        self.conflict_level = conflict_level
 
     def add_rating(self, recording: RecordingInfo, rating_set: str, overwrite=False):
         # If the recording is already present, reuse the existing rating unless
@@ -44,37 +66,113 @@ class RatingStore:
                 self.rating_sets[rating_set] = set()
 
             # Add this rating set as a source so we can check for conflicts
-            self.ratings[recording.mbid].sources[rating_set] = recording.rating
+            sources = self.ratings[recording.mbid].sources
+            previous = sources.get(rating_set, None)
+            sources[rating_set] = recording.rating
             # Add the recording to the rating set so we can compare for differences
             self.rating_sets[rating_set].add(recording.mbid)
 
-        # Filter out LastFM source and get the remaining sources
-        non_lastfm_ratings = {
-            source: rating
-            for source, rating in self.ratings[recording.mbid].sources.items()
-            if source != "lastfm"
-        }
+            if rating_set != LASTFM_SOURCE:
+                self.check_conflict(recording, rating_set, previous)
+
+    def add_ratings(
+        self,
+        recordings: Iterable[RecordingInfo],
+        rating_set: str,
+        overwrite=False,
+    ) -> int:
+        """Adds many ratings to the same rating set, the same way add_rating
+        would. recordings may be a generator, so importers can stream their
+        ratings without building a list first. The rating sets are updated once
+        at the end instead of for each recording. Returns the number of ratings
+        that were added."""
+        ratings = self.ratings
+        check_conflicts = bool(rating_set) and rating_set != LASTFM_SOURCE
+        mbids = []
+
+        try:
+            for recording in recordings:
+                existing = ratings.get(recording.mbid, None)
+
+                if existing is None:
+                    ratings[recording.mbid] = existing = recording
+                elif overwrite:
+                    existing.rating = recording.rating
+
+                mbids.append(recording.mbid)
+                if rating_set:
+                    previous = existing.sources.get(rating_set, None)
+                    existing.sources[rating_set] = recording.rating
+                    if check_conflicts:
+                        self.check_conflict(recording, rating_set, previous)
+        finally:
+            # The ratings added before an error are still added to the sets
+            self.rating_set_all.update(mbids)
+            if rating_set:
+                self.rating_sets.setdefault(rating_set, set()).update(mbids)
+
+        return len(mbids)
 
-        # Get all of the ratings from the non last-fm sources
-        all_ratings = non_lastfm_ratings.values()
+    def check_conflict(
+        self, recording: RecordingInfo, rating_set: str, previous: int | None
+    ):
+        """Counts a new rating from rating_set in place of its previous rating,
+        so a source that rates the same recording twice (such as two MusicBrainz
+        star collections) never conflicts with itself. The sources conflict
+        while they gave more than one distinct rating, which only takes two
+        count updates to check. The conflict is only logged when the recording
+        starts conflicting."""
+        counts = self.rating_counts.setdefault(recording.mbid, {})
+        if previous in counts:
+            counts[previous] -= 1
+            if counts[previous] == 0:
+                del counts[previous]
+        counts[recording.rating] = counts.get(recording.rating, 0) + 1
 
-        # Check to see if there is any difference in the non last-fm sources
-        # This means that there is a conflict between the sources
-        if len(all_ratings) > 1 and max(all_ratings) != min(all_ratings):
+        if len(counts) > 1:
             # This is the first conflict for this recording, create it
             if recording.mbid not in self.conflicts:
                 self.conflicts[recording.mbid] = Conflict(recording.mbid)
+                self.conflicts[recording.mbid].sources = self.ratings[
+                    recording.mbid
+                ].sources
+                self.log_conflict(recording, rating_set)
+        else:
+            # A later rating from the same source resolved the conflict
+            self.conflicts.pop(recording.mbid, None)
 
-            # Add the conflicting recording to the conflict
-            self.conflicts[recording.mbid].sources = self.ratings[
-                recording.mbid
-            ].sources
+    def log_conflict(self, recording: RecordingInfo, rating_set: str):
+        self.logger.log(
+            self.conflict_level,
+            "Conflict found in {0}: {1} -- {2} New:{3} Existing:{4}",
+            rating_set,
+            recording.artist,
+            recording.title,
+            recording.rating,
+            self.ratings[recording.mbid].rating,
+        )
 
-            print(
-                f"Conflict found in {rating_set}: "
-                f"{recording.artist} -- {recording.title} "
-                f"New:{recording.rating} Existing:{self.ratings[recording.mbid].rating}"
-            )
+    def write_conflict_report(self, path: str) -> int:
+        """Writes every conflict to path as JSON, replacing the report from the
+        last sync. Returns the number of conflicts."""
+        report = [
+            {
+                "mbid": mbid,
+                "artist": self.ratings[mbid].artist,
+                "title": self.ratings[mbid].title,
+                "rating": self.ratings[mbid].rating,
+                "sources": conflict.sources,
+            }
+            for mbid, conflict in sorted(self.conflicts.items())
+        ]
+
+        if report:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+        elif os.path.exists(path):
+            os.remove(path)
+
+        return len(report)
 
     def get_missing_ratings_for_set(self, rating_set: str) -> set[str]:
         return (
@@ -83,6 +181,299 @@ class RatingStore:
             else self.rating_set_all
         )
 
+    def get_sources(self, mbid: str) -> dict[str, int]:
+        """The rating that each source gave a recording."""
+        return self.ratings[mbid].sources
+
+    def get_conflicts(self) -> set[str]:
+        """The recordings whose ratings disagree between sources."""
+        return set(self.conflicts)
+
+    def get_rating_differences(self, first_set: str, second_set: str) -> set[str]:
+        """The recordings that are in both rating sets with different ratings."""
+        return {
+            mbid
+            for mbid, recording in self.ratings.items()
+            if first_set in recording.sources
+            and second_set in recording.sources
+            and recording.sources[first_set] != recording.sources[second_set]
+        }
+
+    def mark_complete(self, rating_set: str):
+        """Marks every rating as present in rating_set, after an exporter has
+        written all of them."""
+        self.rating_sets[rating_set] = self.rating_set_all
+
+
+class Bitset:
+    """A set of integer ids, stored as one bit per id."""
+
+    __slots__ = ("bits",)
+
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, id: int):
+        index = id >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (id & 7)
+
+    def __contains__(self, id: int) -> bool:
+        index = id >> 3
+        return index < len(self.bits) and bool(self.bits[index] >> (id & 7) & 1)
+
+    def update(self, ids: list[int]):
+        """Adds many ids at once."""
+        if not ids:
+            return
+
+        size = (max(ids) >> 3) + 1
+        if size > len(self.bits):
+            self.bits.extend(bytes(size - len(self.bits)))
+
+        if numpy is not None:
+            ids = numpy.asarray(ids, dtype=numpy.int64)
+            bits = numpy.frombuffer(self.bits, numpy.uint8)
+            numpy.bitwise_or.at(bits, ids >> 3, (1 << (ids & 7)).astype(numpy.uint8))
+            del bits
+            return
+
+        for id in ids:
+            self.bits[id >> 3] |= 1 << (id & 7)
+
+    def fill(self, size: int):
+        """Adds every id below size."""
+        self.bits = bytearray(b"\xff" * (size >> 3))
+        if size & 7:
+            self.bits.append((1 << (size & 7)) - 1)
+
+    def ids(self, size: int, present: bool = True) -> list[int]:
+        """The ids below size that are in the set, or that aren't in the set if
+        present is False."""
+        if numpy is not None:
+            bits = numpy.zeros((size + 7) >> 3, dtype=numpy.uint8)
+            count = min(len(bits), len(self.bits))
+            bits[:count] = numpy.frombuffer(self.bits, numpy.uint8, count)
+            flags = numpy.unpackbits(bits, count=size, bitorder="little")
+            return numpy.flatnonzero(flags == present).tolist()
+
+        # Whole bytes are skipped when none of their ids match
+        skip = 0x00 if present else 0xFF
+        result = []
+        for index in range((size + 7) >> 3):
+            byte = self.bits[index] if index < len(self.bits) else 0
+            if byte == skip:
+                continue
+
+            start = index << 3
+            for bit in range(min(8, size - start)):
+                if bool(byte >> bit & 1) == present:
+                    result.append(start + bit)
+
+        return result
+
+
+class ColumnarRatingStore(RatingStore):
+    """A RatingStore for very large rating sets. Each mbid is given an integer
+    id, the ratings from each source are kept in one array indexed by id and
+    the members of each rating set are kept in a bitset. Missing ratings,
+    conflicts and differences are computed over whole columns at once, using
+    NumPy if it is installed.
+
+    The recordings are still available through ratings, and rating_sets and
+    rating_set_all are built from the bitsets when they are read."""
+
+    # Stored in the rating arrays for recordings without a rating from a source
+    UNRATED = -1
+
+    def __init__(self, logger: Logger | None = None, conflict_level=DEBUG):
+        self.ratings: dict[str, RecordingInfo] = {}  # Key: mbid, Value: RecordingInfo
+        self.logger = logger if logger else getLogger("beets")
+        self.conflict_level = conflict_level
+        self.ids: dict[str, int] = {}  # Key: mbid, Value: id
+        self.mbids: list[str] = []  # Index: id, Value: mbid
+        # Key: rating_set, Value: rating for each id
+        self.columns: dict[str, array] = {}
+        # Key: rating_set, Value: the ids in the set
+        self.members: dict[str, Bitset] = {}
+        # The ids that are currently conflicting, so each conflict is only
+        # logged once
+        self.conflicting: set[int] = set()
+
+    @property
+    def rating_set_all(self):
+        return self.ratings.keys()
+
+    @property
+    def rating_sets(self) -> dict[str, set[str]]:
+        return {
+            rating_set: {self.mbids[id] for id in bitset.ids(len(self.mbids))}
+            for rating_set, bitset in self.members.items()
+        }
+
+    @property
+    def conflicts(self) -> dict[str, Conflict]:
+        conflicts = {}
+        for mbid in self.get_conflicts():
+            conflict = Conflict(mbid)
+            conflict.sources = self.get_sources(mbid)
+            conflicts[mbid] = conflict
+        return conflicts
+
+    def get_sources(self, mbid: str) -> dict[str, int]:
+        id = self.ids[mbid]
+        return {
+            rating_set: column[id]
+            for rating_set, column in self.columns.items()
+            if id < len(column) and column[id] != self.UNRATED
+        }
+
+    def add_recording(self, recording: RecordingInfo, overwrite: bool) -> int:
+        """Adds a recording if it's new and returns its id."""
+        existing = self.ratings.get(recording.mbid, None)
+
+        if existing is None:
+            id = len(self.mbids)
+            self.ratings[recording.mbid] = recording
+            self.ids[recording.mbid] = id
+            self.mbids.append(recording.mbid)
+            return id
+
+        if overwrite:
+            existing.rating = recording.rating
+        return self.ids[recording.mbid]
+
+    def get_column(self, rating_set: str, size: int) -> array:
+        """The column for rating_set, grown to hold at least size ids."""
+        if rating_set not in self.columns:
+            self.columns[rating_set] = array("b")
+            self.members[rating_set] = Bitset()
+
+        column = self.columns[rating_set]
+        if size > len(column):
+            column.extend(array("b", [self.UNRATED]) * (size - len(column)))
+        return column
+
+    def add_rating(self, recording: RecordingInfo, rating_set: str, overwrite=False):
+        id = self.add_recording(recording, overwrite)
+
+        if not rating_set:
+            return
+
+        self.get_column(rating_set, id + 1)[id] = recording.rating
+        self.members[rating_set].add(id)
+
+        if rating_set != LASTFM_SOURCE:
+            self.check_conflict(recording, rating_set, id)
+
+    def add_ratings(
+        self,
+        recordings: Iterable[RecordingInfo],
+        rating_set: str,
+        overwrite=False,
+    ) -> int:
+        ids = []
+        added = []
+
+        try:
+            for recording in recordings:
+                ids.append(self.add_recording(recording, overwrite))
+                added.append(recording)
+        finally:
+            # The ratings added before an error are still added to the set
+            if rating_set:
+                self.add_to_set(ids, added, rating_set)
+
+        return len(ids)
+
+    def add_to_set(self, ids: list[int], added: list[RecordingInfo], rating_set: str):
+        # Grow the column once for the whole batch
+        column = self.get_column(rating_set, len(self.mbids))
+        for id, recording in zip(ids, added):
+            column[id] = recording.rating
+        self.members[rating_set].update(ids)
+
+        if rating_set != LASTFM_SOURCE:
+            for id, recording in zip(ids, added):
+                self.check_conflict(recording, rating_set, id)
+
+    def check_conflict(self, recording: RecordingInfo, rating_set: str, id: int):
+        # Only the columns for this recording are checked, not every recording
+        rated = [
+            column[id]
+            for source, column in self.columns.items()
+            if source != LASTFM_SOURCE
+            and id < len(column)
+            and column[id] != self.UNRATED
+        ]
+        if rated and max(rated) != min(rated):
+            if id not in self.conflicting:
+                self.conflicting.add(id)
+                self.log_conflict(recording, rating_set)
+        else:
+            self.conflicting.discard(id)
+
+    def get_missing_ratings_for_set(self, rating_set: str) -> set[str]:
+        if rating_set not in self.members:
+            return set(self.ratings)
+
+        missing = self.members[rating_set].ids(len(self.mbids), present=False)
+        return {self.mbids[id] for id in missing}
+
+    def column(self, rating_set: str) -> array:
+        """The ratings from rating_set for every id, padded with UNRATED."""
+        column = self.columns.get(rating_set, array("b"))
+        return column + array("b", [self.UNRATED]) * (len(self.mbids) - len(column))
+
+    def get_conflicts(self) -> set[str]:
+        columns = [
+            self.column(rating_set)
+            for rating_set in self.columns
+            if rating_set != LASTFM_SOURCE
+        ]
+        if len(columns) < 2:
+            return set()
+
+        if numpy is not None:
+            table = numpy.stack([numpy.frombuffer(c, numpy.int8) for c in columns])
+            rated = table != self.UNRATED
+            highest = numpy.where(rated, table, numpy.iinfo(numpy.int8).min).max(0)
+            lowest = numpy.where(rated, table, numpy.iinfo(numpy.int8).max).min(0)
+            conflicting = (rated.sum(0) > 1) & (highest != lowest)
+            return {self.mbids[id] for id in numpy.flatnonzero(conflicting).tolist()}
+
+        conflicts = set()
+        for id, ratings in enumerate(zip(*columns)):
+            rated = [rating for rating in ratings if rating != self.UNRATED]
+            if rated and max(rated) != min(rated):
+                conflicts.add(self.mbids[id])
+        return conflicts
+
+    def get_rating_differences(self, first_set: str, second_set: str) -> set[str]:
+        first = self.column(first_set)
+        second = self.column(second_set)
+
+        if numpy is not None:
+            first = numpy.frombuffer(first, numpy.int8)
+            second = numpy.frombuffer(second, numpy.int8)
+            different = (
+                (first != self.UNRATED) & (second != self.UNRATED) & (first != second)
+            )
+            return {self.mbids[id] for id in numpy.flatnonzero(different).tolist()}
+
+        return {
+            self.mbids[id]
+            for id, (a, b) in enumerate(zip(first, second))
+            if a != self.UNRATED and b != self.UNRATED and a != b
+        }
+
+    def mark_complete(self, rating_set: str):
+        if rating_set not in self.members:
+            self.columns[rating_set] = array("b")
+            self.members[rating_set] = Bitset()
+        self.members[rating_set].fill(len(self.mbids))
+
 
 class RatingStoreImporter(ABC):
     @abstractmethod
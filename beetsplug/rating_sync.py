@@ -1,3 +1,4 @@
+import logging
 import sys
 
 import musicbrainzngs
@@ -12,16 +13,73 @@ from .exporter.csv_exporter import CSVExporter
 from .exporter.mb_rating_collection_exporter import MBRatingCollectionExporter
 from .importer.last_fm_importer import LastFMLovedTrackImporter
 from .importer.mb_rating_collection_importer import MBRatingCollectionImporter
+from .library_index import LibraryIndex
 from .mb_user import MBCache
-from .rating_store import RatingStore, RatingStoreExporter, RatingStoreImporter
-from .track_cache import MBTrackCache
+from .negative_cache import NegativeCache
+from .rating_store import (
+    ColumnarRatingStore,
+    RatingStore,
+    RatingStoreExporter,
+    RatingStoreImporter,
+)
+from .response_cache import ResponseCache
+from .scheduler import RequestScheduler, set_scheduler
+from .search_plan import DEFAULT_SEARCH_PLAN, SearchPlan
+from .stats import SyncStats, set_stats
+from .track_cache import MBTrackCache, SQLiteTrackCache
 from .track_finder import LibraryTrackFinder
 
 
 class RatingSyncPlugin(BeetsPlugin):
     def __init__(self):
         super().__init__()
-        self.track_cache = MBTrackCache()
+        self.config.add(
+            {
+                # Load the whole library into memory once instead of querying
+                # the library for each track. Faster for large imports.
+                "library_index": False,
+                # Number of songs written to the Beets library per transaction.
+                # Zero writes all of the songs in a single transaction.
+                "write_chunk_size": 0,
+                # Storage backend for the track cache, either csv or sqlite
+                "track_cache": "csv",
+                # Number of worker threads used to run searches while waiting
+                # for the MusicBrainz rate limit
+                "workers": 4,
+                # Cache MusicBrainz lookups and searches between runs
+                "response_cache": True,
+                # Maximum size of the response cache in megabytes
+                "response_cache_size": 100,
+                # Number of days that lookups and searches are cached
+                "response_cache_ttl": 30,
+                "search_cache_ttl": 7,
+                # Number of days to wait before searching again for a track that
+                # wasn't found. The wait doubles after each failed search.
+                "retry_delay": 1,
+                # The searches made to find a track, in order
+                "search_plan": DEFAULT_SEARCH_PLAN,
+                # Maximum number of MusicBrainz requests and seconds spent
+                # searching for a single track. Zero means there is no limit.
+                "search_call_budget": 12,
+                "search_deadline": 60,
+                # Number of threads looking up the albums of Last.fm loved tracks
+                "lastfm_workers": 4,
+                # Maximum size of each batch of ratings submitted to MusicBrainz
+                # in kilobytes
+                "rating_batch_size": 64,
+                # Storage for the ratings during a sync, either dict or columnar.
+                # The columnar store uses less memory for very large rating sets.
+                "rating_store": "dict",
+                # Level at which conflicts between rating sources are logged.
+                # Every conflict is also written to conflicts.json.
+                "conflict_log_level": "debug",
+            }
+        )
+
+        if self.config["track_cache"].as_choice(["csv", "sqlite"]) == "sqlite":
+            self.track_cache = SQLiteTrackCache()
+        else:
+            self.track_cache = MBTrackCache()
         self.item_types = {"rating": types.INTEGER}
 
         # Check for MusicBrainz credentials
@@ -45,7 +103,10 @@ class RatingSyncPlugin(BeetsPlugin):
             "0.1b",
             "https://github.com/watkins-matt/beets-rating-sync",
         )
-        musicbrainzngs.set_rate_limit(limit_or_interval=1.0, new_requests=1)
+        # Every request goes through the shared scheduler, which enforces the
+        # rate limit. The musicbrainzngs limiter would limit each request a
+        # second time and serialize the worker threads.
+        musicbrainzngs.set_rate_limit(False)
 
         # Check for LastFM credentials
         try:
@@ -59,6 +120,20 @@ class RatingSyncPlugin(BeetsPlugin):
         ratingsync = Subcommand(
             "ratingsync", help="Synchronizes ratings with provided sources."
         )
+        ratingsync.parser.add_option(
+            "-p",
+            "--pretend",
+            action="store_true",
+            default=False,
+            help="show the changes that would be made to the library, "
+            "MusicBrainz and the ratings file without making them",
+        )
+        ratingsync.parser.add_option(
+            "--stats",
+            action="store_true",
+            default=False,
+            help="show the time and requests spent in each phase of the sync",
+        )
         ratingsync.func = self.rating_sync  # type: ignore
         return [ratingsync]
 
@@ -72,33 +147,132 @@ class RatingSyncPlugin(BeetsPlugin):
     # Export to CSV
     def rating_sync(self, lib, opts, args):
         mb_cache = MBCache()
-        track_finder = LibraryTrackFinder(lib, False, self.track_cache)
-        rating_store = RatingStore()
+        stats = SyncStats()
+        set_stats(stats)
+
+        with stats.phase("setup"):
+            rating_store, importers, exporters, finish = self.prepare_sync(
+                lib, opts, mb_cache
+            )
+
+        for importer in importers:
+            print("Importing from %s" % (type(importer).__name__))
+            with stats.phase(f"import:{type(importer).__name__}"):
+                importer.import_songs(rating_store)
+
+        for exporter in exporters:
+            with stats.phase(f"export:{type(exporter).__name__}"):
+                exporter.export_songs(rating_store)
+
+        with stats.phase("save"):
+            finish()
+
+        conflicts = rating_store.write_conflict_report(
+            mb_cache.get_conflict_report_path()
+        )
+        if conflicts:
+            self._log.info(
+                "Found {0} conflicting ratings, see {1}",
+                conflicts,
+                mb_cache.get_conflict_report_path(),
+            )
+
+        stats.write(mb_cache.get_stats_path())
+        if opts.stats:
+            stats.report()
+
+    def prepare_sync(self, lib, opts, mb_cache: MBCache):
+        """Creates the rating store, importers and exporters for a sync. Also
+        returns a function that saves the caches once the sync is done."""
+        # All MusicBrainz requests share one scheduler that enforces the rate limit
+        scheduler = RequestScheduler(
+            max_workers=self.config["workers"].get(int),
+            response_cache=self.create_response_cache(mb_cache),
+        )
+        set_scheduler(scheduler)
+
+        index = LibraryIndex(lib) if self.config["library_index"].get(bool) else None
+        negative_cache = NegativeCache(
+            mb_cache.get_negative_cache_path(),
+            base_delay=self.config["retry_delay"].as_number() * 24 * 60 * 60,
+        )
+        search_plan = SearchPlan(
+            self.config["search_plan"].as_str_seq(),
+            self.config["search_call_budget"].get(int),
+            self.config["search_deadline"].as_number(),
+        )
+        track_finder = LibraryTrackFinder(
+            lib, False, self.track_cache, index, negative_cache, search_plan
+        )
+        conflict_level = logging.getLevelName(
+            self.config["conflict_log_level"]
+            .as_choice(["debug", "info", "warning"])
+            .upper()
+        )
+        if self.config["rating_store"].as_choice(["dict", "columnar"]) == "columnar":
+            rating_store = ColumnarRatingStore(self._log, conflict_level)
+        else:
+            rating_store = RatingStore(self._log, conflict_level)
         importers: list[RatingStoreImporter] = []
         exporters: list[RatingStoreExporter] = []
 
         if self.lastfm_user:
             last_import = LastFMLovedTrackImporter(
-                self.lastfm_user, mb_cache.get_default_dir(), 4, track_finder
+                self.lastfm_user,
+                mb_cache.get_default_dir(),
+                4,
+                track_finder,
+                self.config["lastfm_workers"].get(int),
             )
             importers.append(last_import)
 
         if self.mb_user:
             mb_user = mb_cache.get_user(self.mb_user, self.mb_pass)
             mb_import = MBRatingCollectionImporter(mb_user, mb_cache, track_finder)
-            mb_exporter = MBRatingCollectionExporter(mb_user)
-            beet_exporter = BeetRatingExporter(lib)
+            mb_exporter = MBRatingCollectionExporter(
+                mb_user,
+                mb_cache,
+                int(self.config["rating_batch_size"].as_number() * 1024),
+                opts.pretend,
+            )
+            beet_exporter = BeetRatingExporter(
+                lib,
+                index,
+                self.config["write_chunk_size"].get(int),
+                opts.pretend,
+            )
             importers.append(mb_import)
             exporters.append(mb_exporter)
-            exporters.append(CSVExporter(mb_cache.get_rating_cache_path()))
+            exporters.append(
+                CSVExporter(mb_cache.get_rating_cache_path(), dry_run=opts.pretend)
+            )
             exporters.append(beet_exporter)
 
-        for importer in importers:
-            print("Importing from %s" % (type(importer).__name__))
-            importer.import_songs(rating_store)
+        def finish():
+            # Make sure to save the track cache, unless this is a dry run
+            if not opts.pretend:
+                self.track_cache.save()
+                negative_cache.save()
+            scheduler.shutdown()
+            search_plan.report()
 
-        for exporter in exporters:
-            exporter.export_songs(rating_store)
+        return rating_store, importers, exporters, finish
+
+    def create_response_cache(self, mb_cache: MBCache) -> ResponseCache | None:
+        if not self.config["response_cache"].get(bool):
+            return None
 
-        # Make sure to save the track cache
-        self.track_cache.save()
+        day = 24 * 60 * 60
+        lookup_ttl = self.config["response_cache_ttl"].as_number() * day
+        search_ttl = self.config["search_cache_ttl"].as_number() * day
+
+        return ResponseCache(
+            mb_cache.get_response_cache_path(),
+            ttls={
+                "get_release_by_id": lookup_ttl,
+                "get_recording_by_id": lookup_ttl,
+                "search_release_groups": search_ttl,
+                "search_recordings": search_ttl,
+            },
+            max_bytes=int(self.config["response_cache_size"].as_number() * 1024 * 1024),
+        )
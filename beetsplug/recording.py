@@ -2,6 +2,8 @@ from typing import Any
 
 
 class MBRecording:
+    __slots__ = ("title", "length", "mbid")
+
     def __init__(self, title: str, length: int, mbid: str):
         self.title = title
         self.length = int(length)
@@ -12,6 +14,19 @@ class MBRecording:
 
 
 class RecordingInfo:
+    # Large libraries keep hundreds of thousands of these around, so they are
+    # slotted, and extra and sources are only allocated when they are used
+    __slots__ = (
+        "artist",
+        "album",
+        "title",
+        "length",
+        "mbid",
+        "rating",
+        "_extra",
+        "_sources",
+    )
+
     def __init__(
         self,
         artist: str,
@@ -27,8 +42,21 @@ class RecordingInfo:
         self.length = int(length)
         self.mbid = mbid
         self.rating = rating
-        self.extra: dict[str, Any] = {}
-        self.sources: dict[str, int] = {}  # Key: source, Value: rating
+        self._extra: dict[str, Any] | None = None
+        self._sources: dict[str, int] | None = None
+
+    @property
+    def extra(self) -> dict[str, Any]:
+        if self._extra is None:
+            self._extra = {}
+        return self._extra
+
+    @property
+    def sources(self) -> dict[str, int]:
+        """Key: source, Value: rating"""
+        if self._sources is None:
+            self._sources = {}
+        return self._sources
 
     def valid(self) -> bool:
         return (
@@ -0,0 +1,146 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from .stats import get_stats
+
+DAY = 24 * 60 * 60
+
+
+class ResponseCache:
+    """A persistent cache of MusicBrainz responses stored in an SQLite database.
+    Responses are keyed by the endpoint and the arguments of the request, such
+    as the id and includes. Each endpoint can have its own time to live, and
+    the least recently used responses are evicted once the cache grows larger
+    than max_bytes."""
+
+    # Time to live in seconds for each endpoint that isn't given its own
+    DEFAULT_TTLS = {
+        "get_release_by_id": 30 * DAY,
+        "get_recording_by_id": 30 * DAY,
+        "search_release_groups": 7 * DAY,
+        "search_recordings": 7 * DAY,
+    }
+
+    def __init__(
+        self,
+        path: str,
+        ttls: dict[str, float] | None = None,
+        default_ttl: float = 7 * DAY,
+        max_bytes: int = 100 * 1024 * 1024,
+    ):
+        self.path = path
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls if ttls else {})
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        # Lookups may be made from the scheduler's worker threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed "
+                "ON responses (accessed)"
+            )
+
+        self.total_bytes = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def build_key(self, endpoint: str, args: tuple, kwargs: dict) -> str:
+        # The order of the includes doesn't change the response
+        kwargs = {
+            key: sorted(value) if isinstance(value, list) else value
+            for key, value in kwargs.items()
+        }
+        return f"{endpoint}:{json.dumps([list(args), kwargs], sort_keys=True)}"
+
+    def get(self, endpoint: str, args: tuple, kwargs: dict) -> Any | None:
+        key = self.build_key(endpoint, args, kwargs)
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                get_stats().record_cache("response_cache", False)
+                return None
+
+            value, created = row
+
+            # The response is too old, it needs to be requested again
+            if now - created > self.ttls.get(endpoint, self.default_ttl):
+                self.misses += 1
+                get_stats().record_cache("response_cache", False)
+                return None
+
+            # Access times are committed with the next write
+            self.connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+
+        self.hits += 1
+        get_stats().record_cache("response_cache", True)
+        return json.loads(value)
+
+    def put(self, endpoint: str, args: tuple, kwargs: dict, response: Any):
+        key = self.build_key(endpoint, args, kwargs)
+        value = json.dumps(response)
+        size = len(value)
+        now = time.time()
+
+        # Never store a response that is larger than the entire cache
+        if size > self.max_bytes:
+            return
+
+        with self.lock, self.connection:
+            existing = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if existing:
+                self.total_bytes -= existing[0]
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, endpoint, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, value, size, now, now),
+            )
+            self.total_bytes += size
+
+            if self.total_bytes > self.max_bytes:
+                self.__evict()
+
+    def __evict(self):
+        """Removes the least recently used responses until the cache fits."""
+        rows = self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        )
+
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+
+from .rate_limit_log import log_rate_limited_call
+from .response_cache import ResponseCache
+from .stats import get_stats
+
+
+class TokenBucket:
+    """A thread-safe token bucket. Each request takes one token, and tokens are
+    refilled at a fixed rate up to the capacity of the bucket."""
+
+    def __init__(self, rate: float = 1.0, capacity: int = 1):
+        self.rate = rate  # Tokens per second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+        # Total time spent waiting for a token, in seconds
+        self.sleep_time = 0.0
+
+    def acquire(self):
+        """Takes a token from the bucket, waiting until one is available. Only
+        one thread waits at a time, so tokens are handed out in order."""
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.last_refill
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+
+                wait = (1.0 - self.tokens) / self.rate
+                self.sleep_time += wait
+                get_stats().record_sleep(wait)
+                time.sleep(wait)
+
+
+class RequestScheduler:
+    """Runs rate limited requests. Every request goes through a single token
+    bucket so that the global rate limit is honored, while work submitted to
+    the scheduler runs on a pool of worker threads. This allows one worker to
+    prepare and parse results while another is waiting on the network."""
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: int = 1,
+        max_workers: int = 4,
+        response_cache: ResponseCache | None = None,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_workers = max_workers
+        self.response_cache = response_cache
+        self.executor: ThreadPoolExecutor | None = None
+        self.lock = threading.Lock()
+        # Counts the calls made by each thread
+        self.local = threading.local()
+
+    def call(self, name: str, function: Callable, *args, **kwargs) -> Any:
+        """Makes a single rate limited call on the current thread."""
+        log_rate_limited_call(name)
+        self.local.calls = self.calls_made() + 1
+
+        start = time.monotonic()
+        self.bucket.acquire()
+        self.local.wait = time.monotonic() - start
+        self.local.total_wait = self.wait_time() + self.local.wait
+
+        return function(*args, **kwargs)
+
+    def calls_made(self) -> int:
+        """The number of rate limited calls made by the current thread."""
+        return getattr(self.local, "calls", 0)
+
+    def last_wait(self) -> float:
+        """The time that the last call on the current thread spent waiting for
+        the rate limiter, in seconds."""
+        return getattr(self.local, "wait", 0.0)
+
+    def wait_time(self) -> float:
+        """The total time that calls on the current thread have spent waiting
+        for the rate limiter, in seconds."""
+        return getattr(self.local, "total_wait", 0.0)
+
+    def cached_call(self, name: str, function: Callable, *args, **kwargs) -> Any:
+        """Makes a rate limited call, unless the response is already in the
+        response cache. Only use this for lookups that don't change often, and
+        never for requests that modify anything."""
+        if self.response_cache is None:
+            return self.call(name, function, *args, **kwargs)
+
+        response = self.response_cache.get(name, args, kwargs)
+        if response is None:
+            response = self.call(name, function, *args, **kwargs)
+            self.response_cache.put(name, args, kwargs, response)
+
+        return response
+
+    def submit(self, function: Callable, *args, **kwargs) -> Future:
+        """Runs function on a worker thread. Any requests made by the function
+        should be made through call()."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="ratingsync"
+                )
+
+        return self.executor.submit(function, *args, **kwargs)
+
+    def map(self, function: Callable, items: Iterable) -> list:
+        """Runs function for each item on the worker threads and returns the
+        results in the same order as items."""
+        futures = [self.submit(function, item) for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+        if self.response_cache is not None:
+            self.response_cache.close()
+            self.response_cache = None
+
+
+_scheduler: RequestScheduler | None = None
+
+
+def get_scheduler() -> RequestScheduler:
+    """Gets the scheduler shared by all MusicBrainz requests."""
+    global _scheduler
+
+    if _scheduler is None:
+        _scheduler = RequestScheduler()
+
+    return _scheduler
+
+
+def set_scheduler(scheduler: RequestScheduler):
+    global _scheduler
+    _scheduler = scheduler
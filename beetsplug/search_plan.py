@@ -0,0 +1,143 @@
+import threading
+import time
+from dataclasses import dataclass
+
+from .scheduler import get_scheduler
+
+
+@dataclass(frozen=True)
+class SearchStage:
+    """A single search made while looking for a track. Searches either the
+    release groups or the recordings, using the album or the title as the
+    release name."""
+
+    name: str
+    kind: str  # Either "releases" or "recordings"
+    release_from: str  # Either "album" or "title"
+    strict: bool
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    """The arguments for a single search stage. Each stage gets its own copy so
+    that one stage can never change the arguments of the next."""
+
+    artist: str
+    release: str
+    title: str
+
+
+SEARCH_STAGES = {
+    stage.name: stage
+    for stage in [
+        SearchStage("release_album_strict", "releases", "album", True),
+        SearchStage("release_album", "releases", "album", False),
+        SearchStage("release_title_strict", "releases", "title", True),
+        SearchStage("release_title", "releases", "title", False),
+        SearchStage("recording_strict", "recordings", "title", True),
+        SearchStage("recording", "recordings", "title", False),
+    ]
+}
+
+DEFAULT_SEARCH_PLAN = [
+    "release_album_strict",
+    "release_album",
+    "release_title_strict",
+    "release_title",
+    "recording_strict",
+    "recording",
+]
+
+
+class SearchBudgetExceeded(Exception):
+    pass
+
+
+class SearchBudget:
+    """Limits the number of rate limited calls and the time spent looking for
+    a single track. A limit of zero means there is no limit. Time spent waiting
+    for the rate limiter doesn't count towards the deadline, since it depends
+    on how busy the other workers are rather than on this search."""
+
+    def __init__(self, max_calls: int = 0, deadline: float = 0):
+        self.max_calls = max_calls
+        self.deadline = deadline
+        self.start_calls = get_scheduler().calls_made()
+        self.start_wait = get_scheduler().wait_time()
+        self.start_time = time.monotonic()
+
+    def calls_used(self) -> int:
+        return get_scheduler().calls_made() - self.start_calls
+
+    def time_used(self) -> float:
+        waited = get_scheduler().wait_time() - self.start_wait
+        return time.monotonic() - self.start_time - waited
+
+    def check(self):
+        """Raises SearchBudgetExceeded if another call would exceed the budget."""
+        if self.max_calls and self.calls_used() >= self.max_calls:
+            raise SearchBudgetExceeded(f"used all {self.max_calls} calls")
+
+        if self.deadline and self.time_used() > self.deadline:
+            raise SearchBudgetExceeded("ran out of time")
+
+
+class SearchPlan:
+    """The ordered list of search stages used to find a track, along with the
+    number of times each stage was tried and found the track."""
+
+    def __init__(
+        self,
+        stage_names: list[str] | None = None,
+        max_calls: int = 12,
+        deadline: float = 60,
+    ):
+        stage_names = stage_names if stage_names else DEFAULT_SEARCH_PLAN
+
+        for name in stage_names:
+            if name not in SEARCH_STAGES:
+                raise ValueError(f"Unknown search stage: {name}")
+
+        self.stages = [SEARCH_STAGES[name] for name in stage_names]
+        self.max_calls = max_calls
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        # Key: stage name, Value: dict of attempts, hits and calls
+        self.stats: dict[str, dict[str, int]] = {
+            stage.name: {"attempts": 0, "hits": 0, "calls": 0} for stage in self.stages
+        }
+        self.budget_exceeded = 0
+
+    def create_budget(self) -> SearchBudget:
+        return SearchBudget(self.max_calls, self.deadline)
+
+    def build_query(
+        self, stage: SearchStage, artist: str, album: str, title: str
+    ) -> SearchQuery:
+        release = album if stage.release_from == "album" else title
+        return SearchQuery(artist, release, title)
+
+    def record(self, stage: SearchStage, found: bool, calls: int):
+        with self.lock:
+            self.stats[stage.name]["attempts"] += 1
+            self.stats[stage.name]["hits"] += 1 if found else 0
+            self.stats[stage.name]["calls"] += calls
+
+    def record_budget_exceeded(self):
+        with self.lock:
+            self.budget_exceeded += 1
+
+    def report(self):
+        print("Search stage statistics:")
+
+        for stage in self.stages:
+            stats = self.stats[stage.name]
+            attempts = stats["attempts"]
+            hit_rate = stats["hits"] / attempts * 100 if attempts else 0
+            print(
+                f"  {stage.name}: {stats['hits']}/{attempts} found "
+                f"({hit_rate:.1f}%), {stats['calls']} rate limited calls"
+            )
+
+        if self.budget_exceeded:
+            print(f"  {self.budget_exceeded} searches stopped by the search budget")
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PhaseStats:
+    """The work done during one phase of a sync, such as a single importer."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.library_queries = 0
+        # Key: service.endpoint, Value: number of calls
+        self.calls: dict[str, int] = {}
+        # Time spent waiting for a rate limiter, in seconds
+        self.sleep_time = 0.0
+        # Key: cache name, Value: dict of hits and misses
+        self.caches: dict[str, dict[str, int]] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "wall_time": round(self.wall_time, 3),
+            "cpu_time": round(self.cpu_time, 3),
+            "library_queries": self.library_queries,
+            "calls": dict(sorted(self.calls.items())),
+            "sleep_time": round(self.sleep_time, 3),
+            "caches": {
+                name: dict(counts, hit_rate=round(hit_rate(counts), 3))
+                for name, counts in sorted(self.caches.items())
+            },
+        }
+
+
+def hit_rate(counts: dict[str, int]) -> float:
+    lookups = counts["hits"] + counts["misses"]
+    return counts["hits"] / lookups if lookups else 0.0
+
+
+class SyncStats:
+    """Collects the time spent and the requests made in each phase of a sync.
+    Work done outside of a phase is counted in the "other" phase. Counters may
+    be updated from any thread, and are added to the phase that is running."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.other = PhaseStats("other")
+        self.phases: list[PhaseStats] = []
+        self.current = self.other
+
+    @contextmanager
+    def phase(self, name: str):
+        phase = PhaseStats(name)
+        wall_start = time.perf_counter()
+        # Process time includes the worker threads
+        cpu_start = time.process_time()
+
+        with self.lock:
+            self.phases.append(phase)
+            self.current = phase
+
+        try:
+            yield phase
+        finally:
+            phase.wall_time = time.perf_counter() - wall_start
+            phase.cpu_time = time.process_time() - cpu_start
+
+            with self.lock:
+                self.current = self.other
+
+    def record_call(self, service: str, endpoint: str):
+        key = f"{service}.{endpoint}"
+        with self.lock:
+            self.current.calls[key] = self.current.calls.get(key, 0) + 1
+
+    def record_library_query(self):
+        with self.lock:
+            self.current.library_queries += 1
+
+    def record_sleep(self, seconds: float):
+        with self.lock:
+            self.current.sleep_time += seconds
+
+    def record_cache(self, name: str, hit: bool):
+        with self.lock:
+            counts = self.current.caches.setdefault(name, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            phases = self.phases + [self.other]
+            return {"phases": [phase.to_dict() for phase in phases]}
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def report(self):
+        print("Sync statistics:")
+
+        for phase in self.to_dict()["phases"]:
+            print(
+                f"  {phase['name']}: {phase['wall_time']:.1f}s wall, "
+                f"{phase['cpu_time']:.1f}s cpu, "
+                f"{phase['sleep_time']:.1f}s rate limited, "
+                f"{phase['library_queries']} library queries"
+            )
+
+            for endpoint, count in phase["calls"].items():
+                print(f"    {endpoint}: {count} calls")
+
+            for name, counts in phase["caches"].items():
+                print(
+                    f"    {name}: {counts['hits']}/{counts['hits'] + counts['misses']}"
+                    f" hits ({counts['hit_rate'] * 100:.1f}%)"
+                )
+
+
+_stats = SyncStats()
+
+
+def get_stats() -> SyncStats:
+    """Gets the statistics of the current sync."""
+    return _stats
+
+
+def set_stats(stats: SyncStats):
+    global _stats
+    _stats = stats
@@ -5,6 +5,11 @@ from pathlib import Path
 
 from beets import dbcore, library
 
+from beetsplug.exporter.beet_rating_exporter import BeetRatingExporter
+from beetsplug.rating_store import RatingStore
+from beetsplug.recording import RecordingInfo
+from beetsplug.test.test_library_index import create_library
+
 
 class TestBeetRatingExporter(unittest.TestCase):
     def test_find_rated_songs(self):
@@ -22,6 +27,31 @@ class TestBeetRatingExporter(unittest.TestCase):
         print(f"Regex query runtime: {runtime}s")
         print(len(songs))
 
+    def test_export_songs(self):
+        lib = create_library()
+        store = RatingStore()
+        store.add_rating(
+            RecordingInfo("Alesso", "Forever", "Cool", 227, "mbid-cool", 5), "mb"
+        )
+        store.add_rating(
+            RecordingInfo(
+                "Duke Dumont", "Duality", "Won't Look Back", 210, "mbid-wlb", 3
+            ),
+            "mb",
+        )
+        rated = dbcore.query.RegexpQuery("rating", r"\d")
+
+        # A dry run computes the changes without writing them
+        exporter = BeetRatingExporter(lib, dry_run=True)
+        self.assertEqual(exporter.export_songs(store), (2, 0))
+        self.assertEqual(len(exporter.changes), 2)
+        self.assertEqual(len(lib.items(rated)), 0)
+
+        exporter = BeetRatingExporter(lib, chunk_size=1)
+        self.assertEqual(exporter.export_songs(store), (2, 0))
+        self.assertEqual(len(lib.items(rated)), 2)
+        self.assertEqual(int(lib.items("mb_trackid:mbid-cool").get()["rating"]), 5)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,10 @@
+import os
+import tempfile
+import threading
 import unittest
 
 from beetsplug.recording import RecordingInfo
-from beetsplug.track_cache import MBTrackCache
+from beetsplug.track_cache import MBTrackCache, SQLiteTrackCache
 
 
 class TestMBCache(unittest.TestCase):
@@ -30,6 +33,142 @@ class TestMBCache(unittest.TestCase):
 
         cache.save()
 
+    def test_incremental_save(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tracks.csv")
+            cache = MBTrackCache(path, compact_threshold=2)
+
+            # Nothing is written if nothing changed
+            cache.save()
+            self.assertFalse(os.path.exists(path))
+
+            cache.add(RecordingInfo("Meduza", "Paradise", "Paradise", 167, "mbid-1"))
+            cache.save()
+            self.assertTrue(os.path.exists(path))
+            self.assertFalse(os.path.exists(cache.journal_file_path))
+
+            # Re-adding an identical entry doesn't mark the cache as changed
+            cache.add(RecordingInfo("Meduza", "Paradise", "Paradise", 167, "mbid-1"))
+            self.assertEqual(len(cache.dirty), 0)
+
+            # New entries are appended to the journal
+            cache.add(RecordingInfo("Alesso", "Forever", "Cool", 227, "mbid-2"))
+            cache.save()
+            self.assertTrue(os.path.exists(cache.journal_file_path))
+
+            reloaded = MBTrackCache(path)
+            self.assertEqual(reloaded.get("Alesso", "Cool").mbid, "mbid-2")
+            self.assertEqual(reloaded.journal_size, 1)
+
+            # Exceeding the threshold compacts the journal into the cache file
+            cache.add(RecordingInfo("Alesso", "Forever", "Heroes", 209, "mbid-3"))
+            cache.add(RecordingInfo("Alesso", "Forever", "Years", 200, "mbid-4"))
+            cache.save()
+            self.assertFalse(os.path.exists(cache.journal_file_path))
+            self.assertEqual(len(MBTrackCache(path).cache), 4)
+
+    def test_add_from_threads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tracks.csv")
+            cache = MBTrackCache(path, compact_threshold=10_000)
+            cache.add(RecordingInfo("Meduza", "Paradise", "Paradise", 167, "mbid-1"))
+            cache.save()
+
+            def add_tracks(worker):
+                for i in range(500):
+                    title = f"Song {worker}-{i}"
+                    cache.add(RecordingInfo("Artist", "", title, 0, title))
+
+            # Entries are added by the searches while the cache is saved
+            threads = [threading.Thread(target=add_tracks, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            while any(thread.is_alive() for thread in threads):
+                cache.save()
+            for thread in threads:
+                thread.join()
+            cache.save()
+
+            self.assertEqual(len(MBTrackCache(path, snapshot=False).cache), 2001)
+
+    def test_missing_cache_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = MBTrackCache(os.path.join(directory, "tracks.csv"))
+            self.assertEqual(len(cache.cache), 0)
+            self.assertEqual(len(cache.mbidCache), 0)
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tracks.csv")
+            cache = MBTrackCache(path)
+            cache.add(RecordingInfo("Meduza", "Paradise", "Paradise", 167, "mbid-1"))
+            cache.save()
+
+            # The first load creates the snapshot, the second load uses it
+            self.assertFalse(MBTrackCache(path).snapshot_loaded)
+            cache = MBTrackCache(path)
+            self.assertTrue(cache.snapshot_loaded)
+            self.assertEqual(cache.get("Meduza", "Paradise").mbid, "mbid-1")
+            self.assertEqual(cache.getByMBID("mbid-1").length, 167)
+
+            # Journal entries written after the snapshot are still loaded
+            cache.add(RecordingInfo("Alesso", "Forever", "Cool", 227, "mbid-2"))
+            cache.save()
+            cache = MBTrackCache(path)
+            self.assertTrue(cache.snapshot_loaded)
+            self.assertEqual(cache.get("Alesso", "Cool").mbid, "mbid-2")
+
+            # Changing the cache file invalidates the snapshot
+            with open(path, "a") as cache_file:
+                cache_file.write("mbid-3,Alesso,Heroes,Forever,209\n")
+            cache = MBTrackCache(path)
+            self.assertFalse(cache.snapshot_loaded)
+            self.assertEqual(len(cache.mbidCache), 3)
+
+    def test_sqlite_cache(self):
+        slingshot = RecordingInfo(
+            "Sonny Bass & Timmo Hendriks",
+            "Slingshot",
+            "Slingshot",
+            195,
+            "0089b4cf-9c65-4644-969f-ed45bb99e1e2",
+        )
+        paradise = RecordingInfo(
+            "Meduza",
+            "Paradise",
+            "Paradise",
+            167,
+            "00a5ed6a-9bba-4e92-8716-1ec5096b26f9",
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "tracks.csv")
+            db_path = os.path.join(directory, "tracks.db")
+
+            with open(csv_path, "w") as csv_file:
+                csv_file.write("mbid,artist,title,album,length\n")
+                csv_file.write(
+                    f"{slingshot.mbid},{slingshot.artist},Slingshot,Slingshot,195\n"
+                )
+
+            # The CSV cache is migrated when the database is created
+            cache = SQLiteTrackCache(db_path)
+            self.assertEqual(cache.getByMBID(slingshot.mbid).title, "Slingshot")
+            self.assertIsNotNone(
+                cache.get("Sonny Bass feat. Timo Hendriks", "Slingshot")
+            )
+            self.assertIsNone(cache.get("Meduza", "Paradise"))
+
+            # Unsaved entries are available before they are written
+            cache.add(paradise)
+            self.assertEqual(cache.get("Meduza", "Paradise").mbid, paradise.mbid)
+            cache.close()
+
+            cache = SQLiteTrackCache(db_path)
+            self.assertEqual(cache.get("Meduza", "Paradise").mbid, paradise.mbid)
+            self.assertEqual(cache.getByMBID(paradise.mbid).length, 167)
+            cache.close()
+
 
 if __name__ == "__main__":
     unittest.main()
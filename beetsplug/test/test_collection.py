@@ -0,0 +1,206 @@
+import unittest
+from unittest import mock
+
+import musicbrainzngs
+
+from beetsplug.collection import (
+    COLLECTION_CHUNK_SIZE,
+    add_recordings_to_collection,
+    apply_collection_changes,
+    plan_collection_changes,
+    remove_recordings_from_collection,
+)
+from beetsplug.exporter.mb_rating_collection_exporter import (
+    MBRatingCollectionExporter,
+)
+from beetsplug.rating_store import RatingStore
+from beetsplug.recording import RecordingInfo
+from beetsplug.scheduler import RequestScheduler, get_scheduler, set_scheduler
+
+
+class RecordingScheduler(RequestScheduler):
+    """Records collection requests instead of sending them, failing the first
+    few requests if asked to."""
+
+    def __init__(self, failures: int = 0, error=None):
+        super().__init__(rate=1000.0)
+        self.requests: list[tuple[str, list[str]]] = []
+        self.failures = failures
+        self.error = error
+
+    def call(self, name, function, *args, **kwargs):
+        if self.failures > 0:
+            self.failures -= 1
+            raise self.error
+
+        path = args[0]
+        self.requests.append((name, path.split("/")[-1].split(";")))
+
+
+class StubCollection:
+    def __init__(self, rating: int):
+        self.mbid = f"{rating}-star"
+        self.entity_type = "recording"
+
+
+class StubRecordingCollection:
+    def __init__(self, mbids: list[str]):
+        self.recordings = [mock.Mock(mbid=mbid) for mbid in mbids]
+        self.invalidated = False
+
+    def invalidate(self):
+        self.invalidated = True
+
+
+class StubUser:
+    """A user with every star collection, holding the given recordings."""
+
+    def __init__(self, members: dict[int, list[str]]):
+        self.members = members
+        self.submitted: dict[str, int] = {}
+
+    def has_collection(self, name):
+        return True
+
+    def get_collection(self, name):
+        return StubCollection(int(name.split()[0]))
+
+    def get_recording_collections(self, collections):
+        return [
+            StubRecordingCollection(self.members.get(int(c.mbid[0]), []))
+            for c in collections
+        ]
+
+    def submit_ratings(self, ratings, max_bytes):
+        self.submitted.update(ratings)
+
+
+class TestCollection(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_scheduler()
+        self.scheduler = RecordingScheduler()
+        set_scheduler(self.scheduler)
+
+    def tearDown(self):
+        set_scheduler(self.previous)
+
+    def test_chunks(self):
+        recordings = [f"rec-{i}" for i in range(COLLECTION_CHUNK_SIZE * 2 + 1)]
+        remove_recordings_from_collection("coll", recordings)
+
+        sizes = [len(chunk) for _, chunk in self.scheduler.requests]
+        self.assertEqual(sizes, [COLLECTION_CHUNK_SIZE, COLLECTION_CHUNK_SIZE, 1])
+        self.assertEqual(
+            [mbid for _, chunk in self.scheduler.requests for mbid in chunk],
+            recordings,
+        )
+
+    @mock.patch("beetsplug.collection.time.sleep")
+    def test_retry(self, sleep):
+        self.scheduler.failures = 2
+        self.scheduler.error = musicbrainzngs.NetworkError("unavailable")
+        add_recordings_to_collection("coll", ["a", "b"])
+
+        self.assertEqual(
+            self.scheduler.requests, [("add_recordings_to_collection", ["a", "b"])]
+        )
+        self.assertEqual(sleep.call_count, 2)
+
+        # Errors that won't go away by retrying are raised right away
+        self.scheduler.failures = 1
+        self.scheduler.error = musicbrainzngs.UsageError("bad request")
+        with self.assertRaises(musicbrainzngs.UsageError):
+            add_recordings_to_collection("coll", ["a"])
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_plan(self):
+        ratings = {"a": 1, "b": 2, "c": 2, "d": 5}
+        collections = {1: "one", 2: "two", 5: "five"}
+        # b moved from 1 star to 2 stars, x isn't in the library
+        members = {1: {"a", "b", "x"}, 2: {"c"}}
+
+        plan = plan_collection_changes(ratings, collections, members)
+        self.assertEqual(
+            [(c.collection, c.add, c.remove) for c in plan],
+            [("one", [], ["b"]), ("two", ["b"], []), ("five", ["d"], [])],
+        )
+
+        # Adds are made before removals
+        apply_collection_changes(plan)
+        self.assertEqual(
+            self.scheduler.requests,
+            [
+                ("add_recordings_to_collection", ["b"]),
+                ("add_recordings_to_collection", ["d"]),
+                ("remove_recordings_from_collection", ["b"]),
+            ],
+        )
+
+        # Nothing to do once the collections match the ratings
+        members = {1: {"a", "x"}, 2: {"b", "c"}, 5: {"d"}}
+        self.assertEqual(plan_collection_changes(ratings, collections, members), [])
+
+    def create_store(self, ratings: dict[str, int]) -> RatingStore:
+        rating_store = RatingStore()
+        for mbid, rating in ratings.items():
+            recording = RecordingInfo("Artist", "", mbid, 0, mbid, rating)
+            rating_store.add_rating(recording, "csv")
+        return rating_store
+
+    def test_export_dry_run(self):
+        user = StubUser({1: ["a"]})
+
+        # The changes are only shown, nothing is sent to MusicBrainz
+        exporter = MBRatingCollectionExporter(user, user, dry_run=True)  # type: ignore
+        exporter.export_songs(self.create_store({"a": 2, "b": 5}))
+        self.assertEqual(self.scheduler.requests, [])
+        self.assertEqual(user.submitted, {})
+
+        exporter = MBRatingCollectionExporter(user, user)  # type: ignore
+        exporter.export_songs(self.create_store({"a": 2, "b": 5}))
+        self.assertEqual(
+            self.scheduler.requests,
+            [
+                ("add_recordings_to_collection", ["a"]),
+                ("add_recordings_to_collection", ["b"]),
+                ("remove_recordings_from_collection", ["a"]),
+            ],
+        )
+        self.assertEqual(user.submitted, {"a": 2, "b": 5})
+
+    def test_export_recording_in_two_collections(self):
+        # b was added to 3 Star while it was still in 4 Star, c is in both too
+        # but was rated 5 outside of MusicBrainz
+        user = StubUser({3: ["b", "c"], 4: ["b", "c"]})
+        rating_store = RatingStore()
+        for rating in [3, 4]:
+            recording = RecordingInfo("Artist", "", "B", 0, "b", rating)
+            rating_store.add_rating(recording, "mb", True)
+        rating_store.add_rating(RecordingInfo("Artist", "", "C", 0, "c", 5), "csv")
+        for rating in [3, 4]:
+            recording = RecordingInfo("Artist", "", "C", 0, "c", rating)
+            rating_store.add_rating(recording, "mb", False)
+
+        MBRatingCollectionExporter(user, user).export_songs(  # type: ignore
+            rating_store
+        )
+
+        # b stays in both collections, c is moved to 5 Star
+        self.assertEqual(
+            self.scheduler.requests,
+            [
+                ("add_recordings_to_collection", ["c"]),
+                ("remove_recordings_from_collection", ["c"]),
+                ("remove_recordings_from_collection", ["c"]),
+            ],
+        )
+
+        # The plan itself never removes the recordings in keep
+        plan = plan_collection_changes(
+            {"b": 4}, {3: "three", 4: "four"}, {3: {"b"}, 4: {"b"}}, {"b"}
+        )
+        self.assertEqual(plan, [])
+
+
+if __name__ == "__main__":
+    unittest.main(module="test_collection")
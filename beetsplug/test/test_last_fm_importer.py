@@ -0,0 +1,269 @@
+import os
+import tempfile
+import threading
+import unittest
+from xml.dom import minidom
+
+import pylast
+
+from beetsplug.importer.last_fm_importer import LastFMLovedTrackImporter
+from beetsplug.rating_store import RatingStore
+from beetsplug.recording import RecordingInfo
+from beetsplug.stats import SyncStats, get_stats, set_stats
+
+
+class StubAlbum:
+    def __init__(self, title):
+        self.title = title
+
+
+class StubArtist:
+    def __init__(self, name):
+        self.name = name
+
+
+class StubTrack:
+    def __init__(self, artist, title, album):
+        self.artist = artist
+        self.title = title
+        self.album = album
+
+    def get_artist(self):
+        return StubArtist(self.artist)
+
+    def get_name(self):
+        return self.title
+
+    def get_album(self):
+        if self.album is None:
+            raise pylast.WSError(None, "6", "Track not found")
+        return StubAlbum(self.album)
+
+
+class StubLovedTrack:
+    def __init__(self, track, timestamp):
+        self.track = track
+        self.timestamp = str(timestamp)
+
+
+class StubTrackFinder:
+    """Finds every track except the ones titled "Missing"."""
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def find_all(self, queries):
+        with self.lock:
+            self.queries.extend(queries)
+
+        return [
+            (
+                None
+                if title == "Missing"
+                else RecordingInfo(artist, album, title, 0, title)
+            )
+            for artist, title, album in queries
+        ]
+
+
+class StubLastFMImporter(LastFMLovedTrackImporter):
+    ALBUM_RATE = 1000.0
+
+    def __init__(self, loved_tracks, *args, load=True, **kwargs):
+        self.stub_loved_tracks = loved_tracks
+        self.streamed = 0
+        super().__init__(*args, **kwargs)
+
+        if load:
+            self.load()
+
+    def stream_loved_tracks(self):
+        for loved_track in self.stub_loved_tracks:
+            # Stand in for a page request that failed partway through the stream
+            if loved_track is None:
+                raise pylast.NetworkError(None, "Connection reset")
+
+            self.streamed += 1
+            yield loved_track
+
+
+def create_page(tracks, total_pages):
+    """A page of loved tracks as returned by the Last.fm API."""
+    xml = "".join(
+        f"<track><name>{title}</name><artist><name>{artist}</name></artist>"
+        f'<date uts="{timestamp}">{timestamp}</date></track>'
+        for artist, title, timestamp in tracks
+    )
+    return minidom.parseString(
+        f'<lfm><lovedtracks totalPages="{total_pages}">{xml}</lovedtracks></lfm>'
+    )
+
+
+def create_loved_tracks(count, start):
+    # Loved tracks are streamed newest first
+    return [
+        StubLovedTrack(StubTrack("Artist", f"Song {i}", f"Album {i}"), start - i)
+        for i in range(count)
+    ]
+
+
+class TestLastFMLovedTrackImporter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load_in_batches(self):
+        loved_tracks = create_loved_tracks(120, 1000)
+        loved_tracks.append(StubLovedTrack(StubTrack("Artist", "Missing", None), 1))
+        # Albums with the same name as the track are ignored
+        loved_tracks.append(StubLovedTrack(StubTrack("Artist", "Single", "Single"), 0))
+        tf = StubTrackFinder()
+
+        importer = StubLastFMImporter(
+            loved_tracks, "user", self.directory.name, 4, tf, batch_size=50
+        )
+
+        self.assertEqual(len(importer.loved_tracks), 121)
+        self.assertEqual(list(importer.unmatched_tracks), [1])
+        self.assertIn(("Artist", "Song 7", "Album 7"), tf.queries)
+        self.assertIn(("Artist", "Missing", None), tf.queries)
+        self.assertIn(("Artist", "Single", None), tf.queries)
+        self.assertEqual(importer.loved_tracks[993].extra["lastfm_timestamp"], 993)
+
+    def test_load_on_import(self):
+        importer = StubLastFMImporter(
+            create_loved_tracks(3, 1000),
+            "user",
+            self.directory.name,
+            4,
+            StubTrackFinder(),
+            load=False,
+        )
+        # Nothing is requested until the import runs
+        self.assertEqual(importer.streamed, 0)
+
+        rating_store = RatingStore()
+        importer.import_songs(rating_store)
+        self.assertEqual(importer.streamed, 3)
+        self.assertEqual(len(rating_store.rating_sets["lastfm"]), 3)
+
+        # The tracks are only loaded once
+        importer.import_songs(rating_store)
+        self.assertEqual(importer.streamed, 3)
+
+    def test_stops_at_cached_timestamp(self):
+        StubLastFMImporter(
+            create_loved_tracks(60, 1000),
+            "user",
+            self.directory.name,
+            4,
+            StubTrackFinder(),
+        )
+
+        # Five new tracks were loved since the last import
+        tf = StubTrackFinder()
+        loved_tracks = create_loved_tracks(65, 1005)
+        importer = StubLastFMImporter(loved_tracks, "user", self.directory.name, 4, tf)
+
+        self.assertEqual(len(tf.queries), 5)
+        self.assertEqual(importer.streamed, 6)
+        self.assertEqual(len(importer.loved_tracks), 65)
+
+    def test_resume_after_error(self):
+        loved_tracks = create_loved_tracks(100, 1000)
+        StubLastFMImporter(
+            loved_tracks[:70] + [None],
+            "user",
+            self.directory.name,
+            4,
+            StubTrackFinder(),
+            batch_size=20,
+        )
+
+        # Tracks loved since the error and the tracks after the error are
+        # fetched, the tracks that were imported before the error are not
+        tf = StubTrackFinder()
+        loved_tracks = create_loved_tracks(103, 1003)
+        importer = StubLastFMImporter(
+            loved_tracks, "user", self.directory.name, 4, tf, batch_size=20
+        )
+
+        self.assertEqual(len(tf.queries), 33)
+        self.assertNotIn(("Artist", "Song 10", "Album 10"), tf.queries)
+        self.assertEqual(len(importer.loved_tracks), 103)
+        self.assertEqual(importer.checkpoint.ranges, [[901, 1003]])
+        self.assertTrue(importer.checkpoint.complete)
+
+        # The cache file is only ever appended to, each track is written once
+        with open(importer.cache_path) as f:
+            self.assertEqual(len(f.readlines()), 104)
+
+    def test_migrate_cache_without_checkpoint(self):
+        importer = StubLastFMImporter(
+            create_loved_tracks(60, 1000),
+            "user",
+            self.directory.name,
+            4,
+            StubTrackFinder(),
+        )
+
+        # An older import stopped partway and left a hole in the cache
+        os.remove(importer.checkpoint.path)
+        hole = [
+            track
+            for track in importer.loved_tracks.values()
+            if 970 <= track.extra["lastfm_timestamp"] < 980
+        ]
+        with open(importer.cache_path, "w") as f:
+            f.write("artist,album,title,length,mbid,timestamp\n")
+        importer.append_loved(
+            [track for track in importer.loved_tracks.values() if track not in hole]
+        )
+
+        tf = StubTrackFinder()
+        importer = StubLastFMImporter(
+            create_loved_tracks(60, 1000), "user", self.directory.name, 4, tf
+        )
+
+        # The whole list is streamed and only the missing tracks are searched
+        self.assertEqual(importer.streamed, 60)
+        self.assertEqual(len(tf.queries), 10)
+        self.assertIn(("Artist", "Song 25", "Album 25"), tf.queries)
+        self.assertEqual(len(importer.loved_tracks), 60)
+        self.assertEqual(importer.checkpoint.ranges, [[941, 1000]])
+        self.assertTrue(importer.checkpoint.complete)
+
+    def test_stream_counts_each_page(self):
+        importer = StubLastFMImporter(
+            [], "user", self.directory.name, 4, StubTrackFinder()
+        )
+        pages = [
+            create_page([("Artist", "Song 2", 2), ("Artist", "Song 1", 1)], 2),
+            create_page([("Artist", "Song 0", 0)], 2),
+        ]
+
+        def request(method, cacheable, params):
+            return pages[int(params["page"]) - 1]
+
+        importer.user._request = request
+
+        stats = SyncStats()
+        previous = get_stats()
+        set_stats(stats)
+        try:
+            stream = LastFMLovedTrackImporter.stream_loved_tracks(importer)
+            self.assertEqual(stats.other.calls, {})
+
+            timestamps = [int(loved_track.timestamp) for loved_track in stream]
+        finally:
+            set_stats(previous)
+
+        self.assertEqual(timestamps, [2, 1, 0])
+        self.assertEqual(stats.other.calls, {"lastfm.get_loved_tracks": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import tempfile
+import time
+import unittest
+
+from beets import library
+
+from beetsplug.exporter.beet_rating_exporter import BeetRatingExporter
+from beetsplug.library_index import LibraryIndex
+from beetsplug.recording import RecordingInfo
+from beetsplug.scheduler import RequestScheduler, get_scheduler, set_scheduler
+from beetsplug.track_finder import LibraryTrackFinder
+
+
+def create_library(path=":memory:"):
+    lib = library.Library(path)
+    songs = [
+        ("Alesso", "Forever", "Heroes (We Could Be)", 209.6, "mbid-heroes", 12),
+        ("Alesso", "Forever", "Cool", 227.2, "mbid-cool", 12),
+        ("Joel Corry & MNEK", "Head & Heart", "Head & Heart", 166.4, "", 1),
+        ("Duke Dumont", "Duality", "Won't Look Back", 210.1, "mbid-wlb", 14),
+        ("The Foo Band feat. X", "Live", "Song (Remastered)", 200.0, "mbid-foo", 10),
+        ("Foo Band", "Songs", "Another Song", 190.0, "mbid-another", 10),
+    ]
+
+    for artist, album, title, length, mbid, tracktotal in songs:
+        item = library.Item(
+            artist=artist,
+            album=album,
+            title=title,
+            length=length,
+            mb_trackid=mbid,
+            tracktotal=tracktotal,
+        )
+        lib.add(item)
+
+    return lib
+
+
+class TestLibraryIndex(unittest.TestCase):
+    def setUp(self):
+        self.lib = create_library()
+        self.index = LibraryIndex(self.lib)
+
+    def test_index_lookups(self):
+        self.assertEqual(len(self.index.get_by_mbid("mbid-cool")), 1)
+        self.assertEqual(len(self.index.get_by_mbid("missing")), 0)
+        self.assertEqual(len(self.index.get_by_artist("Alesso")), 2)
+        self.assertEqual(len(self.index.get_by_artist("mnek")), 1)
+        self.assertEqual(len(self.index.get_by_artist("foo band")), 2)
+        self.assertEqual(len(self.index.get_by_length(206, 212)), 2)
+        self.assertEqual(len(self.index.get_by_length(210.5, 212)), 0)
+
+    def test_finder_matches_query_results(self):
+        indexed = LibraryTrackFinder(self.lib, True, None, self.index)
+        queried = LibraryTrackFinder(self.lib, True, None)
+
+        for finder in [indexed, queried]:
+            recording = finder.findByMBID("mbid-heroes")
+            self.assertIsNotNone(recording)
+            self.assertEqual(recording.title, "Heroes (We Could Be)")
+
+            recording = finder.findByTitleLength("Cool", 226)
+            self.assertIsNotNone(recording)
+            self.assertEqual(recording.mbid, "mbid-cool")
+
+            recording = finder.find("Duke Dumont", "Won't Look Back")
+            self.assertIsNotNone(recording)
+            self.assertEqual(recording.mbid, "mbid-wlb")
+
+            recording = finder.find("Alesso", "Cool", "Forever")
+            self.assertIsNotNone(recording)
+            self.assertEqual(recording.mbid, "mbid-cool")
+
+            # No MBID is stored in the library and we are library only
+            self.assertIsNone(finder.find("Joel Corry", "Head & Heart"))
+
+    def test_query_songs_match_library_queries(self):
+        indexed = LibraryTrackFinder(self.lib, True, None, self.index)
+        queried = LibraryTrackFinder(self.lib, True, None)
+        searches = [
+            ("foo band", "song", None),
+            ("foo band", "song", "live"),
+            ("foo band", "remastered", None),
+            ("Alesso", "o", None),
+            ("alesso", "heroes", "forever"),
+            ("x", "song", None),
+            ("Nobody", "song", None),
+        ]
+
+        for artist, title, album in searches:
+            self.assertEqual(
+                {song.id for song in indexed.query_songs(artist, title, album)},
+                {song.id for song in queried.query_songs(artist, title, album)},
+                (artist, title, album),
+            )
+
+        self.assertEqual(len(indexed.query_songs("foo band", "song")), 2)
+
+    def test_index_updated_after_export(self):
+        item = self.index.get_by_mbid("mbid-cool")[0]
+        recording = RecordingInfo("Alesso", "Forever", "Cool", 227, "mbid-new", 5)
+
+        exporter = BeetRatingExporter(self.lib, self.index)
+        exporter.changes = [(item, recording)]
+        exporter.store_changes()
+
+        self.assertEqual(self.index.get_by_mbid("mbid-cool"), [])
+        self.assertEqual(self.index.get_by_mbid("mbid-new"), [item])
+
+    def test_find_all_cold_index(self):
+        # Each worker thread has its own connection, so use a library file
+        # rather than an in-memory database
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        lib = create_library(os.path.join(directory.name, "library.db"))
+        index = LibraryIndex(lib)
+
+        # Make loading slow enough that every worker would try to load it
+        items = lib.items
+
+        def slow_items(*args, **kwargs):
+            time.sleep(0.05)
+            return items(*args, **kwargs)
+
+        lib.items = slow_items
+        finder = LibraryTrackFinder(lib, True, None, index)
+
+        previous = get_scheduler()
+        set_scheduler(RequestScheduler(max_workers=4))
+        try:
+            results = finder.find_all(
+                [
+                    ("Alesso", "Cool", "Forever"),
+                    ("Alesso", "Heroes (We Could Be)", None),
+                    ("Duke Dumont", "Won't Look Back", None),
+                    ("Foo Band", "Another Song", None),
+                ]
+            )
+            # Lookups on a cold index from several threads at once
+            results += get_scheduler().map(
+                LibraryTrackFinder(lib, True, None, LibraryIndex(lib)).findByMBID,
+                ["mbid-cool"] * 4,
+            )
+        finally:
+            get_scheduler().shutdown()
+            set_scheduler(previous)
+
+        self.assertEqual(
+            [result.mbid for result in results],
+            ["mbid-cool", "mbid-heroes", "mbid-wlb", "mbid-another"]
+            + ["mbid-cool"] * 4,
+        )
+        # Each item was only indexed once
+        for mbid, indexed in index.by_mbid.items():
+            self.assertEqual(len(indexed), 1, mbid)
+
+
+if __name__ == "__main__":
+    unittest.main()
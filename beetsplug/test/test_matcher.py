@@ -0,0 +1,38 @@
+import unittest
+
+from beetsplug.library_index import LibraryIndex
+from beetsplug.matcher import RecordingMatcher
+from beetsplug.recording import RecordingInfo
+from beetsplug.test.test_library_index import create_library
+
+
+class TestRecordingMatcher(unittest.TestCase):
+    def test_match_all(self):
+        lib = create_library()
+        recordings = [
+            RecordingInfo("Alesso", "Forever", "Cool", 227, "mbid-cool"),
+            # Matched by title and length since the MBID is not in the library
+            RecordingInfo("Joel Corry", "Head & Heart", "Head & Heart", 166, "new"),
+            RecordingInfo("Nobody", "Nothing", "Missing", 100, "mbid-missing"),
+        ]
+
+        for matcher in [
+            RecordingMatcher(lib, None),
+            RecordingMatcher(lib, None, LibraryIndex(lib)),
+        ]:
+            matches = matcher.match_all(recordings)
+            self.assertEqual(len(matches), 2)
+            self.assertEqual(matches["mbid-cool"].title, "Cool")
+            self.assertEqual(matches["new"].title, "Head & Heart")
+
+            # The batch results must agree with matching one at a time
+            for recording in recordings:
+                song = matcher.match(recording)
+                expected = matches.get(recording.mbid, None)
+                self.assertEqual(
+                    song.id if song else None, expected.id if expected else None
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,65 @@
 # pyright: reportOptionalMemberAccess=false
+import os
+import tempfile
+import time
 import unittest
 
 from beetsplug.credentials import init_musicbrainzngs
+from beetsplug.negative_cache import NegativeCache
 from beetsplug.normalize import normalize
+from beetsplug.scheduler import RequestScheduler, get_scheduler, set_scheduler
+from beetsplug.search_plan import SearchPlan
 from beetsplug.track_finder import MBTrackFinder
 
 
+def make_release(release_id, title, artist, tracks, medium="Digital Media"):
+    return {
+        "release": {
+            "id": release_id,
+            "title": title,
+            "artist-credit-phrase": artist,
+            "medium-list": [
+                {
+                    "format": medium,
+                    "track-list": [
+                        {
+                            "recording": {
+                                "id": f"{release_id}-{i}",
+                                "title": track,
+                                "length": "180000",
+                            }
+                        }
+                        for i, track in enumerate(tracks)
+                    ],
+                }
+            ],
+        }
+    }
+
+
+class StubScheduler(RequestScheduler):
+    """Answers requests from canned responses and counts the calls made."""
+
+    def __init__(self, release_groups, releases):
+        super().__init__()
+        self.release_groups = release_groups
+        self.releases = releases
+        self.calls: list[str] = []
+
+    def call(self, name, function, *args, **kwargs):
+        self.calls.append(name)
+        self.local.calls = self.calls_made() + 1
+
+        if name == "search_release_groups":
+            return {"release-group-list": self.release_groups}
+        if name == "get_release_by_id":
+            return self.releases[args[0]]
+        if name == "search_recordings":
+            return {"recording-list": []}
+
+        raise AssertionError(f"Unexpected call: {name}")
+
+
 class TestMBTrackFinder(unittest.TestCase):
     def setUp(self):
         init_musicbrainzngs()
@@ -89,5 +143,146 @@ class TestMBTrackFinder(unittest.TestCase):
         self.assertEqual(result.mbid, "c25d91a6-8dfe-4471-9909-e12577a338a8")
 
 
+class TestMBSearchReleaseCandidates(unittest.TestCase):
+    def setUp(self):
+        release_groups = [
+            {
+                "type": "Album",
+                "artist-credit-phrase": "Someone Else",
+                "release-list": [{"id": "other", "title": "Good Job"}],
+            },
+            {
+                "type": "Album",
+                "artist-credit-phrase": "Joel Corry",
+                "release-list": [
+                    {"id": "remixes", "title": "Head & Heart (Remixes)"},
+                    {"id": "vinyl", "title": "Head & Heart", "status": "Promotion"},
+                    {"id": "digital", "title": "Head & Heart", "status": "Official"},
+                ],
+            },
+        ]
+        releases = {
+            "vinyl": make_release("vinyl", "Head & Heart", "Joel Corry", [], "Vinyl"),
+            "digital": make_release(
+                "digital", "Head & Heart", "Joel Corry", ["Head & Heart"]
+            ),
+        }
+        self.scheduler = StubScheduler(release_groups, releases)
+        self.previous_scheduler = get_scheduler()
+        set_scheduler(self.scheduler)
+
+    def tearDown(self):
+        set_scheduler(self.previous_scheduler)
+
+    def test_candidates_filtered_before_fetching(self):
+        tf = MBTrackFinder()
+        search_args = {"artist": "joel corry", "release": "head & heart"}
+
+        track = tf.mb_search_releases(search_args, "Head & Heart")
+        self.assertEqual(track.mbid, "digital-0")
+
+        # The wrong artist and the remix release are never fetched, and the
+        # official release is fetched before the promotional one
+        self.assertEqual(
+            self.scheduler.calls, ["search_release_groups", "get_release_by_id"]
+        )
+
+        # An identical search reuses the release group search results
+        tf.mb_search_releases(search_args, "Head & Heart")
+        self.assertEqual(self.scheduler.calls.count("search_release_groups"), 1)
+
+
+class TestSearchPlan(unittest.TestCase):
+    def setUp(self):
+        # A release by the right artist that never contains the track
+        release_groups = [
+            {
+                "type": "Album",
+                "artist-credit-phrase": "Joel Corry",
+                "release-list": [{"id": "album", "title": "Another Album"}],
+            },
+        ]
+        releases = {
+            "album": make_release("album", "Another Album", "Joel Corry", ["Sorry"]),
+        }
+        self.scheduler = StubScheduler(release_groups, releases)
+        self.previous_scheduler = get_scheduler()
+        set_scheduler(self.scheduler)
+
+    def tearDown(self):
+        set_scheduler(self.previous_scheduler)
+
+    def test_stages_run_in_order(self):
+        plan = SearchPlan()
+        tf = MBTrackFinder(search_plan=plan)
+
+        self.assertIsNone(tf.find("Joel Corry", "Head & Heart", "Good Job"))
+
+        # Each release is only fetched once across all of the stages
+        self.assertEqual(
+            self.scheduler.calls,
+            ["search_release_groups", "get_release_by_id"]
+            + ["search_release_groups"] * 3
+            + ["search_recordings"] * 2,
+        )
+        for stage in plan.stages:
+            self.assertEqual(plan.stats[stage.name]["attempts"], 1)
+            self.assertEqual(plan.stats[stage.name]["hits"], 0)
+        self.assertEqual(plan.stats["release_album_strict"]["calls"], 2)
+
+    def test_duplicate_stages_skipped(self):
+        plan = SearchPlan()
+        tf = MBTrackFinder(search_plan=plan)
+
+        # Without an album, the title stages repeat the album stages
+        self.assertIsNone(tf.find("Joel Corry", "Head & Heart"))
+        self.assertEqual(plan.stats["release_title_strict"]["attempts"], 0)
+        self.assertEqual(plan.stats["release_title"]["attempts"], 0)
+
+    def test_call_budget(self):
+        plan = SearchPlan(max_calls=3)
+        with tempfile.TemporaryDirectory() as directory:
+            negative_cache = NegativeCache(os.path.join(directory, "not-found.csv"))
+            tf = MBTrackFinder(None, negative_cache, plan)
+
+            self.assertIsNone(tf.find("Joel Corry", "Head & Heart", "Good Job"))
+            self.assertEqual(len(self.scheduler.calls), 3)
+            self.assertEqual(plan.budget_exceeded, 1)
+
+            # A search that was cut short isn't recorded as not found
+            self.assertTrue(
+                negative_cache.should_retry("Joel Corry", "Head & Heart", "Good Job")
+            )
+
+            # A search that ran every stage is
+            tf.search_plan = SearchPlan()
+            self.assertIsNone(tf.find("Joel Corry", "Head & Heart", "Good Job"))
+            self.assertFalse(
+                negative_cache.should_retry("Joel Corry", "Head & Heart", "Good Job")
+            )
+
+    def test_deadline_excludes_rate_limit(self):
+        plan = SearchPlan(deadline=0.05)
+        tf = MBTrackFinder(search_plan=plan)
+
+        # Each call waits longer than the whole deadline for the rate limit
+        call = self.scheduler.call
+
+        def slow_call(name, function, *args, **kwargs):
+            time.sleep(0.02)
+            self.scheduler.local.total_wait = self.scheduler.wait_time() + 0.02
+            return call(name, function, *args, **kwargs)
+
+        self.scheduler.call = slow_call
+
+        self.assertIsNone(tf.find("Joel Corry", "Head & Heart", "Good Job"))
+        self.assertEqual(plan.budget_exceeded, 0)
+        self.assertEqual(plan.stats["recording"]["attempts"], 1)
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            SearchPlan(["release_album", "release_everything"])
+
+
 if __name__ == "__main__":
     unittest.main()
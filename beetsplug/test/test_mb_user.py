@@ -1,9 +1,13 @@
 import os
+import tempfile
 import time
 import unittest
 
+import musicbrainzngs
+
 from beetsplug.credentials import load_musicbrainz_credentials
-from beetsplug.mb_user import MBCache, MBRecordingCollection, MBUser
+from beetsplug.mb_user import MBCache, MBCollection, MBRecordingCollection, MBUser
+from beetsplug.scheduler import RequestScheduler, get_scheduler, set_scheduler
 
 
 class TestMBUser(unittest.TestCase):
@@ -79,5 +83,189 @@ class TestMBUser(unittest.TestCase):
         print(f"Total Speedup: {speedup}x")
 
 
+class CollectionScheduler(RequestScheduler):
+    """Answers collection requests with pages of generated recordings."""
+
+    def __init__(self, sizes: dict[str, int]):
+        super().__init__(rate=1000.0)
+        self.sizes = sizes
+        self.offsets: list[tuple[str, int]] = []
+        # Key: (collection, index), Value: id of the recording at that index
+        self.replaced: dict[tuple[str, int], str] = {}
+
+    def call(self, name, function, *args, **kwargs):
+        mbid = args[0]
+        offset = kwargs.get("offset", 0)
+        limit = kwargs["limit"]
+        self.offsets.append((mbid, offset))
+
+        count = self.sizes[mbid]
+        recordings = [
+            {
+                "id": self.replaced.get((mbid, i), f"{mbid}-{i}"),
+                "title": f"Recording {i}",
+                "length": "180000",
+            }
+            for i in range(offset, min(offset + limit, count))
+        ]
+        return {"collection": {"recording-list": recordings, "recording-count": count}}
+
+
+class TestMBRecordingCollectionLoading(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scheduler = CollectionScheduler({"one": 250, "two": 100, "empty": 0})
+        self.previous_scheduler = get_scheduler()
+        set_scheduler(self.scheduler)
+
+    def tearDown(self):
+        set_scheduler(self.previous_scheduler)
+        self.scheduler.shutdown()
+        self.directory.cleanup()
+
+    def test_load_pages(self):
+        cache_path = os.path.join(self.directory.name, "coll-one.csv")
+        collection = MBRecordingCollection("1 Star", "one", cache_path)
+
+        self.assertEqual(len(collection.recordings), 250)
+        self.assertEqual(collection.recordings[249].mbid, "one-249")
+        self.assertEqual(collection.recordings[0].length, 180)
+        # No request is made past the last page
+        self.assertEqual(
+            self.scheduler.offsets, [("one", 0), ("one", 100), ("one", 200)]
+        )
+        self.assertTrue(os.path.exists(cache_path))
+
+    def test_load_collections_together(self):
+        mb_cache = MBCache(self.directory.name)
+        collections = [
+            MBCollection("1 Star", "one", "recording"),
+            MBCollection("2 Star", "two", "recording"),
+            MBCollection("3 Star", "empty", "recording"),
+        ]
+
+        loaded = mb_cache.get_recording_collections(collections)
+
+        self.assertEqual([c.name for c in loaded], ["1 Star", "2 Star", "3 Star"])
+        self.assertEqual([len(c.recordings) for c in loaded], [250, 100, 0])
+        self.assertEqual(len(self.scheduler.offsets), 5)
+
+    def load_stale(self, cache_path: str) -> MBRecordingCollection:
+        # Make the cache old enough to be checked for changes
+        stale = time.time() - MBRecordingCollection.CACHE_TTL - 60
+        os.utime(cache_path, (stale, stale))
+        self.scheduler.offsets.clear()
+        return MBRecordingCollection("1 Star", "one", cache_path)
+
+    def test_refresh_unchanged(self):
+        cache_path = os.path.join(self.directory.name, "coll-one.csv")
+        MBRecordingCollection("1 Star", "one", cache_path)
+
+        # Only the first and last pages are requested
+        collection = self.load_stale(cache_path)
+        self.assertEqual(len(collection.recordings), 250)
+        self.assertEqual(self.scheduler.offsets, [("one", 0), ("one", 200)])
+
+        # The cache is fresh again
+        MBRecordingCollection("1 Star", "one", cache_path)
+        self.assertEqual(len(self.scheduler.offsets), 2)
+
+    def test_refresh_changed(self):
+        cache_path = os.path.join(self.directory.name, "coll-one.csv")
+        MBRecordingCollection("1 Star", "one", cache_path)
+
+        # A recording on the last page was replaced
+        self.scheduler.replaced[("one", 240)] = "new"
+        collection = self.load_stale(cache_path)
+        self.assertEqual(collection.recordings[240].mbid, "new")
+        self.assertEqual(
+            self.scheduler.offsets,
+            [("one", 0), ("one", 200), ("one", 100), ("one", 200)],
+        )
+
+        # A recording was added, the first page is reused for the reload
+        self.scheduler.sizes["one"] = 251
+        collection = self.load_stale(cache_path)
+        self.assertEqual(len(collection.recordings), 251)
+        self.assertEqual(
+            self.scheduler.offsets, [("one", 0), ("one", 100), ("one", 200)]
+        )
+
+
+class RatingScheduler(RequestScheduler):
+    """Records rating submissions, failing the requests in fail_at."""
+
+    def __init__(self, fail_at: set[int] = set()):
+        super().__init__(rate=1000.0)
+        self.fail_at = fail_at
+        self.requests = 0
+        self.submitted: list[bytes] = []
+
+    def call(self, name, function, *args, **kwargs):
+        self.requests += 1
+        if self.requests in self.fail_at:
+            raise musicbrainzngs.ResponseError("rejected")
+
+        self.submitted.append(args[1])
+
+
+class TestMBUserRatings(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_scheduler = get_scheduler()
+
+        # Load the user from a cache file instead of MusicBrainz
+        self.cache_path = os.path.join(self.directory.name, "user-test.csv")
+        with open(self.cache_path, "w") as f:
+            f.write("name,mbid,type\n1 Star,one,recording\n")
+        MBUser.authenticated = True
+
+    def tearDown(self):
+        set_scheduler(self.previous_scheduler)
+        MBUser.authenticated = False
+        self.directory.cleanup()
+
+    def submit(self, scheduler, ratings, max_bytes):
+        set_scheduler(scheduler)
+        user = MBUser("test", "", self.cache_path)
+        user.submit_ratings(ratings, max_bytes)
+        return user
+
+    def test_authenticate_keeps_rate_limit_disabled(self):
+        # The scheduler is the only rate limiter
+        musicbrainzngs.set_rate_limit(False)
+        user = MBUser("test", "", self.cache_path)
+        user.authenticate("test", "", reauthenticate=True)
+        self.assertFalse(musicbrainzngs.musicbrainz.do_rate_limit)
+
+    def test_batches(self):
+        ratings = {f"{i:036d}": 4 for i in range(50)}
+        scheduler = RatingScheduler()
+        user = self.submit(scheduler, ratings, 1024)
+
+        batches = user.rating_batches_sent
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(batch.size for batch in batches), 50)
+        # The size estimate matches the requests that were sent
+        self.assertEqual(
+            [batch.bytes for batch in batches], [len(q) for q in scheduler.submitted]
+        )
+        self.assertTrue(all(batch.bytes <= 1024 for batch in batches))
+        self.assertFalse(os.path.exists(user.get_pending_ratings_path()))
+
+    def test_resume(self):
+        ratings = {f"{i:036d}": 4 for i in range(50)}
+        # The second batch fails, so only the first batch was submitted
+        user = self.submit(RatingScheduler({2}), ratings, 1024)
+        first = user.rating_batches_sent[0].size
+        self.assertEqual(len(user.rating_batches_sent), 1)
+        self.assertEqual(len(user.load_pending_ratings()), 50 - first)
+
+        # The next run submits the remaining ratings along with the new one
+        user = self.submit(RatingScheduler(), {"new": 5}, 1024)
+        self.assertEqual(sum(b.size for b in user.rating_batches_sent), 51 - first)
+        self.assertEqual(user.load_pending_ratings(), {})
+
+
 if __name__ == "__main__":
     unittest.main(module="test_mb_user")
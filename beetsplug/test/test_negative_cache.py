@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from beetsplug.negative_cache import DAY, NegativeCache
+from beetsplug.scheduler import RequestScheduler, get_scheduler, set_scheduler
+from beetsplug.track_finder import MBTrackFinder
+
+
+class FailingScheduler(RequestScheduler):
+    def call(self, name, function, *args, **kwargs):
+        raise AssertionError(f"Unexpected rate limited call: {name}")
+
+
+class TestNegativeCache(unittest.TestCase):
+    def test_backoff(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "not-found.csv")
+            cache = NegativeCache(path)
+            start = 1_000_000.0
+
+            self.assertTrue(cache.should_retry("Nobody", "Nothing", None, start))
+
+            # After the first failure we wait one day, then two, then four
+            cache.record_failure("Nobody", "Nothing", None, start)
+            self.assertFalse(cache.should_retry("Nobody", "Nothing", None, start))
+            self.assertTrue(cache.should_retry("Nobody", "Nothing", None, start + DAY))
+
+            cache.record_failure("Nobody", "Nothing", None, start + DAY)
+            cache.record_failure("Nobody", "Nothing", None, start + 3 * DAY)
+            self.assertFalse(
+                cache.should_retry("Nobody", "Nothing", None, start + 6 * DAY)
+            )
+            self.assertTrue(
+                cache.should_retry("Nobody", "Nothing", None, start + 7 * DAY)
+            )
+
+            # The key is normalized
+            self.assertFalse(
+                cache.should_retry("Nobody feat. Someone", "NOTHING", "", start)
+            )
+
+            cache.save()
+            reloaded = NegativeCache(path)
+            self.assertEqual(len(reloaded.results), 1)
+            result = list(reloaded.results.values())[0]
+            self.assertEqual(result.attempts, 3)
+
+            reloaded.record_success("Nobody", "Nothing")
+            self.assertTrue(reloaded.should_retry("Nobody", "Nothing"))
+
+    def test_record_from_threads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "not-found.csv")
+            cache = NegativeCache(path)
+
+            def record(worker):
+                for i in range(500):
+                    cache.record_failure("Nobody", f"Nothing {worker}-{i}")
+                    if i % 2:
+                        cache.record_success("Nobody", f"Nothing {worker}-{i}")
+
+            # Results are recorded by the searches while the cache is saved
+            threads = [threading.Thread(target=record, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            while any(thread.is_alive() for thread in threads):
+                cache.save()
+            for thread in threads:
+                thread.join()
+            cache.save()
+
+            self.assertEqual(len(NegativeCache(path).results), 1000)
+
+    def test_track_finder_skips_failed_search(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = NegativeCache(os.path.join(directory, "not-found.csv"))
+            cache.record_failure("Nobody", "Nothing", "Nowhere")
+
+            previous_scheduler = get_scheduler()
+            set_scheduler(FailingScheduler())
+            try:
+                finder = MBTrackFinder(None, cache)
+                self.assertIsNone(finder.find("Nobody", "Nothing", "Nowhere"))
+            finally:
+                set_scheduler(previous_scheduler)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,17 @@
+import os
+import random
+import time
 import unittest
 
-from beetsplug.normalize import (normalize, normalize_spotify_title,
-                                 remove_feat, remove_quoted_text)
+from beetsplug.normalize import (
+    cache_stats,
+    clear_caches,
+    first_artist,
+    normalize,
+    normalize_spotify_title,
+    remove_feat,
+    remove_quoted_text,
+)
 
 
 class TestNormalize(unittest.TestCase):
@@ -51,6 +61,77 @@ class TestNormalize(unittest.TestCase):
         for key in songs.keys():
             self.assertEqual(normalize_spotify_title(key), songs[key])
 
+    def test_first_artist(self):
+        artists = {
+            "Sonny Bass & Timmo Hendriks": "Sonny Bass",
+            "Sonny Bass feat. Timmo Hendriks": "Sonny Bass",
+            "Sonny Bass vs. Timmo Hendriks": "Sonny Bass",
+            "Sonny Bass vs Timmo Hendriks": "Sonny Bass",
+            "Tiësto, Sevenn": "Tiesto",
+            "Alesso": "Alesso",
+        }
+
+        for key in artists.keys():
+            self.assertEqual(first_artist(key), artists[key])
+
+    def test_memoization(self):
+        titles = ["Song (Original Mix)", "Song - Radio Edit", "Other [Feat. John Doe]"]
+        corpus = titles * 10
+
+        clear_caches()
+        for title in corpus:
+            self.assertEqual(normalize(title), normalize.__wrapped__(title))
+
+        # Each title is only normalized once, every other call is a cache hit
+        stats = cache_stats()["normalize"]
+        self.assertEqual(stats["misses"], len(titles))
+        self.assertEqual(stats["hits"], len(corpus) - len(titles))
+        self.assertEqual(stats["size"], len(titles))
+
+        clear_caches()
+        self.assertEqual(cache_stats()["normalize"]["size"], 0)
+
+    @unittest.skipUnless(
+        os.getenv("RATINGSYNC_BENCHMARK"), "Set RATINGSYNC_BENCHMARK to run"
+    )
+    def test_memoization_benchmark(self):
+        # A realistic corpus repeats the same artists and titles many times,
+        # since the same track is normalized for cache keys, library lookups
+        # and candidate scoring
+        random.seed(0)
+        suffixes = [
+            "",
+            " (Original Mix)",
+            " - Radio Edit",
+            " [Feat. John Doe]",
+            " (Tiësto Remix)",
+            " - Extended VIP",
+        ]
+        unique = [f"Song Number {i}{random.choice(suffixes)}" for i in range(10_000)]
+        corpus = [random.choice(unique) for _ in range(100_000)]
+
+        clear_caches()
+        start = time.perf_counter()
+        for title in corpus:
+            normalize.__wrapped__(title)
+        uncached_runtime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for title in corpus:
+            normalize(title)
+        cached_runtime = time.perf_counter() - start
+
+        stats = cache_stats()["normalize"]
+        speedup = round(uncached_runtime / cached_runtime, 1)
+        print(f"Uncached: {uncached_runtime}s vs Cached: {cached_runtime}s")
+        print(
+            f"Total Speedup: {speedup}x, {stats['hits']} hits, {stats['misses']} misses"
+        )
+
+        self.assertEqual(stats["hits"] + stats["misses"], len(corpus))
+        self.assertLessEqual(stats["misses"], len(unique))
+        self.assertLess(cached_runtime, uncached_runtime)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tracemalloc
+import unittest
+from typing import Any
+
+from beetsplug.recording import RecordingInfo
+
+
+class DictRecordingInfo:
+    """RecordingInfo as it was before it was slotted, for comparison."""
+
+    def __init__(self, artist, album, title, length, mbid, rating=0):
+        self.artist = artist
+        self.album = album if album else ""
+        self.title = title
+        self.length = int(length)
+        self.mbid = mbid
+        self.rating = rating
+        self.extra: dict[str, Any] = {}
+        self.sources: dict[str, int] = {}
+
+
+def bytes_per_recording(recording_type, count: int) -> float:
+    # The strings are shared like they are in the track cache, so only the
+    # recordings themselves are measured
+    mbids = [f"{i:036d}" for i in range(count)]
+
+    tracemalloc.start()
+    try:
+        recordings = [
+            recording_type("Alesso", "Forever", "Cool", 227, mbid) for mbid in mbids
+        ]
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(recordings) == count
+    return size / count
+
+
+class TestRecordingInfo(unittest.TestCase):
+    def test_lazy_extras(self):
+        recording = RecordingInfo("Alesso", "Forever", "Cool", 227, "mbid-cool")
+        self.assertIsNone(recording._extra)
+        self.assertIsNone(recording._sources)
+
+        recording.sources["mb"] = 5
+        recording.extra["lastfm_timestamp"] = 1
+        self.assertEqual(recording.sources, {"mb": 5})
+        self.assertEqual(recording.extra, {"lastfm_timestamp": 1})
+
+        with self.assertRaises(AttributeError):
+            recording.unknown = 1  # type: ignore
+
+    def benchmark(self, count: int):
+        before = bytes_per_recording(DictRecordingInfo, count)
+        after = bytes_per_recording(RecordingInfo, count)
+
+        print(
+            f"{count} recordings: {before:.0f} bytes per recording before, "
+            f"{after:.0f} bytes after ({before / after:.1f}x smaller)"
+        )
+        self.assertLess(after, before)
+
+    def test_memory_benchmark(self):
+        self.benchmark(100_000)
+
+    @unittest.skipUnless(
+        os.getenv("RATINGSYNC_BENCHMARK"), "Set RATINGSYNC_BENCHMARK to run"
+    )
+    def test_memory_benchmark_large(self):
+        self.benchmark(1_000_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+from beetsplug.response_cache import ResponseCache
+from beetsplug.scheduler import RequestScheduler
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "responses.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_and_put(self):
+        cache = ResponseCache(self.path)
+        release = {"release": {"id": "release-1", "title": "Forever"}}
+        includes = {"includes": ["recordings", "artists"]}
+
+        self.assertIsNone(cache.get("get_release_by_id", ("release-1",), includes))
+        cache.put("get_release_by_id", ("release-1",), includes, release)
+
+        # The order of the includes doesn't matter
+        reversed_includes = {"includes": ["artists", "recordings"]}
+        self.assertEqual(
+            cache.get("get_release_by_id", ("release-1",), reversed_includes), release
+        )
+        self.assertIsNone(cache.get("get_release_by_id", ("release-2",), includes))
+        cache.close()
+
+        # Responses are still available after reopening the cache
+        cache = ResponseCache(self.path)
+        self.assertEqual(
+            cache.get("get_release_by_id", ("release-1",), includes), release
+        )
+        self.assertEqual(cache.hits, 1)
+        cache.close()
+
+    def test_ttl(self):
+        cache = ResponseCache(self.path, ttls={"search_recordings": -1})
+        cache.put("search_recordings", (), {"query": "cool"}, {"recording-list": []})
+        cache.put("get_recording_by_id", ("rec-1",), {}, {"recording": {}})
+
+        self.assertIsNone(cache.get("search_recordings", (), {"query": "cool"}))
+        self.assertIsNotNone(cache.get("get_recording_by_id", ("rec-1",), {}))
+        cache.close()
+
+    def test_eviction(self):
+        cache = ResponseCache(self.path, max_bytes=250)
+
+        for i in range(10):
+            cache.put("get_release_by_id", (f"release-{i}",), {}, {"title": "x" * 50})
+
+        self.assertLessEqual(cache.total_bytes, 250)
+        # The oldest responses are evicted first
+        self.assertIsNone(cache.get("get_release_by_id", ("release-0",), {}))
+        self.assertIsNotNone(cache.get("get_release_by_id", ("release-9",), {}))
+        cache.close()
+
+    def test_scheduler_cached_call(self):
+        calls = []
+
+        def get_release_by_id(release_id, includes=[]):
+            calls.append(release_id)
+            return {"release": {"id": release_id}}
+
+        scheduler = RequestScheduler(
+            rate=1000.0, response_cache=ResponseCache(self.path)
+        )
+
+        # Fifteen tracks from the same album only fetch the album once
+        for _ in range(15):
+            result = scheduler.cached_call(
+                "get_release_by_id", get_release_by_id, "release-1", includes=["x"]
+            )
+            self.assertEqual(result["release"]["id"], "release-1")
+
+        self.assertEqual(calls, ["release-1"])
+        scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import musicbrainzngs
+
+from beetsplug.scheduler import RequestScheduler, TokenBucket
+
+RECORDING_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#">
+  <recording id="{mbid}">
+    <title>Recording {mbid}</title>
+    <length>180000</length>
+  </recording>
+</metadata>
+"""
+
+
+class StubMusicBrainzHandler(BaseHTTPRequestHandler):
+    """Answers recording lookups like the MusicBrainz web service would."""
+
+    request_times: list[float] = []
+
+    def do_GET(self):
+        StubMusicBrainzHandler.request_times.append(time.monotonic())
+        mbid = self.path.split("?")[0].rstrip("/").split("/")[-1]
+        body = RECORDING_XML.format(mbid=mbid).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubMusicBrainzServer:
+    def __enter__(self):
+        StubMusicBrainzHandler.request_times = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubMusicBrainzHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        host, port = self.server.server_address
+        musicbrainzngs.set_useragent("Beets-Rating-Sync-Test", "0.1b")
+        musicbrainzngs.set_hostname(f"{host}:{port}", use_https=False)
+        # The scheduler is responsible for rate limiting in these tests
+        musicbrainzngs.set_rate_limit(False)
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        musicbrainzngs.set_hostname("musicbrainz.org", use_https=True)
+        musicbrainzngs.set_rate_limit(limit_or_interval=1.0, new_requests=1)
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=20.0, capacity=1)
+
+        start = time.perf_counter()
+        for _ in range(5):
+            bucket.acquire()
+        runtime = time.perf_counter() - start
+
+        # The first token is available immediately, the rest are rate limited
+        self.assertGreaterEqual(runtime, 4 / 20.0 * 0.9)
+        self.assertGreater(bucket.sleep_time, 0)
+
+    def test_scheduler_against_stub_server(self):
+        rate = 20.0
+        mbids = [f"00000000-0000-0000-0000-{i:012d}" for i in range(10)]
+        scheduler = RequestScheduler(rate=rate, max_workers=4)
+
+        def lookup(mbid):
+            result = scheduler.call(
+                "get_recording_by_id", musicbrainzngs.get_recording_by_id, mbid
+            )
+            return result["recording"]["id"]
+
+        with StubMusicBrainzServer():
+            results = scheduler.map(lookup, mbids)
+        scheduler.shutdown()
+
+        self.assertEqual(results, mbids)
+
+        # No two requests may be closer together than the rate limit allows
+        request_times = sorted(StubMusicBrainzHandler.request_times)
+        self.assertEqual(len(request_times), len(mbids))
+        gaps = [b - a for a, b in zip(request_times, request_times[1:])]
+        self.assertGreaterEqual(min(gaps), (1 / rate) * 0.8)
+
+
+if __name__ == "__main__":
+    unittest.main()
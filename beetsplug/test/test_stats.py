@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import unittest
+
+from beetsplug.rate_limit_log import log_rate_limited_call
+from beetsplug.scheduler import TokenBucket
+from beetsplug.stats import SyncStats, get_stats, set_stats
+
+
+class TestSyncStats(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_stats()
+        self.stats = SyncStats()
+        set_stats(self.stats)
+
+    def tearDown(self):
+        set_stats(self.previous)
+
+    def test_phases(self):
+        with self.stats.phase("import:Test") as phase:
+            log_rate_limited_call("search_recordings")
+            log_rate_limited_call("search_recordings")
+            log_rate_limited_call("get_album", "lastfm")
+            self.stats.record_library_query()
+            self.stats.record_cache("track_cache", True)
+            self.stats.record_cache("track_cache", False)
+            self.stats.record_cache("track_cache", True)
+
+            # The second token has to wait for the bucket to refill
+            bucket = TokenBucket(rate=100.0)
+            bucket.acquire()
+            bucket.acquire()
+
+        # Work outside of a phase is counted separately
+        self.stats.record_library_query()
+
+        self.assertEqual(
+            phase.calls,
+            {"musicbrainz.search_recordings": 2, "lastfm.get_album": 1},
+        )
+        self.assertEqual(phase.library_queries, 1)
+        self.assertGreater(phase.sleep_time, 0)
+        self.assertGreaterEqual(phase.wall_time, phase.sleep_time)
+        self.assertEqual(self.stats.other.library_queries, 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stats.json")
+            self.stats.write(path)
+
+            with open(path) as f:
+                report = json.load(f)
+
+        phases = {phase["name"]: phase for phase in report["phases"]}
+        self.assertEqual(list(phases), ["import:Test", "other"])
+        self.assertEqual(
+            phases["import:Test"]["caches"]["track_cache"],
+            {"hits": 2, "misses": 1, "hit_rate": 0.667},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,23 @@
+import json
+import logging
 import os
 import pathlib
+import tempfile
 import unittest
+from unittest import mock
 
 from beetsplug.exporter.csv_exporter import CSVExporter
 from beetsplug.importer.csv_importer import CSVImporter
-from beetsplug.rating_store import (RatingStore, RatingStoreExporter,
-                                    RatingStoreImporter)
+from beetsplug.rating_store import (
+    ColumnarRatingStore,
+    RatingStore,
+    RatingStoreExporter,
+    RatingStoreImporter,
+)
 from beetsplug.recording import RecordingInfo
 
+ONE_LAST_TIME = "5bd67e8b-3a7a-4302-9408-5277f6c0620b"
+
 
 class MockMBRatingCollectionImporter(RatingStoreImporter):
     def import_songs(self, rating_store: RatingStore):
@@ -66,8 +76,10 @@ class TestSync(unittest.TestCase):
         output_file = f"{current_dir}/test_rating_generated.csv"
 
         # Delete the output file and start from scratch
-        if os.path.exists(output_file):
-            os.remove(output_file)
+        for path in [output_file, f"{output_file}.sha256"]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.addCleanup(os.remove, f"{output_file}.sha256")
 
         self.assertTrue(os.path.exists(input_file))
 
@@ -103,3 +115,197 @@ class TestSync(unittest.TestCase):
         # The file should have 6 lines including the header
         with open(output_file, "r") as file:
             self.assertEqual(len(file.readlines()), 6)
+
+    def import_all(self, rating_store: RatingStore):
+        current_dir = pathlib.Path(__file__).parent.resolve()
+        importers: list[RatingStoreImporter] = [
+            CSVImporter(f"{current_dir}/test_ratings.csv"),
+            MockLastFMImporter(),
+            MockMBRatingCollectionImporter(),
+        ]
+
+        for importer in importers:
+            importer.import_songs(rating_store)
+
+    def check_columnar(self):
+        expected = RatingStore()
+        self.import_all(expected)
+        store = ColumnarRatingStore()
+        self.import_all(store)
+
+        self.assertEqual(set(store.rating_set_all), expected.rating_set_all)
+        self.assertEqual(store.rating_sets, expected.rating_sets)
+        for rating_set in ["mb", "lastfm", "csv", "missing"]:
+            self.assertEqual(
+                store.get_missing_ratings_for_set(rating_set),
+                expected.get_missing_ratings_for_set(rating_set),
+            )
+
+        self.assertEqual(store.get_conflicts(), expected.get_conflicts())
+        # The CSV and MusicBrainz ratings of One Last Time disagree
+        self.assertEqual(len(store.get_conflicts()), 1)
+        self.assertEqual(
+            store.get_rating_differences("csv", "mb"),
+            expected.get_rating_differences("csv", "mb"),
+        )
+
+        store.mark_complete("mb")
+        self.assertEqual(store.get_missing_ratings_for_set("mb"), set())
+
+    def test_columnar_store(self):
+        self.check_columnar()
+
+    def test_columnar_store_without_numpy(self):
+        with mock.patch("beetsplug.rating_store.numpy", None):
+            self.check_columnar()
+
+    def test_conflict_report(self):
+        logger = mock.Mock()
+        rating_store = RatingStore(logger, logging.INFO)
+        self.import_all(rating_store)
+
+        # One Last Time is rated 4 in the CSV file and 3 in MusicBrainz, while
+        # the Last.fm rating never counts as a conflict
+        self.assertEqual(list(rating_store.conflicts), [ONE_LAST_TIME])
+        self.assertEqual(
+            rating_store.conflicts[ONE_LAST_TIME].sources,
+            {"csv": 4, "lastfm": 3, "mb": 3},
+        )
+        self.assertEqual(rating_store.rating_counts[ONE_LAST_TIME], {4: 1, 3: 1})
+        logger.log.assert_called_once()
+        self.assertEqual(logger.log.call_args[0][0], logging.INFO)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "conflicts.json")
+            self.assertEqual(rating_store.write_conflict_report(path), 1)
+
+            with open(path) as f:
+                report = json.load(f)
+            self.assertEqual(report[0]["mbid"], ONE_LAST_TIME)
+            self.assertEqual(report[0]["sources"], {"csv": 4, "lastfm": 3, "mb": 3})
+
+            # The report from the last sync is removed once there are no conflicts
+            self.assertEqual(RatingStore().write_conflict_report(path), 0)
+            self.assertFalse(os.path.exists(path))
+
+    def test_conflicts_match_between_stores(self):
+        # (mbid, rating_set, rating) in the order they're added
+        ratings = [
+            ("one", "csv", 4),
+            ("one", "mb", 4),
+            # A higher MusicBrainz rating replaces the lower one
+            ("one", "mb", 5),
+            ("one", "mb", 3),
+            ("two", "mb", 4),
+            # Two star collections from the same source aren't a conflict
+            ("two", "mb", 5),
+            ("two", "lastfm", 3),
+            ("three", "csv", 2),
+            ("three", "mb", 3),
+            # The latest rating resolves the conflict
+            ("three", "mb", 2),
+        ]
+
+        results = []
+        for store_type in [RatingStore, ColumnarRatingStore]:
+            logger = mock.Mock()
+            store = store_type(logger)
+            for mbid, rating_set, rating in ratings:
+                recording = RecordingInfo("Artist", "", mbid, 0, mbid, rating)
+                store.add_rating(recording, rating_set, overwrite=True)
+
+            conflicts = {
+                mbid: conflict.sources for mbid, conflict in store.conflicts.items()
+            }
+            results.append((store.get_conflicts(), conflicts, logger.log.call_count))
+            if store_type is RatingStore:
+                store_counts = store.rating_counts
+
+        self.assertEqual(results[0], results[1])
+        # Only the latest rating from each source is counted
+        self.assertEqual(
+            store_counts, {"one": {4: 1, 3: 1}, "two": {5: 1}, "three": {2: 2}}
+        )
+        self.assertEqual(results[0], ({"one"}, {"one": {"csv": 4, "mb": 3}}, 2))
+
+    def test_add_ratings(self):
+        current_dir = pathlib.Path(__file__).parent.resolve()
+        importer = CSVImporter(f"{current_dir}/test_ratings.csv")
+
+        for store_type in [RatingStore, ColumnarRatingStore]:
+            expected = store_type()
+            for recording in importer.read_recordings():
+                expected.add_rating(recording, "csv")
+
+            # A generator is added without building a list first
+            store = store_type()
+            self.assertEqual(store.add_ratings(importer.read_recordings(), "csv"), 3)
+            self.assertEqual(set(store.ratings), set(expected.ratings))
+            self.assertEqual(store.rating_sets, expected.rating_sets)
+
+            # Conflicts and overwrites work like they do for add_rating
+            conflict = RecordingInfo("Alesso", "", "One Last Time", 240, "", 1)
+            conflict.mbid = ONE_LAST_TIME
+            store.add_ratings(iter([conflict]), "mb", overwrite=True)
+            self.assertEqual(store.get_conflicts(), {ONE_LAST_TIME})
+            self.assertEqual(store.ratings[ONE_LAST_TIME].rating, 1)
+            self.assertEqual(
+                store.get_missing_ratings_for_set("mb"),
+                set(store.ratings) - {ONE_LAST_TIME},
+            )
+
+    def test_csv_chunks(self):
+        current_dir = pathlib.Path(__file__).parent.resolve()
+        rating_store = RatingStore()
+        CSVImporter(f"{current_dir}/test_ratings.csv", chunk_size=2).import_songs(
+            rating_store
+        )
+        MockLastFMImporter().import_songs(rating_store)
+        self.assertEqual(len(rating_store.ratings), 4)
+
+        # Sorting in runs gives the same file as sorting everything at once
+        with tempfile.TemporaryDirectory() as directory:
+            whole = os.path.join(directory, "whole.csv")
+            runs = os.path.join(directory, "runs.csv")
+            CSVExporter(whole).export_songs(rating_store)
+            CSVExporter(runs, chunk_size=1).export_songs(rating_store)
+
+            with open(whole) as whole_file, open(runs) as runs_file:
+                self.assertEqual(whole_file.read(), runs_file.read())
+
+            # A dry run doesn't write the file
+            dry_run = os.path.join(directory, "dry_run.csv")
+            exporter = CSVExporter(dry_run, dry_run=True)
+            exporter.export_songs(rating_store)
+            self.assertTrue(exporter.changed)
+            self.assertFalse(os.path.exists(dry_run))
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ["runs.csv", "runs.csv.sha256", "whole.csv", "whole.csv.sha256"],
+            )
+
+    def test_csv_export_unchanged(self):
+        rating_store = RatingStore()
+        MockLastFMImporter().import_songs(rating_store)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ratings.csv")
+            exporter = CSVExporter(path)
+            exporter.export_songs(rating_store)
+            self.assertTrue(exporter.changed)
+            modified = os.stat(path).st_mtime_ns
+
+            # The same ratings aren't written again
+            exporter.export_songs(rating_store)
+            self.assertFalse(exporter.changed)
+            self.assertEqual(os.stat(path).st_mtime_ns, modified)
+
+            MockMBRatingCollectionImporter().import_songs(rating_store)
+            exporter.export_songs(rating_store)
+            self.assertTrue(exporter.changed)
+
+            # A file that was changed since the last export is written again
+            with open(path, "a") as f:
+                f.write("edited\n")
+            exporter.export_songs(rating_store)
+            self.assertTrue(exporter.changed)
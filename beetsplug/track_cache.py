@@ -1,13 +1,21 @@
 import csv
 import os
+import pickle
+import sqlite3
+import sys
+import threading
 from pathlib import Path
 
 from .normalize import first_artist, normalize
 from .recording import RecordingInfo
+from .stats import get_stats
 
 
 class MBTrackCache:
-    def __init__(self, cache_file_path=None):
+    FIELD_NAMES = ["mbid", "artist", "title", "album", "length"]
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, cache_file_path=None, compact_threshold=1000, snapshot=True):
         # Create a default path if it doesn't exist
         # Should be $BEETSDIR/.mbcache/tracks.csv or ~/.mbcache/tracks.csv
         if cache_file_path is None:
@@ -16,66 +24,241 @@ class MBTrackCache:
             cache_file_path = os.path.join(beet_path, ".mbcache", "tracks.csv")
 
         self.cache_file_path = cache_file_path
+        # New entries are appended to the journal when saving. Once the journal
+        # has more than compact_threshold entries, it is merged into the cache file.
+        self.journal_file_path = f"{cache_file_path}.journal"
+        self.compact_threshold = compact_threshold
+        self.journal_size = 0
+        # Entries added or changed since the last save. Key: artist:title
+        self.dirty: dict[str, RecordingInfo] = {}
+        # Searches running on the scheduler's worker threads add entries at the
+        # same time, so adding and saving are guarded by a lock
+        self.lock = threading.Lock()
+        # The snapshot stores the loaded cache with its keys already built,
+        # so that loading an unchanged cache file skips normalization entirely
+        self.snapshot_file_path = f"{cache_file_path}.snapshot" if snapshot else None
+        self.snapshot_loaded = False
         self.cache, self.mbidCache = self.__load_cache(cache_file_path)
 
     def __load_cache(self, path):
         cache = {}
         mbidCache = {}
+        signature = self.__file_signature(path)
+
+        journal_rows = self.__load_snapshot(signature, cache, mbidCache)
+        self.snapshot_loaded = journal_rows is not None
+
+        if journal_rows is None:
+            journal_rows = 0
+            self.__read_rows(path, cache, mbidCache)
+
+        # Replay the journal after the cache file so newer entries take precedence.
+        # Rows already included in the snapshot are skipped.
+        self.journal_size = journal_rows + self.__read_rows(
+            self.journal_file_path, cache, mbidCache, journal_rows
+        )
+
+        # Update the snapshot if anything had to be normalized
+        if not self.snapshot_loaded or self.journal_size > journal_rows:
+            self.__save_snapshot(signature, cache, mbidCache)
+
+        return cache, mbidCache
+
+    def __read_rows(self, path, cache, mbidCache, skip=0) -> int:
+        """Reads all of the rows in a cache file into cache and mbidCache,
+        ignoring the first skip rows. Returns the number of rows read."""
+        count = 0
 
         # Cache file doesn't exist
         if not os.path.exists(path):
-            return cache
+            return count
 
         with open(path, newline="") as cache_file:
-            field_names = ["mbid", "artist", "title", "album", "length"]
-            reader = csv.DictReader(cache_file, fieldnames=field_names)
+            reader = csv.reader(cache_file)
 
             for row in reader:
-                # Skip if this is the header row
-                if row["mbid"] == "mbid":
+                # Skip blank lines and the header row
+                if not row or row[0] == "mbid":
+                    continue
+
+                if skip > 0:
+                    skip -= 1
                     continue
 
+                mbid, artist, title, album, length = row
                 recording = RecordingInfo(
-                    row["artist"],
-                    row["album"],
-                    row["title"],
-                    int(row["length"]),
-                    row["mbid"],
+                    sys.intern(artist), sys.intern(album), title, int(length), mbid
                 )
 
                 key = self.build_key(recording)
                 cache[key] = recording
-                mbidCache[row["mbid"]] = recording
+                mbidCache[mbid] = recording
+                count += 1
 
-        return cache, mbidCache
+        return count
+
+    def __file_signature(self, path):
+        if not os.path.exists(path):
+            return None
+
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def __load_snapshot(self, signature, cache, mbidCache) -> int | None:
+        """Loads the snapshot into cache and mbidCache if it matches the cache
+        file. Returns the number of journal rows included in the snapshot, or
+        None if the snapshot couldn't be used."""
+        if not self.snapshot_file_path or not os.path.exists(self.snapshot_file_path):
+            return None
+
+        try:
+            with open(self.snapshot_file_path, "rb") as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+
+            if (
+                snapshot["version"] != self.SNAPSHOT_VERSION
+                or snapshot["signature"] != signature
+                or snapshot["journal_rows"] > self.__count_rows(self.journal_file_path)
+            ):
+                return None
+
+            recordings = [
+                RecordingInfo(
+                    sys.intern(artist), sys.intern(album), title, length, mbid
+                )
+                for mbid, artist, title, album, length in snapshot["records"]
+            ]
+        except (OSError, EOFError, KeyError, ValueError, pickle.UnpicklingError):
+            return None
+
+        for key, index in snapshot["keys"].items():
+            cache[key] = recordings[index]
+        for mbid, index in snapshot["mbids"].items():
+            mbidCache[mbid] = recordings[index]
+
+        return snapshot["journal_rows"]
+
+    def __save_snapshot(self, signature, cache, mbidCache):
+        if not self.snapshot_file_path or signature is None:
+            return
+
+        # The same recording may be referenced by both dictionaries, so store
+        # each recording once and refer to it by index
+        records = []
+        indexes: dict[int, int] = {}
+
+        def index_of(recording: RecordingInfo) -> int:
+            if id(recording) not in indexes:
+                indexes[id(recording)] = len(records)
+                records.append(
+                    (
+                        recording.mbid,
+                        recording.artist,
+                        recording.title,
+                        recording.album,
+                        recording.length,
+                    )
+                )
+            return indexes[id(recording)]
+
+        snapshot = {
+            "version": self.SNAPSHOT_VERSION,
+            "signature": signature,
+            "journal_rows": self.journal_size,
+            "records": records,
+            "keys": {key: index_of(rec) for key, rec in cache.items()},
+            "mbids": {mbid: index_of(rec) for mbid, rec in mbidCache.items()},
+        }
+
+        temp_path = f"{self.snapshot_file_path}.tmp"
+        try:
+            with open(temp_path, "wb") as snapshot_file:
+                pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.snapshot_file_path)
+        except OSError:
+            # The snapshot is only an optimization, the cache file is still valid
+            pass
+
+    def __count_rows(self, path) -> int:
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, newline="") as journal_file:
+            return sum(1 for _ in csv.reader(journal_file))
 
     def save(self, path=None):
+        with self.lock:
+            self.__save(path)
+
+    def __save(self, path=None):
+        # Saving to another location always writes the entire cache
+        if path and path != self.cache_file_path:
+            self.write_cache(path)
+            return
+
+        # Nothing changed since the last save
+        if len(self.dirty) == 0:
+            return
+
+        if (
+            not os.path.exists(self.cache_file_path)
+            or self.journal_size + len(self.dirty) > self.compact_threshold
+        ):
+            self.compact()
+            return
+
+        with open(self.journal_file_path, "a", newline="") as journal_file:
+            writer = csv.DictWriter(journal_file, fieldnames=self.FIELD_NAMES)
+
+            for recording in self.dirty.values():
+                writer.writerow(self.__to_row(recording))
+
+        self.journal_size += len(self.dirty)
+        self.dirty.clear()
+
+    def compact(self):
+        """Rewrites the cache file with every entry and removes the journal."""
+        self.write_cache(self.cache_file_path)
+
+        if os.path.exists(self.journal_file_path):
+            os.remove(self.journal_file_path)
+
+        self.journal_size = 0
+        self.dirty.clear()
+
+    def write_cache(self, path):
         # Don't write empty files
         if len(self.cache.keys()) == 0:
             return
 
-        # Use the default path location if it isn't provided
-        if not path:
-            path = self.cache_file_path
+        # Create the cache directory if necessary
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
 
-        with open(path, "w", newline="") as cache_file:
-            field_names = ["mbid", "artist", "title", "album", "length"]
-            writer = csv.DictWriter(cache_file, fieldnames=field_names)
+        # Write to a temporary file first and then rename it so that the cache
+        # file is never left partially written
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", newline="") as cache_file:
+            writer = csv.DictWriter(cache_file, fieldnames=self.FIELD_NAMES)
             writer.writeheader()
 
             recordings = list(self.cache.values())
             recordings = sorted(recordings, key=lambda x: x.artist)
 
             for recording in recordings:
-                writer.writerow(
-                    {
-                        "mbid": recording.mbid,
-                        "artist": recording.artist,
-                        "title": recording.title,
-                        "album": recording.album,
-                        "length": recording.length,
-                    }
-                )
+                writer.writerow(self.__to_row(recording))
+
+        os.replace(temp_path, path)
+
+    def __to_row(self, recording: RecordingInfo):
+        return {
+            "mbid": recording.mbid,
+            "artist": recording.artist,
+            "title": recording.title,
+            "album": recording.album,
+            "length": recording.length,
+        }
 
     # Note that the key is artist:title
     # We do not specify the album because it isn't always available
@@ -88,15 +271,177 @@ class MBTrackCache:
         return key
 
     def add(self, info: RecordingInfo):
+        # Many tracks share an artist and album, so the cache keeps a single
+        # copy of each name
+        info.artist = sys.intern(info.artist)
+        info.album = sys.intern(info.album)
         key = self.build_key(info)
-        self.cache[key] = info
+
+        with self.lock:
+            existing = self.cache.get(key, None)
+
+            # Adding an identical copy of an existing entry doesn't need to be
+            # saved. If it is the same object, it may have been modified, so save
+            # it anyway.
+            if (
+                existing is not None
+                and existing is not info
+                and self.__to_row(existing) == self.__to_row(info)
+            ):
+                return
+
+            self.cache[key] = info
+            self.dirty[key] = info
 
     def get(
         self, artist: str, title: str, album: str | None = None
     ) -> RecordingInfo | None:
         key = self.build_key(RecordingInfo(artist, album, title, 0, ""))
         result = self.cache.get(key, None)
+        get_stats().record_cache("track_cache", result is not None)
+        return result
+
+    def getByMBID(self, mbid: str) -> RecordingInfo | None:
+        result = self.mbidCache.get(mbid, None)
+        get_stats().record_cache("track_cache", result is not None)
         return result
 
+
+class SQLiteTrackCache(MBTrackCache):
+    """A track cache stored in an SQLite database instead of a CSV file. Lookups
+    are made against the database as needed instead of loading everything into
+    memory, and saving only writes the entries that were added since the last save.
+
+    If the database doesn't exist yet, it is created from the CSV cache file at
+    csv_file_path, if one exists."""
+
+    def __init__(self, cache_file_path=None, csv_file_path=None):
+        # Should be $BEETSDIR/.mbcache/tracks.db or ~/.mbcache/tracks.db
+        if cache_file_path is None:
+            home = str(Path.home())
+            beet_path = os.getenv("BEETSDIR", default=home)
+            cache_file_path = os.path.join(beet_path, ".mbcache", "tracks.db")
+
+        if csv_file_path is None:
+            csv_file_path = os.path.join(os.path.dirname(cache_file_path), "tracks.csv")
+
+        self.cache_file_path = cache_file_path
+        # Entries added since the last save. Key: artist:title, Value: RecordingInfo
+        self.cache: dict[str, RecordingInfo] = {}
+        # Key: mbid, Value: RecordingInfo
+        self.mbidCache: dict[str, RecordingInfo] = {}
+
+        migrate = not os.path.exists(cache_file_path)
+        # Lookups may be made from the scheduler's worker threads, so the
+        # connection is shared between threads and guarded by a lock
+        self.connection = sqlite3.connect(cache_file_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.__create_tables()
+
+        if migrate and os.path.exists(csv_file_path):
+            self.__migrate(csv_file_path)
+
+    def __create_tables(self):
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "mbid TEXT PRIMARY KEY, key TEXT NOT NULL, artist TEXT, "
+                "title TEXT, album TEXT, length INTEGER)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS tracks_key ON tracks (key)"
+            )
+
+    def __migrate(self, csv_file_path):
+        csv_cache = MBTrackCache(csv_file_path)
+
+        for recording in csv_cache.mbidCache.values():
+            self.add(recording)
+
+        self.save()
+        print(
+            f"Migrated {len(csv_cache.mbidCache)} cached tracks from "
+            f"{csv_file_path} to {self.cache_file_path}."
+        )
+
+    def __to_recording(self, row) -> RecordingInfo | None:
+        if row is None:
+            return None
+
+        mbid, artist, title, album, length = row
+        return RecordingInfo(artist, album, title, length, mbid)
+
+    def save(self, path=None):
+        with self.lock:
+            # Nothing was added since the last save
+            if len(self.mbidCache) == 0:
+                return
+
+            rows = [
+                (
+                    recording.mbid,
+                    self.build_key(recording),
+                    recording.artist,
+                    recording.title,
+                    recording.album,
+                    recording.length,
+                )
+                for recording in self.mbidCache.values()
+            ]
+
+            # Replacing a row gives it a new rowid, so the most recently added
+            # recording for a key always has the highest rowid
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO tracks "
+                    "(mbid, key, artist, title, album, length) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+            self.cache.clear()
+            self.mbidCache.clear()
+
+    def close(self):
+        self.save()
+        self.connection.close()
+
+    def add(self, info: RecordingInfo):
+        key = self.build_key(info)
+
+        with self.lock:
+            self.cache[key] = info
+            self.mbidCache[info.mbid] = info
+
+    def get(
+        self, artist: str, title: str, album: str | None = None
+    ) -> RecordingInfo | None:
+        key = self.build_key(RecordingInfo(artist, album, title, 0, ""))
+
+        result = self.cache.get(key, None)
+        if result:
+            get_stats().record_cache("track_cache", True)
+            return result
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mbid, artist, title, album, length FROM tracks "
+                "WHERE key = ? ORDER BY rowid DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+        get_stats().record_cache("track_cache", row is not None)
+        return self.__to_recording(row)
+
     def getByMBID(self, mbid: str) -> RecordingInfo | None:
-        return self.mbidCache.get(mbid, None)
+        result = self.mbidCache.get(mbid, None)
+        if result:
+            get_stats().record_cache("track_cache", True)
+            return result
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mbid, artist, title, album, length FROM tracks WHERE mbid = ?",
+                (mbid,),
+            ).fetchone()
+        get_stats().record_cache("track_cache", row is not None)
+        return self.__to_recording(row)
@@ -1,9 +1,12 @@
+import threading
+
 import musicbrainzngs
 import unidecode
 from beets import dbcore
 from thefuzz import fuzz
 
-from .mb_user import log_rate_limited_call
+from .library_index import LibraryIndex
+from .negative_cache import NegativeCache
 from .normalize import (
     first_artist,
     force_titlecase,
@@ -12,17 +15,40 @@ from .normalize import (
     remove_quoted_text,
 )
 from .recording import MBRecording, RecordingInfo
+from .scheduler import get_scheduler
+from .search_plan import SearchBudget, SearchBudgetExceeded, SearchPlan, SearchQuery
+from .stats import get_stats
 from .track_cache import MBTrackCache
 
+# Searches run on several worker threads, so each line of progress output is
+# written while holding this lock
+output_lock = threading.Lock()
+
+
+def print_progress(message: str):
+    with output_lock:
+        print(message)
+
 
 class LibraryTrackFinder:
-    def __init__(self, library, library_only=False, cache: MBTrackCache | None = None):
+    def __init__(
+        self,
+        library,
+        library_only=False,
+        cache: MBTrackCache | None = None,
+        index: LibraryIndex | None = None,
+        negative_cache: NegativeCache | None = None,
+        search_plan: SearchPlan | None = None,
+    ):
         self.library = library
         self.library_only = library_only
         self.cache = cache
+        # If an index is provided, all library lookups are resolved in memory
+        # instead of issuing a query against the library for each track
+        self.index = index
 
         # Initialize a single intstance of MBTrackFinder we can reuse for non-library lookups
-        self.mb_track_finder = MBTrackFinder(self.cache)
+        self.mb_track_finder = MBTrackFinder(self.cache, negative_cache, search_plan)
 
     def findByMBID(self, mbid: str) -> RecordingInfo | None:
         # Return the cached value if it exists
@@ -31,8 +57,12 @@ class LibraryTrackFinder:
             if result:
                 return result
 
-        query = dbcore.MatchQuery("mb_trackid", mbid)
-        songs = self.library.items(query)
+        if self.index:
+            songs = self.index.get_by_mbid(mbid)
+        else:
+            query = dbcore.MatchQuery("mb_trackid", mbid)
+            get_stats().record_library_query()
+            songs = self.library.items(query)
 
         if len(songs) == 1:
             song = songs[0]
@@ -75,19 +105,29 @@ class LibraryTrackFinder:
         length_lower = length - allowed_variance
         length_upper = length + allowed_variance
 
-        andQuery = dbcore.AndQuery(
-            [
-                dbcore.query.SubstringQuery("title", remove_quoted_text(title)),
-                dbcore.query.NumericQuery("length", f"{length_lower}..{length_upper}"),
+        if self.index:
+            search_title = remove_quoted_text(title).lower()
+            songs = [
+                song
+                for song in self.index.get_by_length(length_lower, length_upper)
+                if search_title in song.title.lower()
             ]
-        )
-
-        songs = self.library.items(andQuery)
+        else:
+            andQuery = dbcore.AndQuery(
+                [
+                    dbcore.query.SubstringQuery("title", remove_quoted_text(title)),
+                    dbcore.query.NumericQuery(
+                        "length", f"{length_lower}..{length_upper}"
+                    ),
+                ]
+            )
+            get_stats().record_library_query()
+            songs = self.library.items(andQuery)
 
         # Initialize song to None since we have not found a song yet
         song = None
         if len(songs) == 1:
-            song = songs.get()
+            song = songs[0]
         else:
             for each_song in songs:
                 # This was a bad match, skip it
@@ -108,6 +148,37 @@ class LibraryTrackFinder:
             else None
         )
 
+    def query_songs(self, normalized_artist, normalized_title, normalized_album=None):
+        """Finds all of the songs in the library where the artist, title and album
+        (if provided) contain the given strings."""
+        search_title = remove_quoted_text(normalized_title)
+        search_album = (
+            remove_quoted_text(normalized_album) if normalized_album else None
+        )
+
+        if not self.index:
+            subqueries = [
+                dbcore.query.SubstringQuery("title", search_title),
+                dbcore.query.SubstringQuery("artist", normalized_artist),
+            ]
+            if search_album:
+                subqueries.append(dbcore.query.SubstringQuery("album", search_album))
+
+            get_stats().record_library_query()
+            return self.library.items(dbcore.AndQuery(subqueries))
+
+        # Match the library query above: every field is a case insensitive
+        # substring match, and the artist narrows down the candidates
+        search_title = search_title.lower()
+        search_album = search_album.lower() if search_album else None
+
+        return [
+            song
+            for song in self.index.get_by_artist(normalized_artist)
+            if search_title in song.title.lower()
+            and (not search_album or search_album in song.album.lower())
+        ]
+
     def find(self, artist, title, album=None) -> RecordingInfo | None:
         # Return the cached value if it exists
         if self.cache:
@@ -126,29 +197,11 @@ class LibraryTrackFinder:
         # We want to broaden the search if album and title are the same
         if album and album != title:
             album = normalize(album)
-
-            query = dbcore.AndQuery(
-                [
-                    dbcore.query.SubstringQuery(
-                        "title", remove_quoted_text(normalized_title)
-                    ),
-                    dbcore.query.SubstringQuery("artist", normalized_artist),
-                    dbcore.query.SubstringQuery("album", remove_quoted_text(album)),
-                ]
-            )
-            songs = self.library.items(query)
+            songs = self.query_songs(normalized_artist, normalized_title, album)
 
         # The album was not provided or we searched with the album and got no results
         if not album or len(songs) == 0:
-            query = dbcore.AndQuery(
-                [
-                    dbcore.query.SubstringQuery(
-                        "title", remove_quoted_text(normalized_title)
-                    ),
-                    dbcore.query.SubstringQuery("artist", normalized_artist),
-                ]
-            )
-            songs = self.library.items(query)
+            songs = self.query_songs(normalized_artist, normalized_title)
 
         correct_song = None
         for song in songs:
@@ -205,10 +258,37 @@ class LibraryTrackFinder:
             else:
                 return None
 
+    def find_all(self, queries) -> list[RecordingInfo | None]:
+        """Finds many tracks at once. Each query is an (artist, title, album)
+        tuple. Returns the results in the same order as the queries."""
+        # Load the index before the lookups fan out to the worker threads
+        if self.index:
+            self.index.ensure_loaded()
+
+        return get_scheduler().map(lambda query: self.find(*query), queries)
+
 
 class MBTrackFinder:
-    def __init__(self, cache: MBTrackCache | None = None):
+    def __init__(
+        self,
+        cache: MBTrackCache | None = None,
+        negative_cache: NegativeCache | None = None,
+        search_plan: SearchPlan | None = None,
+    ):
         self.cache = cache
+        # Searches that previously failed are skipped until their retry time
+        self.negative_cache = negative_cache
+        # Key: (artist, release, strict), Value: release group search results
+        self.release_group_searches: dict[tuple[str, str, bool], list] = {}
+        # The stages used to search for a track, in order
+        self.search_plan = search_plan if search_plan else SearchPlan()
+
+    def find_all(self, queries) -> list[RecordingInfo | None]:
+        """Finds many tracks at once. Each query is an (artist, title, album)
+        tuple. The searches run on the scheduler's worker threads, so one
+        search can do its matching while another waits on the rate limit.
+        Returns the results in the same order as the queries."""
+        return get_scheduler().map(lambda query: self.find(*query), queries)
 
     def findByMBID(self, mbid) -> RecordingInfo | None:
         # Return the cached value if it exists
@@ -217,9 +297,11 @@ class MBTrackFinder:
             if result:
                 return result
 
-        log_rate_limited_call("get_recording_by_id")
-        recordings = musicbrainzngs.get_recording_by_id(
-            mbid, includes=["artists", "releases"]
+        recordings = get_scheduler().cached_call(
+            "get_recording_by_id",
+            musicbrainzngs.get_recording_by_id,
+            mbid,
+            includes=["artists", "releases"],
         )
 
         if len(recordings) == 1:
@@ -254,63 +336,135 @@ class MBTrackFinder:
             if result:
                 return result
 
+        # We failed to find this track recently, don't search again yet
+        original_args = (artist, title, album)
+        if self.negative_cache:
+            skip = not self.negative_cache.should_retry(*original_args)
+            get_stats().record_cache("negative_cache", skip)
+            if skip:
+                return None
+
         # If album is None we just use the title
         album = title if not album else album
-        track = None
-        print("Searching for %s - %s " % (artist, title), end="")
+        # Each search prints a single line once it's done, so that the output of
+        # searches running at the same time doesn't get mixed up
+        progress = "Searching for %s - %s" % (artist, title)
 
         # Normalize the strings
         title = normalize(title)
         artist = unidecode.unidecode(artist)
 
-        search_args = {
-            "artist": artist.lower().strip(),
-            "release": album.lower().strip(),
-        }
-
-        track = self.mb_search_releases(search_args, title)
-
-        # We didn't get a result searching by album, but album and title are
-        # different so try just searching with the title
-        if not track and album != title:
-            search_args["release"] = title.lower().strip()
-            track = self.mb_search_releases(search_args, title)
+        try:
+            track = self.run_search_plan(
+                artist.lower().strip(), album.lower().strip(), title
+            )
+        except SearchBudgetExceeded as e:
+            # The search was cut short, so we don't know that the track can't
+            # be found. Don't back off, try again on the next sync.
+            print_progress(f"{progress} (search stopped: {e})")
+            return None
 
-        # We still haven't found a track, try a recording search
-        if not track:
-            track = self.mb_search_recordings(search_args, title)
+        if track:
+            print_progress("%s (%s,%s)" % (progress, track.mbid, track.length))
+        else:
+            print_progress(f"{progress} (not found)")
 
         # We got a result, store it in the cache
         if track and self.cache:
             self.cache.add(track)
 
+        if self.negative_cache:
+            if track:
+                self.negative_cache.record_success(*original_args)
+            else:
+                self.negative_cache.record_failure(*original_args)
+
         return track
 
+    def run_search_plan(self, artist: str, album: str, title: str):
+        """Runs each stage of the search plan in order until the track is found.
+        Returns None if no stage found the track, and raises
+        SearchBudgetExceeded if the call budget or deadline for this track was
+        used up before every stage had run."""
+        budget = self.search_plan.create_budget()
+        completed: set[tuple] = set()
+        # Releases that were already fetched and rejected for this title
+        examined: set[str] = set()
+
+        for stage in self.search_plan.stages:
+            query = self.search_plan.build_query(stage, artist, album, title)
+
+            # Don't repeat a search that an earlier stage already made, such as
+            # searching by title when the album and the title are the same
+            search_key = (stage.kind, stage.strict, query.artist, query.release)
+            if stage.kind == "recordings":
+                search_key = (stage.kind, stage.strict, query.artist)
+            if search_key in completed:
+                continue
+            completed.add(search_key)
+
+            calls_before = budget.calls_used()
+            try:
+                if stage.kind == "releases":
+                    track = self.search_releases(query, stage.strict, examined, budget)
+                else:
+                    track = self.search_recordings(query, stage.strict, budget)
+            except SearchBudgetExceeded:
+                self.search_plan.record(
+                    stage, False, budget.calls_used() - calls_before
+                )
+                self.search_plan.record_budget_exceeded()
+                raise
+
+            self.search_plan.record(
+                stage, track is not None, budget.calls_used() - calls_before
+            )
+            if track:
+                return track
+
+        return None
+
+    def request(self, budget: SearchBudget | None, name, function, *args, **kwargs):
+        """Makes a cached, rate limited call if the budget allows it."""
+        if budget:
+            budget.check()
+
+        return get_scheduler().cached_call(name, function, *args, **kwargs)
+
     def mb_search_recordings(
         self, search_args, title: str, use_strict: bool = True
     ) -> RecordingInfo | None:
-        primary_artist = first_artist(search_args["artist"])
-        normalized_title = normalize(title)
+        """Searches for a recording with the artist in search_args, falling back
+        to a non-strict release search using the title."""
+        query = SearchQuery(search_args["artist"], title.lower().strip(), title)
+
+        track = self.search_recordings(query, use_strict)
+        if not track and use_strict:
+            track = self.search_releases(query, False)
+
+        return track
+
+    def search_recordings(
+        self, query: SearchQuery, use_strict: bool, budget: SearchBudget | None = None
+    ) -> RecordingInfo | None:
+        primary_artist = first_artist(query.artist)
+        normalized_title = normalize(query.title)
 
         # If we're searching for a recording, passing in a release
         # tends to mess up the results. Search based on the title and
         # artist only.
-        if "release" in search_args:
-            del search_args["release"]
-
-        log_rate_limited_call("search_recordings")
-        results = musicbrainzngs.search_recordings(
-            query=normalized_title, limit=10, strict=use_strict, **search_args
+        results = self.request(
+            budget,
+            "search_recordings",
+            musicbrainzngs.search_recordings,
+            query=normalized_title,
+            limit=10,
+            strict=use_strict,
+            artist=query.artist,
         )
 
-        # If there aren't any results, try again without strict
-        # If this wasn't strict then we won't find anything
         if not results:
-            return (
-                None
-                if not use_strict
-                else self.mb_search_recordings(search_args, title, False)
-            )
+            return None
 
         recordings = results["recording-list"]
 
@@ -374,7 +528,6 @@ class MBTrackFinder:
                 else:
                     length = 0
 
-                print("(%s,%s)" % (recording["id"], length))
                 return RecordingInfo(
                     recording["artist-credit-phrase"],
                     release["title"],
@@ -383,111 +536,184 @@ class MBTrackFinder:
                     recording["id"],
                 )
 
-        # If we didn't find a result, try again without strict
-        if use_strict:
-            return self.mb_search_releases(search_args, title, False)
-
         return None
 
+    def search_release_groups(
+        self, artist: str, release: str, use_strict: bool, budget=None
+    ) -> list:
+        """Searches for release groups, reusing the results of identical searches
+        made earlier in this run."""
+        key = (artist, release, use_strict)
+
+        if key not in self.release_group_searches:
+            results = self.request(
+                budget,
+                "search_release_groups",
+                musicbrainzngs.search_release_groups,
+                limit=10,
+                artist=artist,
+                release=release,
+                strict=use_strict,
+            )
+            self.release_group_searches[key] = results["release-group-list"]
+
+        return self.release_group_searches[key]
+
+    def rank_release_candidates(
+        self, release_groups: list, artist: str, title: str
+    ) -> list:
+        """Uses the information already present in the release group search
+        results to remove releases that can't match, before any release is
+        fetched. Returns the remaining releases in the order they should be
+        fetched."""
+        is_remix = "remix" in title
+
+        # Sort the releases by type so that we search albums first,
+        # then EPs, then singles
+        release_groups = sorted(release_groups, key=lambda k: k.get("type", "Unknown"))
+
+        candidates = []
+        seen = set()
+        for release_group in release_groups:
+            # If artist is not on this release group, none of its releases match
+            artist_credit = release_group.get("artist-credit-phrase", "").lower()
+            if artist_credit and artist not in artist_credit:
+                continue
+
+            releases = release_group.get("release-list", [])
+
+            # Prefer official releases within each release group
+            releases = sorted(
+                releases, key=lambda r: r.get("status", "Official") != "Official"
+            )
+
+            for release in releases:
+                if release["id"] in seen:
+                    continue
+                seen.add(release["id"])
+
+                # This is a remix release but we aren't searching for a remix
+                release_title = release.get("title", "").lower()
+                if "remix" in release_title and not is_remix:
+                    continue
+
+                candidates.append(release)
+
+        return candidates
+
     def mb_search_releases(
         self, search_args, title: str, use_strict: bool = True
     ) -> RecordingInfo | None:
-        artist = search_args["artist"].replace(" & ", "; ")
+        """Searches the releases by the artist in search_args for the title,
+        followed by a non-strict search if nothing was found."""
+        release = search_args.get("release", None)
+        query = SearchQuery(
+            search_args["artist"],
+            release if release else title.lower().strip(),
+            title,
+        )
+
+        # Releases rejected by the strict search are rejected by both searches
+        examined: set[str] = set()
+        track = self.search_releases(query, use_strict, examined)
+        if not track and use_strict:
+            track = self.search_releases(query, False, examined)
+
+        return track
+
+    def search_releases(
+        self,
+        query: SearchQuery,
+        use_strict: bool,
+        examined: set[str] | None = None,
+        budget: SearchBudget | None = None,
+    ) -> RecordingInfo | None:
+        artist = query.artist.replace(" & ", "; ")
         artist = artist.replace(", ", "; ")
         artists = artist.split("; ")
-        title = title.lower().strip()
-
-        # Make sure that release is present
-        if "release" not in search_args:
-            search_args["release"] = title.lower().strip()
+        title = query.title.lower().strip()
 
-        search_args["release"] = remove_feat(search_args["release"])
+        # Releases that were already fetched and rejected for this title
+        examined = examined if examined is not None else set()
 
-        log_rate_limited_call("search_release_groups")
-        results = musicbrainzngs.search_release_groups(
-            limit=10, **search_args, strict=use_strict
+        release_group_results = self.search_release_groups(
+            query.artist, remove_feat(query.release), use_strict, budget
         )
 
-        # Sort the releases by type so that we search albums first,
-        # then EPs, then singles
-        release_group_results = results["release-group-list"]
-        release_group_results = sorted(
-            release_group_results, key=lambda k: k.get("type", "Unknown")
+        candidates = self.rank_release_candidates(
+            release_group_results, artists[0].lower().strip(), title
         )
-        rg_count = len(release_group_results)
-
-        if rg_count == 0 and use_strict:
-            return self.mb_search_releases(search_args, title, False)
 
-        for release_group in release_group_results:
-            release_results = release_group["release-list"]
+        for release_result in candidates:
+            release_id = release_result["id"]
 
-            for release_result in release_results:
-                release_id = release_result["id"]
+            if release_id in examined:
+                continue
+            examined.add(release_id)
 
-                log_rate_limited_call("get_release_by_id")
-                release = musicbrainzngs.get_release_by_id(
-                    release_id, includes=["recordings", "artists"]
-                )
-
-                try:
-                    track_list = release["release"]["medium-list"][0]["track-list"]
-                    medium = release["release"]["medium-list"][0]["format"]
-
-                    # Ignore mediums such as vinyl.
-                    # We only want digital files or files from CDs
-                    if medium not in ["Digital Media", "CD"]:
-                        continue
+            release = self.request(
+                budget,
+                "get_release_by_id",
+                musicbrainzngs.get_release_by_id,
+                release_id,
+                includes=["recordings", "artists"],
+            )
 
-                    artist_credit = (
-                        release["release"]["artist-credit-phrase"].lower().strip()
-                    )
-                # If the medium or track list is missing, just skip this iteration
-                except (KeyError, IndexError):
-                    continue
+            try:
+                track_list = release["release"]["medium-list"][0]["track-list"]
+                medium = release["release"]["medium-list"][0]["format"]
 
-                # If artist is not on this release, skip it because it's wrong
-                # correct_artist = any(artist in artist_credit for artist in artists)
-                if artists[0].lower().strip() not in artist_credit:
+                # Ignore mediums such as vinyl.
+                # We only want digital files or files from CDs
+                if medium not in ["Digital Media", "CD"]:
                     continue
 
-                # This release group is a remix release group but we
-                # aren't searching for a remix
-                if (
-                    "remix" in release["release"]["title"].lower()
-                    or "remixes" in release["release"]["title"].lower()
-                ) and "remix" not in title:
-                    continue
+                artist_credit = (
+                    release["release"]["artist-credit-phrase"].lower().strip()
+                )
+            # If the medium or track list is missing, just skip this iteration
+            except (KeyError, IndexError):
+                continue
+
+            # If artist is not on this release, skip it because it's wrong
+            # correct_artist = any(artist in artist_credit for artist in artists)
+            if artists[0].lower().strip() not in artist_credit:
+                continue
+
+            # This release group is a remix release group but we
+            # aren't searching for a remix
+            if (
+                "remix" in release["release"]["title"].lower()
+                or "remixes" in release["release"]["title"].lower()
+            ) and "remix" not in title:
+                continue
+
+            for track in track_list:
+                candidate_title = track["recording"]["title"].lower().strip()
+                candidate_title_no_feat = remove_feat(candidate_title)
+                title_no_feat = remove_feat(title)
+
+                extended_candidate = "extended" in candidate_title_no_feat
+                extended_actual = "extended" in title_no_feat
+
+                # Check to see if the title is a fuzzy match. The first
+                # match is returned without fetching any other releases.
+                if fuzz.ratio(candidate_title_no_feat, title_no_feat) > 90 and (
+                    extended_actual == extended_candidate
+                ):
+                    # Load the length information if available
+                    if "length" in track["recording"]:
+                        length = int(track["recording"]["length"]) / 1000
+                        length = round(length)
+                    else:
+                        length = 0
+
+                    return RecordingInfo(
+                        release["release"]["artist-credit-phrase"],
+                        release["release"]["title"],
+                        track["recording"]["title"],
+                        length,
+                        track["recording"]["id"],
+                    )
 
-                for track in track_list:
-                    candidate_title = track["recording"]["title"].lower().strip()
-                    candidate_title_no_feat = remove_feat(candidate_title)
-                    title_no_feat = remove_feat(title)
-
-                    extended_candidate = "extended" in candidate_title_no_feat
-                    extended_actual = "extended" in title_no_feat
-
-                    # Check to see if the title is a fuzzy match
-                    if fuzz.ratio(candidate_title_no_feat, title_no_feat) > 90 and (
-                        extended_actual == extended_candidate
-                    ):
-                        # Load the length information if available
-                        if "length" in track["recording"]:
-                            length = int(track["recording"]["length"]) / 1000
-                            length = round(length)
-                        else:
-                            length = 0
-
-                        print("(%s,%s)" % (track["recording"]["id"], length))
-                        return RecordingInfo(
-                            release["release"]["artist-credit-phrase"],
-                            release["release"]["title"],
-                            track["recording"]["title"],
-                            length,
-                            track["recording"]["id"],
-                        )
-
-        # Try a non-strict search if we didn't find anything
-        return (
-            self.mb_search_releases(search_args, title, False) if use_strict else None
-        )
+        return None